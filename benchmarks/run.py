@@ -0,0 +1,245 @@
+"""
+Benchmark remotePathSync transfer and listing strategies against an in-process fake cluster.
+
+    python benchmarks/run.py --latency 20 --bandwidth 50 --output results.json
+    python benchmarks/run.py --quick --compare results.json
+
+Every (tree, strategy) pair runs on a fresh copy of a deterministic synthetic tree and reports wall
+time, exec round trips, channel opens, SFTP requests and bytes moved each way. Results are written
+as JSON tagged with the current commit, and --compare prints the change against an earlier run.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_here = Path(__file__).resolve().parent
+sys.path.insert(0, str(_here))
+sys.path.insert(0, str(_here.parent / "src"))
+# Keep the sync index, job history and learned compression state of benchmark runs out of the user's cache
+os.environ["REMOTEPATHSYNC_CACHE"] = tempfile.mkdtemp(prefix="rps-bench-cache-")
+
+from server import FakeCluster
+from trees import trees, tree_size
+from remotePathSync.pathroot import PathRoot
+from remotePathSync.pathrootpair import PathRootPair
+
+
+class BenchPair(PathRootPair):
+    """ Moves every file and never reuses state learned in earlier runs, so runs stay comparable """
+    exclude_fs_default = []
+    adaptive_compression = False
+    persist_job_history = False
+
+
+class Bench:
+    """ A fresh remote/local root pair for one measurement """
+
+    def __init__(self, cluster: FakeCluster, workdir: Path, tree: str):
+        self.cluster = cluster
+        self.tree = tree
+        self.remote_root = workdir / "remote"
+        self.local_root = workdir / "local"
+        for root in (self.remote_root, self.local_root):
+            shutil.rmtree(root, ignore_errors=True)
+            root.mkdir(parents=True)
+        local = PathRoot(self.local_root, None)
+        remote = PathRoot(self.remote_root, "127.0.0.1", username="bench", _ssh=cluster.connect())
+        self.pair = BenchPair(local, remote)
+        self.local_dir = self.local_root / tree
+        self.remote_dir = self.remote_root / tree
+
+    def close(self):
+        self.pair.remote.ssh.close()
+
+
+def _download(**kwargs):
+    def prepare(b: Bench, template: Path):
+        shutil.copytree(template, b.remote_dir)
+    def run(b: Bench):
+        b.pair.download_dir(b.local_dir, **kwargs)
+    return prepare, run, lambda b: (b.remote_dir, b.local_dir)
+
+
+def _upload(**kwargs):
+    def prepare(b: Bench, template: Path):
+        shutil.copytree(template, b.local_dir)
+    def run(b: Bench):
+        b.pair.upload_dir(b.local_dir, **kwargs)
+    return prepare, run, lambda b: (b.local_dir, b.remote_dir)
+
+
+def _update_unchanged(**kwargs):
+    def prepare(b: Bench, template: Path):
+        shutil.copytree(template, b.remote_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            b.pair.download_dir(b.local_dir, as_zip=False)
+    def run(b: Bench):
+        b.pair.update_dir_contents(b.local_dir, **kwargs)
+    return prepare, run, lambda b: (b.remote_dir, b.local_dir)
+
+
+def _listing(backend: str):
+    def prepare(b: Bench, template: Path):
+        shutil.copytree(template, b.remote_dir)
+        b.pair.remote.listing_backend = backend
+    def run(b: Bench):
+        for dirpath, _, _ in os.walk(b.remote_dir):
+            b.pair.remote.get_ls_l_file_info(Path(dirpath))
+    return prepare, run, None
+
+
+strategies = {
+    "download_zip": _download(as_zip=True),
+    "download_tar": _download(as_tar=True),
+    "download_files": _download(as_zip=False),
+    "download_manifest": _download(as_zip=False, manifest=True),
+    "download_hybrid": _download(hybrid=True),
+    "update_unchanged": _update_unchanged(),
+    "update_unchanged_manifest": _update_unchanged(manifest=True),
+    "upload_zip": _upload(as_zip=True),
+    "upload_tar": _upload(as_tar=True),
+    "upload_files": _upload(as_zip=False),
+    "upload_hybrid": _upload(hybrid=True),
+    "list_sftp": _listing("sftp"),
+    "list_ls": _listing("ls"),
+}
+
+
+def _sacct_jobs(n: int, workroot: str) -> list[dict]:
+    now = time.time()
+    states = ["COMPLETED", "COMPLETED", "COMPLETED", "TIMEOUT", "FAILED", "RUNNING", "PENDING"]
+    jobs = []
+    for i in range(n):
+        state = states[i % len(states)]
+        submit = now - (n - i) * 600
+        end = None if state in ("RUNNING", "PENDING") else submit + 300
+        jobs.append({"name": f"job {i}", "workdir": f"{workroot}/calc_{i % 500:03d}", "jobid": str(10000 + i), "state": state, "submit": submit, "end": end})
+    return jobs
+
+
+def bench_sacct(cluster: FakeCluster, workdir: Path, n_jobs: int) -> list[dict]:
+    """ Cold job history query, then a warm re-query after the refresh time (incremental poll) """
+    b = Bench(cluster, workdir, "jobs")
+    cluster.set_jobs(_sacct_jobs(n_jobs, str(b.remote_root)))
+    results = []
+    for name in ["sacct_cold", "sacct_incremental"]:
+        b.pair.job_store.refresh_time = 0
+        cluster.counters.reset()
+        start = time.perf_counter()
+        history = b.pair.get_slurm_job_history(days=60)
+        elapsed = time.perf_counter() - start
+        results.append({"tree": f"{n_jobs}_jobs", "strategy": name, "wall": elapsed, "files": sum(len(h) for h in history.values()), "bytes": 0, "ok": True, **cluster.counters.snapshot()})
+    b.close()
+    return results
+
+
+def same_tree(a: Path, b: Path) -> bool:
+    return tree_size(a) == tree_size(b)
+
+
+def run_one(cluster: FakeCluster, workdir: Path, template: Path, tree: str, strategy: str) -> dict:
+    prepare, run, compare = strategies[strategy]
+    b = Bench(cluster, workdir, tree)
+    with contextlib.redirect_stdout(io.StringIO()):
+        prepare(b, template)
+        cluster.counters.reset()
+        start = time.perf_counter()
+        run(b)
+        elapsed = time.perf_counter() - start
+    counts = cluster.counters.snapshot()
+    ok = True if compare is None else same_tree(*compare(b))
+    b.close()
+    n_files, n_bytes = tree_size(template)
+    return {"tree": tree, "strategy": strategy, "wall": elapsed, "files": n_files, "bytes": n_bytes, "ok": ok, **counts}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_here, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: list[dict], previous: dict | None = None):
+    before = {}
+    if not previous is None:
+        before = {(r["tree"], r["strategy"]): r for r in previous["results"]}
+    header = f"{'tree':<14}{'strategy':<28}{'wall s':>9}{'exec':>6}{'chan':>6}{'sftp':>7}{'MB up':>9}{'MB down':>9}"
+    if len(before):
+        header += f"{'vs prev':>9}"
+    print(header)
+    for r in results:
+        line = (
+            f"{r['tree']:<14}{r['strategy']:<28}{r['wall']:>9.3f}{r['exec']:>6}{r['channels']:>6}{r['sftp_requests']:>7}"
+            f"{r['bytes_up'] / 1e6:>9.2f}{r['bytes_down'] / 1e6:>9.2f}"
+        )
+        prev = before.get((r["tree"], r["strategy"]))
+        if not prev is None and prev["wall"] > 0:
+            line += f"{r['wall'] / prev['wall']:>8.2f}x"
+        if not r["ok"]:
+            line += "  MISMATCH"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", nargs="+", default=list(trees), choices=list(trees))
+    parser.add_argument("--strategies", nargs="+", default=list(strategies), choices=list(strategies))
+    parser.add_argument("--latency", type=float, default=20, help="one-way latency in ms")
+    parser.add_argument("--bandwidth", type=float, default=None, help="link bandwidth in MB/s (default unlimited)")
+    parser.add_argument("--jobs", type=int, default=5000, help="fake sacct history size (0 skips the sacct benchmark)")
+    parser.add_argument("--quick", action="store_true", help="small trees for a fast smoke run")
+    parser.add_argument("--output", type=Path, default=None, help="write results as JSON")
+    parser.add_argument("--compare", type=Path, default=None, help="JSON from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    workdir = Path(tempfile.mkdtemp(prefix="rps-bench-"))
+    bandwidth = None if args.bandwidth is None else args.bandwidth * 1e6
+    cluster = FakeCluster(str(workdir / "cluster"), latency=args.latency / 1000, bandwidth=bandwidth)
+    quick_args = {
+        "many_small": {"n_dirs": 5, "files_per_dir": 20},
+        "few_huge": {"n_files": 2, "size": 4 << 20},
+        "deep": {"depth": 4},
+        "mixed": {},
+    }
+    results = []
+    try:
+        for tree in args.trees:
+            template = workdir / "templates" / tree
+            trees[tree](template, **(quick_args[tree] if args.quick else {}))
+            for strategy in args.strategies:
+                results.append(run_one(cluster, workdir / "run", template, tree, strategy))
+        if args.jobs:
+            results += bench_sacct(cluster, workdir / "run", args.jobs if not args.quick else 500)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": {"latency_ms": args.latency, "bandwidth_MBps": args.bandwidth, "quick": args.quick},
+        "results": results,
+    }
+    previous = None
+    if not args.compare is None:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    if not args.output is None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+In-process stand-in for a cluster login node: a paramiko SSH server with exec and SFTP support,
+fake Slurm commands, and a link emulator adding latency and a bandwidth cap in front of it.
+"""
+from __future__ import annotations
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import queue
+import paramiko
+from paramiko import SFTPServerInterface, SFTPServer, SFTPAttributes, SFTPHandle, SFTP_OK, AUTH_SUCCESSFUL, OPEN_SUCCEEDED
+
+
+class Counters:
+    """ What the server saw: exec requests (round trips), channel opens, SFTP requests and bytes each way """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.values = {"exec": 0, "channels": 0, "sftp_requests": 0, "bytes_up": 0, "bytes_down": 0}
+
+    def add(self, key: str, n: int = 1):
+        with self._lock:
+            self.values[key] += n
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.values)
+
+
+class _Handle(SFTPHandle):
+    def stat(self):
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+def _sftp_interface(counters: Counters):
+    def errno_result(fn):
+        def wrapped(self, *args):
+            counters.add("sftp_requests")
+            try:
+                return fn(self, *args)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+        return wrapped
+
+    class SFTPInterface(SFTPServerInterface):
+        @errno_result
+        def list_folder(self, path):
+            out = []
+            for name in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+
+        @errno_result
+        def stat(self, path):
+            return SFTPAttributes.from_stat(os.stat(path))
+
+        @errno_result
+        def lstat(self, path):
+            return SFTPAttributes.from_stat(os.lstat(path))
+
+        @errno_result
+        def open(self, path, flags, attr):
+            fd = os.open(path, flags, 0o644)
+            if flags & os.O_WRONLY:
+                mode = "ab" if flags & os.O_APPEND else "wb"
+            elif flags & os.O_RDWR:
+                mode = "a+b" if flags & os.O_APPEND else "r+b"
+            else:
+                mode = "rb"
+            f = os.fdopen(fd, mode)
+            handle = _Handle(flags)
+            handle.filename = path
+            handle.readfile = f
+            handle.writefile = f
+            return handle
+
+        @errno_result
+        def remove(self, path):
+            os.remove(path)
+            return SFTP_OK
+
+        @errno_result
+        def rename(self, old, new):
+            os.rename(old, new)
+            return SFTP_OK
+
+        @errno_result
+        def posix_rename(self, old, new):
+            os.replace(old, new)
+            return SFTP_OK
+
+        @errno_result
+        def mkdir(self, path, attr):
+            os.mkdir(path)
+            return SFTP_OK
+
+        @errno_result
+        def rmdir(self, path):
+            os.rmdir(path)
+            return SFTP_OK
+
+        @errno_result
+        def chattr(self, path, attr):
+            if not attr.st_mtime is None:
+                os.utime(path, (attr.st_atime, attr.st_mtime))
+            return SFTP_OK
+
+    return SFTPInterface
+
+
+class _ServerInterface(paramiko.ServerInterface):
+
+    def __init__(self, counters: Counters, env: dict[str, str]):
+        self.counters = counters
+        self.env = env
+
+    def check_channel_request(self, kind, chanid):
+        self.counters.add("channels")
+        return OPEN_SUCCEEDED
+
+    def check_auth_password(self, username, password):
+        return AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_exec_request(self, channel, command):
+        self.counters.add("exec")
+        threading.Thread(target=_run_exec, args=(channel, command.decode(), self.env), daemon=True).start()
+        return True
+
+
+def _run_exec(channel, command: str, env: dict[str, str]):
+    proc = subprocess.Popen(
+        ["sh", "-c", command], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        )
+
+    def feed():
+        for data in iter(lambda: channel.recv(1 << 15), b""):
+            proc.stdin.write(data)
+            proc.stdin.flush()
+        proc.stdin.close()
+
+    def stderr():
+        for data in iter(lambda: proc.stderr.read1(1 << 15), b""):
+            channel.sendall_stderr(data)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    err = threading.Thread(target=stderr, daemon=True)
+    err.start()
+    for data in iter(lambda: proc.stdout.read1(1 << 15), b""):
+        channel.sendall(data)
+    status = proc.wait()
+    err.join()
+    channel.send_exit_status(status)
+    channel.close()
+
+
+def _pipe(src: socket.socket, dst: socket.socket, latency: float, bandwidth: float | None, counters: Counters, key: str):
+    """ Forward src -> dst, delivering each chunk latency seconds after it arrived and no faster than bandwidth """
+    line = queue.Queue()
+
+    def deliver():
+        free_at = 0.0
+        while True:
+            arrived, data = line.get()
+            if data is None:
+                break
+            # Latency is paid once per chunk in flight, serialization time queues up behind the previous chunk
+            send_at = max(arrived + latency, free_at)
+            if not bandwidth is None:
+                send_at += len(data) / bandwidth
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            free_at = send_at
+            try:
+                dst.sendall(data)
+            except OSError:
+                break
+            counters.add(key, len(data))
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    sender = threading.Thread(target=deliver, daemon=True)
+    sender.start()
+    try:
+        for data in iter(lambda: src.recv(1 << 16), b""):
+            line.put((time.monotonic(), data))
+    except OSError:
+        pass
+    line.put((time.monotonic(), None))
+
+
+class FakeCluster:
+    """
+    SSH/SFTP server on localhost behind a link emulator, with fake sacct/squeue/sbatch/scancel on its PATH.
+
+    The fake Slurm commands keep their jobs in <state_dir>/jobs.json: sbatch adds a PENDING job for
+    the current directory, and benchmarks can rewrite the table with set_jobs.
+    """
+
+    def __init__(self, state_dir: str, latency: float = 0.0, bandwidth: float | None = None):
+        self.state_dir = state_dir
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.counters = Counters()
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.bin_dir = os.path.join(state_dir, "bin")
+        self.jobs_file = os.path.join(state_dir, "jobs.json")
+        os.makedirs(self.bin_dir, exist_ok=True)
+        self._write_slurm_commands()
+        self.set_jobs([])
+        self.env = dict(os.environ, PATH=f"{self.bin_dir}{os.pathsep}{os.environ.get('PATH', '')}", FAKE_SLURM_JOBS=self.jobs_file)
+        self._server_sock = self._listen(self._serve)
+        self.port = self._listen(self._proxy).getsockname()[1]
+
+    @staticmethod
+    def _listen(handler) -> socket.socket:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        def accept():
+            while True:
+                conn, _ = sock.accept()
+                threading.Thread(target=handler, args=(conn,), daemon=True).start()
+        threading.Thread(target=accept, daemon=True).start()
+        return sock
+
+    def _serve(self, conn: socket.socket):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler("sftp", SFTPServer, _sftp_interface(self.counters))
+        transport.start_server(server=_ServerInterface(self.counters, self.env))
+
+    def _proxy(self, client: socket.socket):
+        server = socket.create_connection(self._server_sock.getsockname())
+        for sock in (client, server):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=_pipe, args=(client, server, self.latency, self.bandwidth, self.counters, "bytes_up"), daemon=True).start()
+        _pipe(server, client, self.latency, self.bandwidth, self.counters, "bytes_down")
+
+    def connect(self) -> paramiko.SSHClient:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect("127.0.0.1", self.port, "bench", "bench", allow_agent=False, look_for_keys=False)
+        return client
+
+    def set_jobs(self, jobs: list[dict]):
+        """ Replace the fake job table ({"name", "workdir", "jobid", "state", "submit", "end"}, times as epochs) """
+        with open(self.jobs_file, "w") as f:
+            json.dump(jobs, f)
+
+    def get_jobs(self) -> list[dict]:
+        with open(self.jobs_file, "r") as f:
+            return json.load(f)
+
+    def _write_slurm_commands(self):
+        python = sys.executable
+        for name, body in _slurm_commands.items():
+            path = os.path.join(self.bin_dir, name)
+            with open(path, "w") as f:
+                f.write(f"#!{python}\n{body}")
+            os.chmod(path, 0o755)
+
+
+_slurm_commands = {
+    "sacct": """
+import datetime, json, os, sys
+args = sys.argv[1:]
+start = datetime.datetime.strptime(args[args.index("-S") + 1], "%Y-%m-%dT%H:%M:%S").timestamp()
+jobs = json.load(open(os.environ["FAKE_SLURM_JOBS"]))
+out = []
+for j in jobs:
+    if j["end"] is None or j["end"] >= start or j["submit"] >= start:
+        end = "Unknown" if j["end"] is None else str(int(j["end"]))
+        out.append("|".join([j["name"], j["workdir"], str(j["jobid"]), j["state"], "00:01:00", str(int(j["submit"])), end]))
+sys.stdout.write("\\n".join(out) + ("\\n" if out else ""))
+""",
+    "squeue": """
+import json, os
+for j in json.load(open(os.environ["FAKE_SLURM_JOBS"])):
+    if j["state"] in ("PENDING", "RUNNING"):
+        print(f"{j['jobid']}|{j['state']}|{j['workdir']}")
+""",
+    "sbatch": """
+import fcntl, json, os, sys, time
+if len(sys.argv) < 2 or not os.path.isfile(sys.argv[-1]):
+    print(f"sbatch: error: Unable to open file {sys.argv[-1] if len(sys.argv) > 1 else ''}")
+    sys.exit(1)
+with open(os.environ["FAKE_SLURM_JOBS"], "r+") as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    jobs = json.load(f)
+    jobid = max([int(j["jobid"]) for j in jobs] + [1000]) + 1
+    jobs.append({"name": sys.argv[-1], "workdir": os.getcwd(), "jobid": str(jobid), "state": "PENDING", "submit": time.time(), "end": None})
+    f.seek(0)
+    f.truncate()
+    json.dump(jobs, f)
+print(f"Submitted batch job {jobid}")
+""",
+    "scancel": """
+import fcntl, json, os, sys, time
+with open(os.environ["FAKE_SLURM_JOBS"], "r+") as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    jobs = json.load(f)
+    for j in jobs:
+        if j["jobid"] in sys.argv[1:]:
+            j["state"] = "CANCELLED"
+            j["end"] = time.time()
+    f.seek(0)
+    f.truncate()
+    json.dump(jobs, f)
+""",
+}
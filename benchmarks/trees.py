@@ -0,0 +1,85 @@
+"""
+Deterministic synthetic directory trees shaped like calculation output.
+"""
+from __future__ import annotations
+import os
+import random
+from pathlib import Path
+
+
+def _text(rng: random.Random, size: int) -> bytes:
+    """ Compressible, log-like text of about size bytes """
+    lines = []
+    n = 0
+    while n < size:
+        line = f"iter {rng.randint(0, 9999):5d}  E = {rng.uniform(-200, 0):.10f}  |grad| = {rng.uniform(0, 1):.3e}\n"
+        lines.append(line)
+        n += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def _binary(rng: random.Random, size: int) -> bytes:
+    """ Incompressible data of size bytes (like wavefunctions and densities) """
+    return rng.randbytes(size)
+
+
+def many_small(root: Path, n_dirs: int = 40, files_per_dir: int = 50, size: int = 2048, seed: int = 0):
+    """ Many directories full of small text outputs """
+    rng = random.Random(seed)
+    for i in range(n_dirs):
+        d = Path(root) / f"calc_{i:03d}"
+        d.mkdir(parents=True, exist_ok=True)
+        for j in range(files_per_dir):
+            (d / f"out_{j:03d}.txt").write_bytes(_text(rng, size))
+
+
+def few_huge(root: Path, n_files: int = 3, size: int = 32 << 20, seed: int = 1):
+    """ A few large binaries next to a text log each """
+    rng = random.Random(seed)
+    for i in range(n_files):
+        d = Path(root) / f"big_{i}"
+        d.mkdir(parents=True, exist_ok=True)
+        (d / "wfns").write_bytes(_binary(rng, size))
+        (d / "out").write_bytes(_text(rng, 1 << 16))
+
+
+def deep(root: Path, depth: int = 8, width: int = 2, files_per_dir: int = 3, size: int = 1024, seed: int = 2):
+    """ A deeply nested tree with a few files at every level """
+    rng = random.Random(seed)
+    def build(d: Path, level: int):
+        d.mkdir(parents=True, exist_ok=True)
+        for j in range(files_per_dir):
+            (d / f"f{j}.log").write_bytes(_text(rng, size))
+        if level < depth:
+            for k in range(width):
+                build(d / f"d{k}", level + 1)
+    build(Path(root), 1)
+
+
+def mixed(root: Path, seed: int = 3):
+    """ Calculation directories with text outputs and a medium-sized binary each """
+    rng = random.Random(seed)
+    for i in range(10):
+        d = Path(root) / f"calc_{i:02d}"
+        d.mkdir(parents=True, exist_ok=True)
+        for j in range(20):
+            (d / f"out_{j:02d}.txt").write_bytes(_text(rng, 8192))
+        (d / "n_up").write_bytes(_binary(rng, 2 << 20))
+
+
+trees = {
+    "many_small": many_small,
+    "few_huge": few_huge,
+    "deep": deep,
+    "mixed": mixed,
+}
+
+
+def tree_size(root: Path) -> tuple[int, int]:
+    """ (number of files, total bytes) below root """
+    n, size = 0, 0
+    for dirpath, _, filenames in os.walk(root):
+        for f in filenames:
+            n += 1
+            size += os.path.getsize(os.path.join(dirpath, f))
+    return n, size
@@ -0,0 +1,171 @@
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from remotePathSync.pathroot import PathRoot
+from remotePathSync.pathrootpair import PathRootPair
+from remotePathSync.instrument import report_progress
+
+
+class _AsyncRunner:
+    """ Runs blocking calls on a private thread pool, at most `concurrency` at a time """
+
+    def __init__(self, concurrency: int = 8):
+        self.concurrency = max(1, concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def call(self, fn, *args, **kwargs):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class AsyncPathRoot:
+    """
+    Awaitable wrapper around a PathRoot.
+
+    Every method runs the blocking PathRoot call on a worker thread, so independent remote
+    operations issued with asyncio.gather share the SSH transport and overlap their round trips.
+    """
+
+    def __init__(self, pathroot: PathRoot, concurrency: int = 8, _runner: _AsyncRunner | None = None):
+        self.sync = pathroot
+        self._runner = _AsyncRunner(concurrency) if _runner is None else _runner
+
+    @property
+    def root(self) -> Path:
+        return self.sync.root
+
+    @property
+    def remote(self) -> bool:
+        return self.sync.remote
+
+    async def run(self, cmd: str) -> str:
+        return await self._runner.call(self.sync.run, cmd)
+
+    async def ope(self, path: Path) -> bool:
+        return await self._runner.call(self.sync.ope, path)
+
+    async def isdir(self, path: Path) -> bool:
+        return await self._runner.call(self.sync.isdir, path)
+
+    async def mkdir(self, path: Path):
+        return await self._runner.call(self.sync.mkdir, path)
+
+    async def rm(self, path: Path):
+        return await self._runner.call(self.sync.rm, path)
+
+    async def get_ls_fs(self, path: Path) -> list[str]:
+        return await self._runner.call(self.sync.get_ls_fs, path)
+
+    async def list_dir(self, path: Path) -> list:
+        return await self._runner.call(self.sync.list_dir, path)
+
+    async def get_ls_l_file_info(self, path: Path) -> dict[str, dict]:
+        return await self._runner.call(self.sync.get_ls_l_file_info, path)
+
+    async def get_manifest(self, path: Path, maxdepth: int | None = None) -> dict[str, dict]:
+        return await self._runner.call(self.sync.get_manifest, path, maxdepth=maxdepth)
+
+    async def listdirs(self, path: Path) -> list[str]:
+        return await self._runner.call(self.sync.listdirs, path)
+
+    async def get_hashes(self, paths: list[Path | str], algorithm: str = "sha256") -> dict[str, str]:
+        return await self._runner.call(self.sync.get_hashes, paths, algorithm=algorithm)
+
+
+class AsyncPathRootPair:
+    """
+    Awaitable wrapper around a PathRootPair.
+
+    `local` and `remote` are AsyncPathRoots sharing this pair's concurrency limit. Single-file
+    download/upload go through one SFTP channel per worker thread (the pair's SCPClient is not
+    safe to share between threads). The synchronous pair stays usable as `sync`.
+    """
+
+    def __init__(self, pair: PathRootPair, concurrency: int = 8):
+        self.sync = pair
+        self._runner = _AsyncRunner(concurrency)
+        self.local = AsyncPathRoot(pair.local, _runner=self._runner)
+        self.remote = AsyncPathRoot(pair.remote, _runner=self._runner)
+        self._thread_local = threading.local()
+        self._sftps = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_paths(cls, *args, concurrency: int = 8, pair_cls=PathRootPair, **kwargs):
+        """ Same arguments as PathRootPair.from_paths (pair_cls selects a PathRootPair subclass) """
+        return cls(pair_cls.from_paths(*args, **kwargs), concurrency=concurrency)
+
+    def _sftp(self):
+        sftp = getattr(self._thread_local, "sftp", None)
+        if sftp is None:
+            sftp = self.sync.remote.open_sftp()
+            with self._lock:
+                self._sftps.append(sftp)
+            self._thread_local.sftp = sftp
+        return sftp
+
+    def _download(self, arb_path: Path | str, p=True):
+        local_file, remote_file = self.sync.get_local_remote_from_arb(Path(arb_path))
+        self.sync.local.mkdir(local_file.parent)
+        report_progress(p, "transfer", f"{remote_file} --> {local_file}", src=remote_file, dst=local_file, download=True)
+        sftp = self._sftp()
+        with self.sync.stats.timed("sftp_get", str(remote_file)):
+            sftp.get(str(remote_file), str(local_file))
+        self.sync.stats.count("files_down")
+        self.sync.stats.count("bytes_down", local_file.stat().st_size)
+
+    def _upload(self, arb_path: Path | str, p=True):
+        local_file, remote_file = self.sync.get_local_remote_from_arb(Path(arb_path))
+        self.sync.remote.mkdir(remote_file.parent)
+        report_progress(p, "transfer", f"{local_file} --> {remote_file}", src=local_file, dst=remote_file, download=False)
+        sftp = self._sftp()
+        try:
+            with self.sync.stats.timed("sftp_put", str(local_file)):
+                sftp.put(str(local_file), str(remote_file))
+        finally:
+            # The file (and its directory's mtime) changed even if the put failed part-way
+            self.sync.remote.invalidate(remote_file)
+            self.sync.remote.invalidate(remote_file.parent)
+        self.sync.stats.count("files_up")
+        self.sync.stats.count("bytes_up", local_file.stat().st_size)
+
+    async def download(self, arb_path: Path | str, p=True):
+        return await self._runner.call(self._download, arb_path, p=p)
+
+    async def upload(self, arb_path: Path | str, p=True):
+        return await self._runner.call(self._upload, arb_path, p=p)
+
+    async def download_dir(self, arb_path: Path, **kwargs):
+        return await self._runner.call(self.sync.download_dir, arb_path, **kwargs)
+
+    async def upload_dir(self, arb_path: Path, **kwargs):
+        return await self._runner.call(self.sync.upload_dir, arb_path, **kwargs)
+
+    async def update_dir_contents(self, arb_dir: Path, **kwargs):
+        return await self._runner.call(self.sync.update_dir_contents, arb_dir, **kwargs)
+
+    async def get_job_state(self, path: Path, check_days=3) -> str | None:
+        return await self._runner.call(self.sync.get_job_state, path, check_days=check_days)
+
+    async def submit_local_path(self, arb_path: Path, **kwargs):
+        return await self._runner.call(self.sync.submit_local_path, arb_path, **kwargs)
+
+    def close(self):
+        self._runner.close()
+        with self._lock:
+            sftps, self._sftps = self._sftps, []
+        for sftp in sftps:
+            sftp.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
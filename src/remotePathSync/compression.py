@@ -0,0 +1,194 @@
+from __future__ import annotations
+import fcntl
+import json
+import os
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from remotePathSync.syncindex import default_cache_dir
+
+# Names and suffixes of files that are dense binary data or already compressed
+incompressible_default = [
+    "wfns", "n_up", "n_dn", "fluidState", "d_tot",
+    ".gz", ".bz2", ".xz", ".zst", ".zip", ".tgz", ".npy", ".npz", ".h5", ".hdf5", ".png", ".jpg", ".jpeg",
+]
+
+_zip_log_re = re.compile(r"^\s*(?:adding|updating): (.+?) \((deflated|stored) (\d+)%\)\s*$")
+
+
+@contextmanager
+def file_lock(path: Path):
+    """ Exclusive lock on path (created if needed) between processes, held for the with block """
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_key(name: str) -> str:
+    """ What compressibility is tracked by: the suffix if the file has one, otherwise its name """
+    name = Path(name).name
+    suffix = Path(name).suffix
+    return suffix if len(suffix) else name
+
+
+def parse_zip_log(out: str) -> dict[str, float]:
+    """ {path: compressed size / original size} from the 'adding: <path> (deflated N%)' lines zip prints """
+    ratios = {}
+    for line in out.split("\n"):
+        match = _zip_log_re.match(line)
+        if not match is None and not match.group(1).endswith("/"):
+            ratios[match.group(1)] = 1 - int(match.group(3)) / 100
+    return ratios
+
+
+def sample_ratio(path: Path | str, sample_size: int = 1 << 16) -> float:
+    """ Compressed / original size of the first sample_size bytes of a local file at a cheap level """
+    with open(path, "rb") as f:
+        data = f.read(sample_size)
+    if not len(data):
+        return 1.0
+    return len(zlib.compress(data, 1)) / len(data)
+
+
+class CompressionPolicy:
+    """
+    Decides whether and how hard to compress transfers to one host.
+
+    Two things are learned and kept in the cache directory across sessions: the compression ratio
+    achieved per file type (suffix, or name for suffix-less outputs like wfns), taken from zip's
+    own per-file report, and the throughput of the link to each host. File types that do not
+    compress are stored instead of deflated, and the codec level follows the link speed: no
+    compression on fast links where it only costs CPU, the strongest on slow ones, where it also
+    turns on SSH transport compression.
+    """
+    # Compressed / original size above which compressing a file type is not worth the CPU
+    min_gain_ratio: float = 0.9
+    # Link speeds (bytes per second) separating slow, medium and fast links
+    slow_link: float = 5e6
+    fast_link: float = 1e8
+    # Transfers smaller than this say more about latency than bandwidth and are not recorded
+    min_sample_bytes: int = 1 << 22
+
+    def __init__(self, host: str | None = None, incompressible: list[str] | None = None, state_path: Path | str | None = None):
+        self.host = str(host)
+        self.incompressible = list(incompressible_default if incompressible is None else incompressible)
+        self.state_path = Path(default_cache_dir() / "compression.json" if state_path is None else state_path)
+        self._lock = threading.Lock()
+        self.state = {"ratios": {}, "throughput": {}}
+        self.state.update(self._load())
+
+    def _load(self) -> dict:
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update(self, section: str, updates: dict):
+        """
+        Replace state[section][key] with update(old value or None) for every key, update in updates
+
+        Other pairs and processes share the file, so under a lock on it the file is read again right
+        before writing and only these keys change; what others learned meanwhile is kept (and picked up).
+        """
+        with self._lock, file_lock(self.state_path.with_name(f"{self.state_path.name}.lock")):
+            state = {"ratios": {}, "throughput": {}}
+            state.update(self._load())
+            for key, update in updates.items():
+                state[section][key] = update(state[section].get(key))
+            tmp = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.state_path)
+            self.state = state
+
+    def record_ratios(self, ratios: dict[str, float]):
+        """ Fold {path: compressed / original size} into the running mean of each file type """
+        by_key = {}
+        for path, ratio in ratios.items():
+            by_key.setdefault(file_key(path), []).append(ratio)
+
+        def fold(old, new):
+            n, mean = old or (0, 0.0)
+            for ratio in new:
+                n = min(n + 1, 100)
+                mean += (ratio - mean) / n
+            return (n, mean)
+
+        self._update("ratios", {key: (lambda old, new=new: fold(old, new)) for key, new in by_key.items()})
+
+    def record_throughput(self, n_bytes: int, elapsed: float):
+        """ Fold one transfer into the (exponentially weighted) link speed of this host """
+        if n_bytes < self.min_sample_bytes or elapsed <= 0:
+            return
+        speed = n_bytes / elapsed
+        self._update("throughput", {self.host: lambda old: speed if old is None else 0.7 * old + 0.3 * speed})
+
+    @property
+    def link_speed(self) -> float | None:
+        """ Bytes per second recently achieved to this host (None until something was measured) """
+        return self.state["throughput"].get(self.host)
+
+    def expected_ratio(self, name: str) -> float | None:
+        learned = self.state["ratios"].get(file_key(name))
+        return None if learned is None else learned[1]
+
+    def should_compress(self, path: Path | str, sample: bool = True) -> bool:
+        """ Whether a file is worth compressing, by name, by recorded ratios, or by compressing a sample of it """
+        name = Path(path).name
+        if name in self.incompressible or file_key(name) in self.incompressible:
+            return False
+        ratio = self.expected_ratio(name)
+        if (ratio is None) and sample and os.path.isfile(path):
+            ratio = sample_ratio(path)
+        return (ratio is None) or (ratio < self.min_gain_ratio)
+
+    def bundle_codec(self, files: list[tuple[Path | str, int]], codec: str | None, sample: bool = True) -> str | None:
+        """
+        codec for an archive of (path, size) files, or None (stored) if most of its bytes are file types
+        should_compress turns down (one file of each type is sampled, and only with sample)
+        """
+        if codec is None:
+            return None
+        decided, compressible, total = {}, 0, 0
+        for path, size in files:
+            key = file_key(str(path))
+            if not key in decided:
+                decided[key] = self.should_compress(path, sample=sample)
+            compressible += size if decided[key] else 0
+            total += size
+        return codec if 2 * compressible >= total else None
+
+    def store_suffixes(self) -> list[str]:
+        """ Names/suffixes to store uncompressed in archives (zip -n) """
+        learned = [key for key, (_, ratio) in self.state["ratios"].items() if ratio >= self.min_gain_ratio]
+        return sorted(set(self.incompressible + learned))
+
+    def zip_level(self) -> int:
+        """ zip compression level for this link (0 stores everything) """
+        speed = self.link_speed
+        if speed is None:
+            return 6
+        if speed >= self.fast_link:
+            return 0
+        if speed <= self.slow_link:
+            return 9
+        return 6 if speed < self.fast_link / 4 else 1
+
+    def tar_codec(self) -> str | None:
+        """ Codec for tar streams (see tarstream.tar_codecs) for this link """
+        speed = self.link_speed
+        # gzip keeps up with any link we would want to compress for, xz/bz2 would become the bottleneck
+        if (not speed is None) and speed >= self.fast_link:
+            return None
+        return "gz"
+
+    def ssh_compression(self) -> bool:
+        """ Whether SSH transport compression pays off (only on links known to be slow) """
+        speed = self.link_speed
+        return (not speed is None) and speed <= self.slow_link
@@ -0,0 +1,95 @@
+from __future__ import annotations
+import hashlib
+import os
+import shutil
+from pathlib import Path
+import paramiko
+
+# Run remotely as `python3 -c <script> <block size> <path>`: prints the file size, then one md5 per block
+block_hashes_script = (
+    "import hashlib, os, sys\n"
+    "bs = int(sys.argv[1])\n"
+    "print(os.path.getsize(sys.argv[2]))\n"
+    "with open(sys.argv[2], 'rb') as f:\n"
+    "    for b in iter(lambda: f.read(bs), b''):\n"
+    "        print(hashlib.md5(b).hexdigest())\n"
+)
+
+
+def block_hashes(path: Path | str, block_size: int) -> list[str]:
+    """ md5 of every block_size block of a local file """
+    with open(path, "rb") as f:
+        return [hashlib.md5(b).hexdigest() for b in iter(lambda: f.read(block_size), b"")]
+
+
+def parse_block_hashes_output(out: str) -> tuple[int, list[str]]:
+    lines = out.split()
+    if not len(lines):
+        raise RuntimeError("Remote block hashing returned nothing (is python3 available on the remote?)")
+    return int(lines[0]), lines[1:]
+
+
+def get_differing_ranges(
+        local_hashes: list[str], remote_hashes: list[str], remote_size: int, block_size: int,
+        max_length: int = 1 << 24,
+        ) -> list[tuple[int, int]]:
+    """ (offset, length) ranges of the remote file not already present at the same offset locally, with neighbours merged up to max_length """
+    ranges = []
+    for i, h in enumerate(remote_hashes):
+        if i < len(local_hashes) and local_hashes[i] == h:
+            continue
+        offset = i * block_size
+        length = min(block_size, remote_size - offset)
+        if len(ranges) and ranges[-1][0] + ranges[-1][1] == offset and ranges[-1][1] + length <= max_length:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+def batch_ranges(ranges: list[tuple[int, int]], batch_bytes: int) -> list[list[tuple[int, int]]]:
+    """ ranges split, in order, into batches whose lengths add up to at most batch_bytes (a longer range goes alone) """
+    batches, total = [], 0
+    for offset, length in ranges:
+        if (not len(batches)) or total + length > batch_bytes:
+            batches.append([])
+            total = 0
+        batches[-1].append((offset, length))
+        total += length
+    return batches
+
+
+def delta_download(
+        sftp: paramiko.SFTPClient, remote_file: Path, local_file: Path,
+        remote_size: int, remote_hashes: list[str], block_size: int, batch_bytes: int = 1 << 26,
+        ) -> int:
+    """
+    Update local_file to match remote_file by fetching only the blocks that differ.
+
+    The patch is applied to a copy which replaces local_file once every block has been verified,
+    so an interrupted delta never leaves a half-patched file behind. At most batch_bytes (or one
+    range, if longer) are requested at a time. Returns the number of bytes fetched (0 if no block differed).
+    """
+    local_hashes = block_hashes(local_file, block_size)
+    ranges = get_differing_ranges(local_hashes, remote_hashes, remote_size, block_size)
+    tmp_file = local_file.with_name(f"{local_file.name}.delta")
+    shutil.copyfile(local_file, tmp_file)
+    n_bytes = 0
+    try:
+        with open(tmp_file, "r+b") as out:
+            if len(ranges):
+                with sftp.open(str(remote_file), "rb") as remote:
+                    # readv pipelines its requests but buffers them all, so hand it batches of bounded total size
+                    for batch in batch_ranges(ranges, batch_bytes):
+                        for (offset, _), data in zip(batch, remote.readv(batch)):
+                            out.seek(offset)
+                            out.write(data)
+                            n_bytes += len(data)
+            out.truncate(remote_size)
+        if block_hashes(tmp_file, block_size) != remote_hashes:
+            raise RuntimeError(f"Delta transfer of {remote_file} did not reproduce the remote blocks")
+        os.replace(tmp_file, local_file)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+    return n_bytes
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import math
+import re
+import shlex
+import time
+from fnmatch import translate
+
+
+def _compile_globs(patterns: list[str]) -> re.Pattern | None:
+    if not len(patterns):
+        return None
+    return re.compile("|".join(f"(?:{translate(pattern)})" for pattern in patterns))
+
+
+def _glob_escape(path: str) -> str:
+    """ path with find's glob characters escaped, so -path matches it literally """
+    return re.sub(r"([\[\]*?\\])", r"\\\1", path)
+
+
+class FileFilter:
+    """
+    Compiled file selection, shared by every transfer mode so they all move the same set of files.
+
+    Patterns are globs matched against the name, or against the path relative to the transferred
+    directory when they contain a "/". exclude applies to files and directories (an excluded
+    directory is pruned, nothing below it is listed), exclude_dirs to directories only, and
+    exclude_files and include to files only (include None keeps every file). exclude_regex/include_regex are Python regexes searched
+    in the relative path of files. min_size/max_size are in bytes and min_age/max_age in seconds
+    since the last modification, all inclusive.
+
+    find_expression turns everything but the regexes into find tests, so remote listings and
+    archives never enumerate pruned subtrees. Python's regex dialect is not find's, so regexes are
+    checked on what the listing returns instead, and archives of a filter with regexes (see
+    find_exact) are made from a checked listing.
+    """
+
+    def __init__(
+            self, exclude: list[str] | None = None, include: list[str] | None = None, exclude_dirs: list[str] | None = None,
+            exclude_regex: list[str] | None = None, include_regex: list[str] | None = None,
+            min_size: int | None = None, max_size: int | None = None, min_age: float | None = None, max_age: float | None = None,
+            exclude_files: list[str] | None = None,
+            ):
+        self.exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+        self.include = [include] if isinstance(include, str) else (None if include is None else list(include))
+        self.exclude_dirs = [exclude_dirs] if isinstance(exclude_dirs, str) else list(exclude_dirs or [])
+        self.exclude_files = [exclude_files] if isinstance(exclude_files, str) else list(exclude_files or [])
+        self.exclude_regex = [exclude_regex] if isinstance(exclude_regex, str) else list(exclude_regex or [])
+        self.include_regex = [include_regex] if isinstance(include_regex, str) else (None if include_regex is None else list(include_regex))
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_age = min_age
+        self.max_age = max_age
+        self._compile()
+
+    @classmethod
+    def from_lists(cls, exclude_fs: list[str] | str | None = None, include_fs: list[str] | str | None = None) -> FileFilter:
+        """
+        Filter equivalent to the exclude_fs/include_fs name lists taken by the transfer methods
+
+        exclude_fs only ever matched files (zip -x '*/name'), so it becomes exclude_files: a directory
+        sharing a name with an excluded file type (a "force" directory, say) is still transferred.
+        """
+        return cls(exclude_files=exclude_fs, include=include_fs)
+
+    def _compile(self):
+        def split(patterns):
+            return [p for p in patterns if not "/" in p], [p for p in patterns if "/" in p]
+
+        self._exclude = [_compile_globs(part) for part in split(self.exclude)]
+        self._exclude_dirs = [_compile_globs(part) for part in split(self.exclude_dirs)]
+        self._exclude_files = [_compile_globs(part) for part in split(self.exclude_files)]
+        self._include = None if self.include is None else [_compile_globs(part) for part in split(self.include)]
+        self._exclude_regex = re.compile("|".join(f"(?:{r})" for r in self.exclude_regex)) if len(self.exclude_regex) else None
+        self._include_regex = None if self.include_regex is None else re.compile("|".join(f"(?:{r})" for r in self.include_regex) or "(?!)")
+
+    @property
+    def find_exact(self) -> bool:
+        """ Whether find_expression alone selects what the filter keeps (regexes need the listing checked in Python) """
+        return (not len(self.exclude_regex)) and self.include_regex is None
+
+    def paths_only(self) -> FileFilter:
+        """ The same filter without the size and age predicates """
+        return FileFilter(
+            exclude=self.exclude, include=self.include, exclude_dirs=self.exclude_dirs, exclude_files=self.exclude_files,
+            exclude_regex=self.exclude_regex, include_regex=self.include_regex,
+            )
+
+    @staticmethod
+    def _matches(compiled: list[re.Pattern | None], relpath: str) -> bool:
+        by_name, by_path = compiled
+        name = relpath.rsplit("/", 1)[-1]
+        return ((not by_name is None) and not by_name.match(name) is None) or ((not by_path is None) and not by_path.match(relpath) is None)
+
+    def match_dir(self, relpath: str) -> bool:
+        """ Whether to descend into a directory (its parents are not checked) """
+        return not (self._matches(self._exclude, relpath) or self._matches(self._exclude_dirs, relpath))
+
+    def match_file(self, relpath: str, size: int | None = None, mtime: float | None = None) -> bool:
+        """ Whether to keep a file (its parents are not checked, nor the predicates whose stat field is None) """
+        if self._matches(self._exclude, relpath) or self._matches(self._exclude_files, relpath):
+            return False
+        if (not self._include is None) and not self._matches(self._include, relpath):
+            return False
+        if (not self._exclude_regex is None) and not self._exclude_regex.search(relpath) is None:
+            return False
+        if (not self._include_regex is None) and self._include_regex.search(relpath) is None:
+            return False
+        if not size is None:
+            if (not self.min_size is None) and size < self.min_size:
+                return False
+            if (not self.max_size is None) and size > self.max_size:
+                return False
+        if not mtime is None:
+            age = time.time() - mtime
+            if (not self.min_age is None) and age < self.min_age:
+                return False
+            if (not self.max_age is None) and age > self.max_age:
+                return False
+        return True
+
+    def selects(self, relpath: str, size: int | None = None, mtime: float | None = None, is_dir: bool = False) -> bool:
+        """ match_file (match_dir with is_dir), plus match_dir for every parent (for paths that did not come out of a pruned listing) """
+        parts = relpath.split("/")
+        for i in range(1, len(parts)):
+            if not self.match_dir("/".join(parts[:i])):
+                return False
+        return self.match_dir(relpath) if is_dir else self.match_file(relpath, size=size, mtime=mtime)
+
+    def _find_tests(self, patterns: list[str], root: str) -> str:
+        return " -o ".join(
+            f"-path {shlex.quote(f'{root}/{p}')}" if "/" in p else f"-name {shlex.quote(p)}" for p in patterns
+        )
+
+    def find_expression(self, root: str, action: str = "-print") -> str:
+        """
+        find expression (everything after the start point and global options) running action on every
+        directory that is not pruned and every file the filter keeps, for a find started at root
+        """
+        root = _glob_escape(str(root).rstrip("/") or "/")
+        expr = ""
+        prune = self.exclude + self.exclude_dirs
+        if len(prune):
+            expr += f"\\( -type d ! -path {shlex.quote(root)} \\( {self._find_tests(prune, root)} \\) -prune \\) -o "
+        tests = []
+        if len(self.exclude + self.exclude_files):
+            tests.append(f"! \\( {self._find_tests(self.exclude + self.exclude_files, root)} \\)")
+        if not self.include is None:
+            tests.append(f"\\( {self._find_tests(self.include, root)} \\)" if len(self.include) else "-false")
+        if (not self.min_size is None) and self.min_size > 0:
+            tests.append(f"-size +{int(self.min_size) - 1}c")
+        if not self.max_size is None:
+            tests.append(f"-size -{int(self.max_size) + 1}c")
+        now = time.time()
+        if not self.max_age is None:
+            # Whole seconds, rounded to keep a little more than asked (the listing is checked again with match_file)
+            tests.append(f"-newermt @{math.floor(now - self.max_age) - 1}")
+        if not self.min_age is None:
+            tests.append(f"! -newermt @{math.ceil(now - self.min_age) + 1}")
+        if len(tests):
+            expr += f"\\( -type d -o {' '.join(tests)} \\) "
+        return expr + action
+
+    def __repr__(self):
+        fields = {
+            "exclude": self.exclude, "include": self.include, "exclude_dirs": self.exclude_dirs, "exclude_files": self.exclude_files,
+            "exclude_regex": self.exclude_regex, "include_regex": self.include_regex,
+            "min_size": self.min_size, "max_size": self.max_size, "min_age": self.min_age, "max_age": self.max_age,
+        }
+        args = ", ".join(f"{key}={value!r}" for key, value in fields.items() if (not value is None) and value != [])
+        return f"FileFilter({args})"
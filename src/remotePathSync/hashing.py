@@ -0,0 +1,56 @@
+from __future__ import annotations
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from remotePathSync.syncindex import SyncIndex
+
+
+def hash_file(path: Path | str, algorithm: str = "sha256", chunk_size: int = 1 << 20) -> str:
+    """ Hex digest of a local file """
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_local_files(paths: list[Path | str], algorithm: str = "sha256", n_workers: int = 8, cache: SyncIndex | None = None) -> dict[str, str]:
+    """
+    Hash local files in a thread pool.
+
+    If a SyncIndex is given, digests are looked up / stored by (inode, size, mtime_ns) so
+    unchanged files are never re-read.
+    """
+    def _hash(path):
+        path = str(path)
+        st = os.stat(path)
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if not cache is None:
+            digest = cache.get_local_hash(path, stamp, algorithm)
+            if not digest is None:
+                return path, digest
+        digest = hash_file(path, algorithm=algorithm)
+        if not cache is None:
+            cache.set_local_hash(path, stamp, algorithm, digest)
+        return path, digest
+    with ThreadPoolExecutor(max_workers=max(1, n_workers)) as pool:
+        return dict(pool.map(_hash, paths))
+
+
+def parse_hashsum_output(out: str) -> dict[str, str]:
+    """ Parse '<digest>  <path>' lines from sha256sum/md5sum, undoing their escaping of odd file names """
+    digests = {}
+    for line in out.split("\n"):
+        if not len(line):
+            continue
+        escaped = line.startswith("\\")
+        if escaped:
+            line = line[1:]
+        digest, path = line.split(" ", 1)
+        path = path[1:] if path.startswith((" ", "*")) else path
+        if escaped:
+            path = re.sub(r"\\(.)", lambda m: "\n" if m.group(1) == "n" else m.group(1), path)
+        digests[path] = digest
+    return digests
@@ -0,0 +1,186 @@
+from __future__ import annotations
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+# Upper bounds (seconds) of the latency histogram buckets, doubling from 1 ms to about a minute
+latency_buckets = [0.001 * 2 ** i for i in range(17)]
+
+
+class TraceEvent(NamedTuple):
+    """ One finished operation, as passed to tracing hooks """
+    op: str
+    start: float
+    elapsed: float
+    detail: str | None
+    error: str | None
+
+
+class ProgressEvent(NamedTuple):
+    """
+    Structured progress report passed to callable p arguments.
+
+    kind is one of "transfer" (a file or stream started moving), "plan" (what an update is about to
+    move), "report" (a finished batch, with its TransferReport under data["report"]), "job" (Slurm
+    submissions and cancellations) or "error".
+    """
+    kind: str
+    message: str
+    data: dict
+
+
+def report_progress(p, kind: str, message: str, always: bool = False, **data):
+    """ Pass a ProgressEvent to p if it is callable, otherwise print the message if p (or always) is set """
+    if callable(p):
+        p(ProgressEvent(kind, message, data))
+    elif p or always:
+        print(message)
+
+
+class LatencyHistogram:
+    """ Durations of one kind of operation, counted in latency_buckets (plus one overflow bucket) """
+
+    def __init__(self):
+        self.counts = [0] * (len(latency_buckets) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+
+    def add(self, elapsed: float):
+        self.counts[bisect.bisect_left(latency_buckets, elapsed)] += 1
+        self.n += 1
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = elapsed if self.max is None else max(self.max, elapsed)
+
+    def quantile(self, q: float) -> float | None:
+        """ Upper bound of the bucket holding the q-th quantile (capped by the largest duration seen) """
+        if not self.n:
+            return None
+        target = q * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return min(latency_buckets[i], self.max) if i < len(latency_buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        buckets = {f"{bound:g}": count for bound, count in zip(latency_buckets, self.counts) if count}
+        if self.counts[-1]:
+            buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.n,
+            "total": self.total,
+            "mean": self.total / self.n if self.n else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class Stats:
+    """
+    Counters and per-operation latency histograms of a PathRoot (shared by the PathRootPair using it).
+
+    Counters are plain running totals: "exec" (remote commands, one round trip each to start),
+    "channels" (SSH channels opened, by exec, SFTP and SCP alike), "bytes_up"/"bytes_down" (payload
+    moved each way: file contents, streams, command text and output) and "files_up"/"files_down".
+    Operations timed with timed() go into a LatencyHistogram per operation name and are passed to
+    every hook added with add_hook as a TraceEvent once they finish.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters: dict[str, int] = {}
+            self.latencies: dict[str, LatencyHistogram] = {}
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, op: str, elapsed: float, start: float | None = None, detail: str | None = None, error: str | None = None):
+        """ Record one finished operation and pass it on to the tracing hooks """
+        with self._lock:
+            if not op in self.latencies:
+                self.latencies[op] = LatencyHistogram()
+            self.latencies[op].add(elapsed)
+            hooks = list(self.hooks)
+        if len(hooks):
+            event = TraceEvent(op, time.time() - elapsed if start is None else start, elapsed, detail, error)
+            for hook in hooks:
+                hook(event)
+
+    @contextmanager
+    def timed(self, op: str, detail: str | None = None):
+        """ Time the body of a with block as one op (failures are recorded too, with their error) """
+        start = time.time()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.observe(op, time.perf_counter() - t0, start=start, detail=detail, error=error)
+
+    def add_hook(self, hook):
+        """ Call hook(TraceEvent) after every timed operation """
+        with self._lock:
+            self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        with self._lock:
+            if hook in self.hooks:
+                self.hooks.remove(hook)
+
+    def snapshot(self) -> dict:
+        """ {"counters": {name: total}, "latency": {op: histogram summary}} as of now """
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "latency": {op: hist.snapshot() for op, hist in self.latencies.items()},
+            }
+
+    def __str__(self):
+        snapshot = self.snapshot()
+        lines = [", ".join(f"{key}: {value}" for key, value in sorted(snapshot["counters"].items()))]
+        for op, hist in sorted(snapshot["latency"].items()):
+            lines.append(
+                f"{op}: {hist['count']} x {hist['mean'] * 1e3:.1f} ms mean "
+                f"(p50 {hist['p50'] * 1e3:.1f} ms, p99 {hist['p99'] * 1e3:.1f} ms, max {hist['max'] * 1e3:.1f} ms)"
+            )
+        return "\n".join(lines)
+
+
+class CountingFile:
+    """ File-like wrapper adding everything read or written through it to a Stats counter """
+
+    def __init__(self, fileobj, stats: Stats, key: str):
+        self._fileobj = fileobj
+        self._stats = stats
+        self._key = key
+
+    def read(self, *args):
+        data = self._fileobj.read(*args)
+        self._stats.count(self._key, len(data))
+        return data
+
+    def write(self, data):
+        self._stats.count(self._key, len(data))
+        return self._fileobj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._fileobj, name)
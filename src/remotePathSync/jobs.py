@@ -0,0 +1,238 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from remotePathSync.syncindex import default_cache_dir
+
+# sacct fields, in the order of the pipe-separated (-P) output parsed by parse_sacct_output
+sacct_fields = ["jobname", "workdir", "jobid", "state", "elapsed", "submit", "end"]
+
+
+def sacct_command(user: str, start: str) -> str:
+    """
+    Shell command printing the remote epoch now, the epoch of start (any `date -d` argument,
+    e.g. '"3 days ago"' or '@1700000000'), then every job of user active since start, one per line.
+    """
+    return (
+        f"date +%s; date -d {start} +%s; "
+        f"SLURM_TIME_FORMAT=%s sacct -X -n -P -u {user} -S $(date -d {start} +%Y-%m-%dT%H:%M:%S) "
+        f"--format={','.join(sacct_fields)}"
+    )
+
+
+def _parse_epoch(value: str) -> float | None:
+    return float(value) if value.isdigit() else None
+
+
+def parse_sacct_output(out: str) -> tuple[float, float, list[dict]]:
+    """ Parse sacct_command output into (remote now, start, [job record]) """
+    lines = [line for line in out.strip().split("\n") if len(line)]
+    if len(lines) < 2 or not lines[0].strip().isdigit():
+        raise RuntimeError(f"Unexpected sacct output: {out[:200]}")
+    now, start = float(lines[0]), float(lines[1])
+    records = []
+    for line in lines[2:]:
+        fields = line.rsplit("|", len(sacct_fields) - 1)
+        if len(fields) != len(sacct_fields):
+            continue
+        jobname, workdir, jobid, state, elapsed, submit, end = fields
+        records.append({
+            "job type": jobname,
+            "workdir": workdir,
+            "jobid": jobid,
+            # "CANCELLED by <uid>" -> "CANCELLED", like the fixed-width output used to give
+            "state": state.split(" ")[0],
+            "elapsed": elapsed,
+            "submit": _parse_epoch(submit),
+            "end": _parse_epoch(end),
+        })
+    return now, start, records
+
+
+def squeue_command(user: str) -> str:
+    return f"squeue -h -u {user} -o '%i|%T|%Z'"
+
+
+def parse_squeue_output(out: str) -> dict[str, list[dict]]:
+    """ Parse squeue_command output into {workdir: [{"jobid", "state"}]} """
+    active = {}
+    for line in out.strip().split("\n"):
+        fields = line.split("|", 2)
+        if len(fields) != 3:
+            continue
+        jobid, state, workdir = fields
+        active.setdefault(workdir, []).append({"jobid": jobid, "state": state})
+    return active
+
+
+class JobHistory:
+    """
+    On-disk Slurm job records, keyed by cluster, workdir and jobid, plus how far back each
+    cluster's history is complete. Lives in the cache directory so every session can pick up
+    where the last one stopped.
+    """
+
+    def __init__(self, db_path: Path | str | None = None):
+        if db_path is None:
+            db_path = default_cache_dir() / "jobs.sqlite"
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "cluster TEXT, workdir TEXT, jobid TEXT, jobname TEXT, state TEXT, elapsed TEXT, submit REAL, end REAL, "
+                "PRIMARY KEY (cluster, workdir, jobid))"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS coverage (cluster TEXT PRIMARY KEY, covered_since REAL, last_poll REAL)"
+            )
+
+    def load(self, cluster: str) -> dict[str, dict[str, dict]]:
+        """ {workdir: {jobid: record}} of everything stored for cluster """
+        with self._lock:
+            rows = self._con.execute(
+                "SELECT workdir, jobid, jobname, state, elapsed, submit, end FROM jobs WHERE cluster = ?", (cluster,)
+            ).fetchall()
+        jobs = {}
+        for workdir, jobid, jobname, state, elapsed, submit, end in rows:
+            jobs.setdefault(workdir, {})[jobid] = {
+                "job type": jobname, "workdir": workdir, "jobid": jobid, "state": state,
+                "elapsed": elapsed, "submit": submit, "end": end,
+            }
+        return jobs
+
+    def save(self, cluster: str, records: list[dict]):
+        rows = [
+            (cluster, r["workdir"], r["jobid"], r["job type"], r["state"], r["elapsed"], r["submit"], r["end"])
+            for r in records
+        ]
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get_coverage(self, cluster: str) -> tuple[float | None, float | None]:
+        """ (covered_since, last_poll) remote epochs stored for cluster """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT covered_since, last_poll FROM coverage WHERE cluster = ?", (cluster,)
+            ).fetchone()
+        return (None, None) if row is None else (row[0], row[1])
+
+    def set_coverage(self, cluster: str, covered_since: float, last_poll: float):
+        with self._lock, self._con:
+            self._con.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)", (cluster, covered_since, last_poll))
+
+    def clear(self, cluster: str):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM jobs WHERE cluster = ?", (cluster,))
+            self._con.execute("DELETE FROM coverage WHERE cluster = ?", (cluster,))
+
+    def close(self):
+        self._con.close()
+
+
+class JobStore:
+    """
+    In-memory index of Slurm job records keyed by workdir and jobid.
+
+    The first query backfills the requested window. After that, every poll (at most one per
+    refresh_time seconds) only asks sacct for jobs active since the previous poll and merges
+    them in, so any `days` window already covered is answered from memory. Times are remote
+    epochs, which keeps the windows independent of the local clock.
+
+    With a JobHistory, the index starts from what earlier sessions stored for `cluster` (so the
+    first poll only fetches the gap since then) and every poll is written back.
+    """
+
+    def __init__(self, run, user: str, refresh_time: float = 60, margin: float = 5, history: JobHistory | None = None, cluster: str | None = None):
+        self.run = run
+        self.user = user
+        self.refresh_time = refresh_time
+        # Overlap of consecutive polls, so a job changing state during a poll is not missed
+        self.margin = margin
+        # workdir -> jobid -> record
+        self.jobs: dict[str, dict[str, dict]] = {}
+        # Remote epoch from which the history is complete, and of the last poll
+        self.covered_since: float | None = None
+        self.last_poll: float | None = None
+        # Local time of the last poll
+        self.polled_at: float | None = None
+        self._active: dict[str, list[dict]] | None = None
+        self._active_at: float | None = None
+        self._lock = threading.Lock()
+        self.history = history
+        self.cluster = cluster
+        if not history is None:
+            self.jobs = history.load(cluster)
+            self.covered_since, self.last_poll = history.get_coverage(cluster)
+
+    def merge(self, records: list[dict]):
+        for record in records:
+            self.jobs.setdefault(record["workdir"], {})[record["jobid"]] = record
+        if not self.history is None:
+            self.history.save(self.cluster, records)
+
+    def _query(self, start: str):
+        now, start, records = parse_sacct_output(self.run(sacct_command(self.user, start)))
+        self.merge(records)
+        self.last_poll = now
+        self.polled_at = time.time()
+        return start
+
+    def remote_now(self) -> float:
+        """ Best estimate of the remote epoch now (the local clock until this session's first poll) """
+        if self.polled_at is None:
+            return time.time()
+        return self.last_poll + (time.time() - self.polled_at)
+
+    def refresh(self, days: float = 1, force: bool = False):
+        """ Make sure the last `days` days are covered and no older than refresh_time (or re-poll now if force) """
+        with self._lock:
+            window_start = self.remote_now() - days * 86400
+            if (self.covered_since is None) or (window_start < self.covered_since - self.margin):
+                start = self._query(f'"{days} days ago"')
+                self.covered_since = start if self.covered_since is None else min(start, self.covered_since)
+            elif force or (self.polled_at is None) or (time.time() - self.polled_at) > self.refresh_time:
+                # Everything since the last poll, which may have been made by an earlier session
+                self._query(f"@{int(self.last_poll - self.margin)}")
+            else:
+                return
+            if not self.history is None:
+                self.history.set_coverage(self.cluster, self.covered_since, self.last_poll)
+
+    def invalidate(self):
+        """ Make the next query poll again, e.g. after submitting or cancelling jobs """
+        with self._lock:
+            self.polled_at = None
+            self._active = None
+
+    def get_history(self, days: float = 1) -> dict[str, list[dict]]:
+        """ {workdir: [records, oldest first]} of every job active in the last `days` days """
+        self.refresh(days=days)
+        cutoff = self.remote_now() - days * 86400
+        history = {}
+        with self._lock:
+            for workdir, jobs in self.jobs.items():
+                records = [
+                    r for r in jobs.values()
+                    if (r["end"] is None) or r["end"] >= cutoff or (r["submit"] or 0) >= cutoff
+                ]
+                if len(records):
+                    history[workdir] = sorted(records, key=lambda r: (r["submit"] or 0, r["jobid"]))
+        return history
+
+    def get_active(self, force: bool = False) -> dict[str, list[dict]]:
+        """ {workdir: [{"jobid", "state"}]} of pending/running jobs from squeue, cached for refresh_time """
+        with self._lock:
+            if force or (self._active is None) or (time.time() - self._active_at) > self.refresh_time:
+                self._active = parse_squeue_output(self.run(squeue_command(self.user)))
+                self._active_at = time.time()
+            return self._active
+
+    def get_active_state(self, workdir: str) -> str | None:
+        """ State of the newest pending/running job in workdir according to squeue """
+        jobs = self.get_active().get(workdir)
+        if not jobs:
+            return None
+        return jobs[-1]["state"]
@@ -0,0 +1,52 @@
+from __future__ import annotations
+import os
+import stat
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+import paramiko
+
+
+class ListEntry(NamedTuple):
+    """ One directory entry from a single-pass listing (symlinks are reported as themselves, not followed) """
+    name: str
+    is_dir: bool
+    size: int
+    mtime: float
+
+    @property
+    def time(self) -> datetime:
+        return datetime.fromtimestamp(self.mtime)
+
+
+def list_sftp(sftp: paramiko.SFTPClient, path: Path | str) -> list[ListEntry]:
+    """ List a remote directory with one SFTP opendir/readdir exchange (a missing directory lists as empty) """
+    try:
+        attrs = sftp.listdir_attr(str(path))
+    except FileNotFoundError:
+        return []
+    return [
+        ListEntry(a.filename, stat.S_ISDIR(a.st_mode or 0), int(a.st_size or 0), float(a.st_mtime or 0))
+        for a in attrs
+    ]
+
+
+def list_local(path: Path | str) -> list[ListEntry]:
+    """ List a local directory with os.scandir (a missing directory lists as empty) """
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    st = e.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append(ListEntry(e.name, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime))
+    except FileNotFoundError:
+        return []
+    return entries
+
+
+def entries_to_file_info(entries: list[ListEntry]) -> dict[str, dict]:
+    """ {name: {"isdir", "size", "time"}} in the shape get_ls_l_file_info has always returned """
+    return {e.name: {"isdir": e.is_dir, "size": e.size, "time": e.time} for e in entries}
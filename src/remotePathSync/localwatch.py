@@ -0,0 +1,355 @@
+from __future__ import annotations
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from remotePathSync.scan import scan_tree, is_excluded
+from remotePathSync.instrument import report_progress
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_event_header = struct.Struct("iIII")
+
+
+def _libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    return libc if hasattr(libc, "inotify_init1") else None
+
+
+def inotify_available() -> bool:
+    return not _libc() is None
+
+
+class InotifySource:
+    """
+    Change events below root from Linux inotify.
+
+    Every directory gets a watch. Directories created or moved in are watched as soon as their event
+    arrives, and their contents at that moment are reported too (files written before the watch was
+    in place would otherwise be missed). Events are (kind, relpath) with kind "file" (created or
+    written), "delete", "dir" or "rmdir". A queue overflow reports ("rescan", "").
+    """
+
+    def __init__(self, root: Path | str, exclude: list[str] | None = None):
+        self.root = Path(root)
+        self.exclude = list(exclude or [])
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this system")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: dict[int, str] = {}
+        self._add_tree("")
+
+    def _add_watch(self, reldir: str) -> bool:
+        path = self.root / reldir if len(reldir) else self.root
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            return False
+        self.watches[wd] = reldir
+        return True
+
+    def _add_tree(self, reldir: str) -> list[tuple[str, str]]:
+        """ Watch reldir and everything below it, returning what is already there as events """
+        events = []
+        if not self._add_watch(reldir):
+            return events
+        base = self.root / reldir if len(reldir) else self.root
+        for entry in scan_tree(base, exclude=self.exclude):
+            relpath = f"{reldir}/{entry.relpath}" if len(reldir) else entry.relpath
+            if entry.is_dir:
+                self._add_watch(relpath)
+                events.append(("dir", relpath))
+            else:
+                events.append(("file", relpath))
+        return events
+
+    def _drop_tree(self, reldir: str):
+        for wd, path in list(self.watches.items()):
+            if path == reldir or path.startswith(reldir + "/"):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def read(self, timeout: float) -> list[tuple[str, str]]:
+        """ Wait up to timeout seconds for events and return everything that arrived """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not len(ready):
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _event_header.size <= len(data):
+            wd, mask, _, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append(("rescan", ""))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            reldir = self.watches.get(wd)
+            if (reldir is None) or (not len(name)) or is_excluded(name, self.exclude):
+                continue
+            relpath = f"{reldir}/{name}" if len(reldir) else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    events.append(("dir", relpath))
+                    events += self._add_tree(relpath)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._drop_tree(relpath)
+                    events.append(("rmdir", relpath))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+                events.append(("file", relpath))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                events.append(("delete", relpath))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingSource:
+    """ Same events as InotifySource, from comparing (size, mtime_ns) snapshots of a scan every interval seconds """
+
+    def __init__(self, root: Path | str, exclude: list[str] | None = None, interval: float = 2.0):
+        self.root = Path(root)
+        self.exclude = list(exclude or [])
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+        self._closed = threading.Event()
+
+    def _scan(self) -> dict[str, tuple[bool, int, int]]:
+        return {e.relpath: (e.is_dir, e.size, e.mtime_ns) for e in scan_tree(self.root, exclude=self.exclude)}
+
+    def read(self, timeout: float) -> list[tuple[str, str]]:
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            self._closed.wait(timeout)
+            return []
+        if wait > 0:
+            self._closed.wait(wait)
+        self._next = time.monotonic() + self.interval
+        old, new = self._snapshot, self._scan()
+        self._snapshot = new
+        events = []
+        for relpath, stamp in new.items():
+            if old.get(relpath) != stamp:
+                if stamp[0]:
+                    if not relpath in old:
+                        events.append(("dir", relpath))
+                else:
+                    events.append(("file", relpath))
+        for relpath, stamp in old.items():
+            if not relpath in new:
+                events.append(("rmdir" if stamp[0] else "delete", relpath))
+        return events
+
+    def close(self):
+        self._closed.set()
+
+
+class PushWatcher:
+    """
+    Keep the remote copy of a local directory current by pushing local edits as they happen.
+
+    Changes are picked up with inotify (or, where it is unavailable or use_inotify=False, by scanning
+    every poll_interval seconds) and collected until the tree has been quiet for debounce seconds
+    (or max_delay seconds passed since the first pending change). Each flush then coalesces them:
+    a file written ten times goes up once, a file created and deleted again never goes up, and
+    everything below a deleted directory is covered by removing the directory. Remote deletions and
+    directory creations go in one batch() round trip and the changed files over the pair's transfer
+    engine, each to its get_remote_path. Only changes made after start() are pushed, so bring the
+    remote up to date with upload_dir first.
+
+    Changes the pair's FileFilter (see PathRootPair.get_file_filter) rejects by path are not pushed.
+    on_push(pushed) is called after every flush with {"files", "deleted", "dirs", "report"}.
+    Run it with start()/stop() on a background thread or await run() as an asyncio task.
+    """
+    # Editor swap/backup files that should never reach the remote
+    ignore_patterns = ["._*", "*.swp", "*.swx", "*~", ".#*", "4913"]
+
+    def __init__(
+            self, pair, arb_dir: Path | None = None, exclude_fs: list[str] | None = None,
+            debounce: float = 1.0, max_delay: float = 10.0, use_inotify: bool | None = None, poll_interval: float = 2.0,
+            n_workers: int | None = None, p=True, on_push=None, file_filter=None,
+            ):
+        self.pair = pair
+        self.local_dir = pair.local.root if arb_dir is None else pair.get_local_remote_from_arb(arb_dir)[0]
+        self.exclude = self.ignore_patterns + list(pair.exclude_fs_default if exclude_fs is None else exclude_fs)
+        self.file_filter = pair.get_file_filter(exclude_fs, None, file_filter).paths_only()
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.use_inotify = inotify_available() if use_inotify is None else use_inotify
+        self.poll_interval = poll_interval
+        self.n_workers = n_workers
+        self.p = p
+        self.on_push = on_push
+        self.pending: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._source = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _open_source(self):
+        if self.use_inotify:
+            return InotifySource(self.local_dir, exclude=self.exclude)
+        return PollingSource(self.local_dir, exclude=self.exclude, interval=self.poll_interval)
+
+    def _queue(self, kind: str, relpath: str):
+        if kind in ("file", "dir") and not self.file_filter.selects(relpath, is_dir=kind == "dir"):
+            return
+        with self._lock:
+            if kind == "rescan":
+                # Events were lost, so push everything (unchanged files are cheap next to a missed edit)
+                for entry in scan_tree(self.local_dir, exclude=self.exclude):
+                    self.pending[entry.relpath] = "dir" if entry.is_dir else "file"
+                return
+            if kind == "rmdir":
+                prefix = relpath + "/"
+                for other in [r for r in self.pending if r.startswith(prefix)]:
+                    del self.pending[other]
+            self.pending[relpath] = kind
+
+    def _requeue(self, entries: dict[str, str]):
+        """ Put back changes that did not make it to the remote, unless newer events replaced them meanwhile """
+        with self._lock:
+            removed = [r + "/" for r, kind in self.pending.items() if kind == "rmdir"]
+            for relpath, kind in entries.items():
+                if not any(relpath.startswith(prefix) for prefix in removed):
+                    self.pending.setdefault(relpath, kind)
+
+    def flush(self) -> dict | None:
+        """
+        Push everything pending now (returns what was pushed, None if nothing was).
+
+        Changes are only dropped once pushed: if the push fails they are queued again (and the error
+        raised), and files whose upload failed are queued again for the next flush.
+        """
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not len(pending):
+            return None
+        try:
+            pushed = self._push(pending)
+        except BaseException:
+            self._requeue(pending)
+            raise
+        report = pushed["report"]
+        if (not report is None) and len(report.errors):
+            self._requeue({Path(path).relative_to(self.local_dir).as_posix(): "file" for path in report.errors})
+        if not self.on_push is None:
+            self.on_push(pushed)
+        return pushed
+
+    def _push(self, pending: dict[str, str]) -> dict:
+        files, deleted, dirs = [], [], []
+        for relpath, kind in sorted(pending.items()):
+            local_path = self.local_dir / relpath
+            # What is on disk now wins over the event, which may be stale by the time the tree went quiet
+            if kind in ("file", "dir") and not os.path.lexists(local_path):
+                kind = "rmdir" if kind == "dir" else "delete"
+            elif kind in ("delete", "rmdir") and os.path.lexists(local_path):
+                kind = "dir" if local_path.is_dir() else "file"
+            if kind == "file":
+                files.append(local_path)
+            elif kind == "dir":
+                dirs.append(local_path)
+            else:
+                deleted.append(local_path)
+        get_remote_path = self.pair.get_remote_path
+        remote_dirs = {get_remote_path(d) for d in dirs} | {get_remote_path(f.parent) for f in files}
+        ops = [("rm", get_remote_path(path)) for path in deleted] + [("mkdir", d) for d in sorted(remote_dirs)]
+        for result in self.pair.remote.batch(ops):
+            # Removing something that never made it to the remote is not a problem
+            if (not result["ok"]) and result["op"] != "rm":
+                report_progress(self.p, "error", f"Error running {result['op']} on {result['path']}: {result['error']}", always=True, **result)
+        for path in deleted:
+            report_progress(self.p, "transfer", f"{get_remote_path(path)} removed", src=path, dst=get_remote_path(path), download=False)
+        report = None
+        if len(files):
+            with self.pair.get_transfer_engine(n_workers=self.n_workers, p=self.p) as engine:
+                for path in files:
+                    engine.submit_upload(path, get_remote_path(path))
+                report = engine.wait()
+            report_progress(self.p, "report", str(report), report=report)
+        return {"files": files, "deleted": deleted, "dirs": dirs, "report": report}
+
+    def _loop(self):
+        first = last = None
+        while not self._stop.is_set():
+            events = self._source.read(self.debounce if len(self.pending) else 1.0)
+            now = time.monotonic()
+            for kind, relpath in events:
+                self._queue(kind, relpath)
+            if len(events):
+                last = now
+                first = now if first is None else first
+            if len(self.pending) and ((now - last >= self.debounce) or (now - first >= self.max_delay)):
+                try:
+                    self.flush()
+                except Exception as e:
+                    report_progress(self.p, "error", f"Pushing changes below {self.local_dir} failed: {e}", always=True, error=e)
+                # Whatever is pending again (failed pushes) is retried once the tree has been quiet for debounce
+                first = last = time.monotonic() if len(self.pending) else None
+
+    def start(self):
+        """ Watch and push on a background thread """
+        if (not self._thread is None) and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._source = self._open_source()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True):
+        """ Stop watching (and with flush, push whatever is still pending) """
+        self._stop.set()
+        if not self._thread is None:
+            self._thread.join()
+        if not self._source is None:
+            self._source.close()
+            self._source = None
+        if flush:
+            self.flush()
+
+    async def run(self):
+        """ Watch and push until cancelled, for use as an asyncio task """
+        self.start()
+        try:
+            while True:
+                await asyncio.sleep(3600)
+        finally:
+            await asyncio.get_running_loop().run_in_executor(None, self.stop)
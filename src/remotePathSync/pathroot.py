@@ -9,22 +9,51 @@ from cryptography.fernet import Fernet
 import os
 from pathlib import Path
 import shutil
+import subprocess
+import json
+import shlex
+import socket
+import threading
+from contextlib import contextmanager
+from remotePathSync.syncindex import default_cache_dir
+from remotePathSync.hashing import hash_local_files, parse_hashsum_output
+from remotePathSync.delta import block_hashes, block_hashes_script, parse_block_hashes_output
+from remotePathSync.listing import ListEntry, list_sftp, list_local, entries_to_file_info
+from remotePathSync.instrument import Stats
+from remotePathSync.remotepath import MetadataCache, RemotePath
 
 key = Fernet.generate_key()
 fernet = Fernet(key)
 
-def createSSHClient(server, port, user, password):
+def createSSHClient(server, port, user, password, compress=False):
     client = paramiko.SSHClient()
     client.load_system_host_keys()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(server, port, user, password)
+    client.connect(server, port, user, password, compress=compress)
     return client
 
 def get_pw_and_otp_combo():
     encPWOTP = fernet.encrypt(getpass.getpass('Password + OTP:').encode())
     return encPWOTP
 
-def createSSHClient_through_agent(hostname: str, username: str) -> paramiko.SSHClient | None:
+def get_preferred_agent_keys() -> dict[str, str]:
+    """ Fingerprints of the agent keys that last worked, keyed by 'username@hostname' """
+    fname = default_cache_dir() / "agent_keys.json"
+    if not fname.exists():
+        return {}
+    try:
+        with open(fname, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def set_preferred_agent_key(hostname: str, username: str, fingerprint: str):
+    preferred = get_preferred_agent_keys()
+    preferred[f"{username}@{hostname}"] = fingerprint
+    with open(default_cache_dir() / "agent_keys.json", "w") as f:
+        json.dump(preferred, f)
+
+def createSSHClient_through_agent(hostname: str, username: str, port: int = 22, compress: bool = False) -> paramiko.SSHClient | None:
     
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -38,14 +67,23 @@ def createSSHClient_through_agent(hostname: str, username: str) -> paramiko.SSHC
         ssh_agent = paramiko.Agent()
         agent_keys = ssh_agent.get_keys()
         
+        # ssh_agent.get_keys() returns a ton of keys, most of which are old and unusable - reversing order prioritizes most recent keys
+        agent_keys = list(agent_keys)[::-1]
+        # The key that worked last time for this host goes first
+        preferred = get_preferred_agent_keys().get(f"{username}@{hostname}")
+        agent_keys.sort(key=lambda k: k.get_fingerprint().hex() != preferred)
         # Try each key
-        for key in agent_keys[::-1]: # ssh_agent.get_keys() returns a ton of keys, most of which are old and unusable - reversing order prioritizes most recent keys
+        for key in agent_keys:
             try:
                 client.connect(
                     hostname=hostname,
+                    port=port,
                     username=username,
-                    pkey=key
+                    pkey=key,
+                    compress=compress,
                 )
+                if key.get_fingerprint().hex() != preferred:
+                    set_preferred_agent_key(hostname, username, key.get_fingerprint().hex())
                 return client
             except Exception as e:
                 continue
@@ -68,47 +106,184 @@ def get_scp_and_ssh(username: str, hostname: str, try_agent=True):
         try_agent (bool): Whether to try using SSH agent for authentication
     """
     port = 22
+    ssh = connect(hostname, username, port=port, try_agent=try_agent)
+    scp = SCPClient(ssh.get_transport())
+    return scp, ssh
+
+def parse_manifest_stream(chunks):
+    """ Parse null-terminated find -printf records (type, size, mtime, relative path) from byte chunks """
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        records = buf.split(b"\0")
+        buf = records.pop()
+        for record in records:
+            ftype, size, mtime, rel = record.decode(errors="surrogateescape").split("\t", 3)
+            yield rel, {
+                "isdir": ftype == "d",
+                "size": int(size),
+                "time": datetime.fromtimestamp(float(mtime)),
+            }
+
+def connect(hostname: str, username: str, port: int = 22, try_agent=True, compress: bool = False) -> paramiko.SSHClient:
+    """ Open an authenticated SSHClient, through the SSH agent if possible and an interactive password + OTP otherwise """
     ssh = None
     if try_agent:
-        ssh = createSSHClient_through_agent(hostname, username)
+        ssh = createSSHClient_through_agent(hostname, username, port=port, compress=compress)
     if ssh is None:
         sdfsdfsdf = get_pw_and_otp_combo()
-        ssh = createSSHClient(hostname, port, username, fernet.decrypt(sdfsdfsdf).decode())
+        ssh = createSSHClient(hostname, port, username, fernet.decrypt(sdfsdfsdf).decode(), compress=compress)
         del sdfsdfsdf
-    scp = SCPClient(ssh.get_transport())
-    return scp, ssh
+    return ssh
+
+class ConnectionPool:
+    """
+    Process-wide cache of authenticated SSH connections keyed by (hostname, username, port, compress).
+
+    Every PathRoot (and so every PathRootPair) against the same account shares one transport and
+    opens extra channels on it as needed. Transports get a keepalive, and a transport found dead
+    is replaced by a fresh connection the next time it is asked for.
+    """
+
+    def __init__(self, keepalive_interval: int | None = 60):
+        self.keepalive_interval = keepalive_interval
+        self._clients: dict[tuple[str, str, int, bool], paramiko.SSHClient] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if (transport is None) or (not transport.is_active()):
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    def get(self, hostname: str, username: str, port: int = 22, try_agent=True, compress: bool = False) -> paramiko.SSHClient:
+        """ Return a live SSHClient for (hostname, username, port), connecting (or reconnecting) if needed """
+        key = (hostname, username, port, compress)
+        with self._lock:
+            client = self._clients.get(key)
+            if (not client is None) and self.is_alive(client):
+                return client
+            if not client is None:
+                print(f"Connection to {hostname} (user: {username}) was lost, reconnecting")
+                client.close()
+            client = connect(hostname, username, port=port, try_agent=try_agent, compress=compress)
+            if not self.keepalive_interval is None:
+                client.get_transport().set_keepalive(self.keepalive_interval)
+            self._clients[key] = client
+            return client
+
+    def open_channel(self, hostname: str, username: str, port: int = 22, compress: bool = False) -> paramiko.Channel:
+        return self.get(hostname, username, port=port, compress=compress).get_transport().open_session()
+
+    def open_sftp(self, hostname: str, username: str, port: int = 22, compress: bool = False) -> paramiko.SFTPClient:
+        return self.get(hostname, username, port=port, compress=compress).open_sftp()
+
+    def drop(self, hostname: str, username: str, port: int = 22):
+        """ Close and forget the connections for (hostname, username, port), compressed or not """
+        with self._lock:
+            keys = [key for key in self._clients if key[:3] == (hostname, username, port)]
+            clients = [self._clients.pop(key) for key in keys]
+        for client in clients:
+            client.close()
+
+    def close_all(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+connection_pool = ConnectionPool()
 
 class PathRoot:
 
     remote = False
     root: Path | None = None
-    ssh: paramiko.SSHClient | None = None
-    scp: SCPClient | None = None
+    _ssh: paramiko.SSHClient | None = None
+    _scp: SCPClient | None = None
     hostname: str | None = None
+    username: str | None = None
+    port: int = 22
+    # Use SSH transport compression (pays off on slow links, costs CPU on fast ones)
+    compress: bool = False
+    # Take connections from (and hand reconnects to) the process-wide connection_pool
+    pooled: bool = False
+    # "sftp" lists remote directories with SFTP listdir_attr (os.scandir locally), "ls" parses ls -l output
+    listing_backend: str = "sftp"
+    # Seconds remote stat results and listings stay cached for RemotePath (0 turns the cache off)
+    metadata_ttl: float = 30.0
+    # Largest read-ahead window of files opened with RemotePath.open
+    read_ahead: int = 1 << 20
 
-    def __init__(self, root: Path, hostname: str | None, try_agent=True, _ssh=None, username: str | None = None, keepalive_interval: int | None = 60, port: int = 22):
+    def __init__(self, root: Path, hostname: str | None, try_agent=True, _ssh=None, username: str | None = None, keepalive_interval: int | None = 60, port: int = 22, pooled: bool = True, compress: bool = False):
         self.root = root
-        ssh = _ssh
-        scp = None
+        # Round trips, channels, bytes and operation latencies of this root (see instrument.Stats)
+        self.stats = Stats()
+        # Remote metadata served to RemotePath, dropped for whatever this root (or its pairs) writes
+        self.metadata = MetadataCache(self.metadata_ttl)
+        # SCPClient keeps its channel on the instance, so calls from several threads must take turns
+        # (made once, as a reconnect must not hand waiting threads a second lock on the same client)
+        self.scp_lock = threading.Lock()
+        # The same for the shared SFTP channel (see shared_sftp)
+        self.list_lock = threading.Lock()
         if not hostname is None:
             self.remote = True
             if username is None:
                 raise ValueError("username must be provided for remote PathRoot")
-            if _ssh is None:
-                if try_agent:
-                    ssh = createSSHClient_through_agent(hostname, username)
-                if ssh is None:
-                    sdfsdfsdf = get_pw_and_otp_combo()
-                    ssh = createSSHClient(hostname, port, username, fernet.decrypt(sdfsdfsdf).decode())
-                    del sdfsdfsdf
-            scp = SCPClient(ssh.get_transport())
             self.hostname = hostname
-            self.scp = scp
-            self.ssh = ssh
-            self.set_keepalive(keepalive_interval)
+            self.username = username
+            self.port = port
+            self.compress = compress
+            self.try_agent = try_agent
+            self.keepalive_interval = keepalive_interval
+            ssh = _ssh
+            if _ssh is None:
+                self.pooled = pooled
+                ssh = connection_pool.get(hostname, username, port=port, try_agent=try_agent, compress=compress) if pooled else connect(hostname, username, port=port, try_agent=try_agent, compress=compress)
+            self._set_ssh(ssh)
         else:
             self.remote = False
 
+    def _set_ssh(self, ssh: paramiko.SSHClient):
+        self._ssh = ssh
+        # SFTP pipelines many small requests, which Nagle + delayed ACKs would otherwise hold back
+        sock = ssh.get_transport().sock
+        if hasattr(sock, "setsockopt"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._scp = SCPClient(ssh.get_transport())
+        # SFTP channel reused for directory listings, opened on first use
+        self._list_sftp = None
+        self.set_keepalive(self.keepalive_interval)
+
+    @property
+    def ssh(self) -> paramiko.SSHClient | None:
+        """ SSHClient of a remote root (pooled roots transparently pick up a new connection if the old one died) """
+        if self.pooled and not ConnectionPool.is_alive(self._ssh):
+            self._set_ssh(connection_pool.get(self.hostname, self.username, port=self.port, try_agent=self.try_agent, compress=self.compress))
+        return self._ssh
+
+    @property
+    def scp(self) -> SCPClient | None:
+        self.ssh  # picks up a fresh pooled connection (and SCPClient) if needed
+        return self._scp
+
+    def open_sftp(self) -> paramiko.SFTPClient:
+        """ Open an extra SFTP channel on the remote transport """
+        self.stats.count("channels")
+        return self.ssh.open_sftp()
+
+    def exec_command(self, cmd: str):
+        """ ssh.exec_command, counted and timed in stats (the returned streams are read by the caller) """
+        self.stats.count("exec")
+        self.stats.count("channels")
+        self.stats.count("bytes_up", len(cmd))
+        with self.stats.timed("exec", cmd):
+            return self.ssh.exec_command(cmd)
+
     def set_keepalive(self, interval: int | None):
         """ Set keepalive interval for remote SSH connection """
         if not interval is None:
@@ -123,33 +298,80 @@ class PathRoot:
         return instance
 
     def _run(self, cmd):
-        if self.remote:
-            out = self.ssh.exec_command(cmd)
-            return out[1].read().decode()
-        else:
-            return os.popen(cmd).read()
+        return self.run(cmd)
 
     def run(self, cmd):
-        if self.remote:
-            out = self.ssh.exec_command(cmd)
-            return out[1].read().decode()
-        else:
-            return os.popen(cmd).read()
+        with self.stats.timed("run", cmd):
+            if self.remote:
+                out = self.exec_command(cmd)
+                data = out[1].read()
+                self.stats.count("bytes_down", len(data))
+                return data.decode()
+            else:
+                return os.popen(cmd).read()
+
+    def run_input(self, cmd, data: str) -> str:
+        """ Run cmd with data on its stdin and return its output """
+        with self.stats.timed("run", cmd):
+            if not self.remote:
+                return subprocess.run(cmd, shell=True, input=data, stdout=subprocess.PIPE, text=True).stdout
+            stdin, stdout, _ = self.exec_command(cmd)
+            def feed():
+                # From a thread, so a long input can't deadlock against output the command writes meanwhile
+                stdin.write(data)
+                stdin.channel.shutdown_write()
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            out = stdout.read()
+            feeder.join()
+        self.stats.count("bytes_up", len(data))
+        self.stats.count("bytes_down", len(out))
+        return out.decode()
         
-    def make_zip(self, arb_dir_path: Path, exclude_fs=["wfns"], include_fs=None) -> Path:
+    def make_zip(
+            self, arb_dir_path: Path, exclude_fs=["wfns"], include_fs=None,
+            level: int | None = None, store_suffixes: list[str] | None = None, return_log=False,
+            file_filter=None,
+            ) -> Path:
+        """
+        Zip arb_dir_path next to itself and return the archive path.
+
+        level is zip's compression level (0 stores) and files ending in any of store_suffixes are
+        stored without compression. With return_log, return (archive path, zip's per-file output).
+        A FileFilter replaces exclude_fs/include_fs, and zip then takes its file list from find
+        (or, for filters find can't apply in full, from a listing checked against it first).
+        """
         zip_path = arb_dir_path.parent / f"{str(arb_dir_path.name)}.zip"
-        cmd = f"cd {str(arb_dir_path.parent)}; zip -r {str(arb_dir_path.name)}.zip {str(arb_dir_path.name)}"
+        listing = None
+        cmd = f"cd {str(arb_dir_path.parent)}; "
+        if (not file_filter is None) and not file_filter.find_exact:
+            listing = [arb_dir_path.name] + [f"{arb_dir_path.name}/{f}" for f, _ in self.iter_manifest(arb_dir_path, file_filter=file_filter)]
+            cmd += "zip"
+        elif not file_filter is None:
+            cmd += f"find {shlex.quote(arb_dir_path.name)} {file_filter.find_expression(arb_dir_path.name)} | zip"
+        else:
+            cmd += "zip -r"
+        if not level is None:
+            cmd += f" -{int(level)}"
+        if store_suffixes:
+            cmd += f" -n {shlex.quote(':'.join(store_suffixes))}"
+        cmd += f" {str(arb_dir_path.name)}.zip"
+        cmd += " -@" if not file_filter is None else f" {str(arb_dir_path.name)}"
         app_files = None
-        if include_fs is not None:
+        if (file_filter is None) and (include_fs is not None):
             cmd += " -i"
             app_files = [include_fs] if isinstance(include_fs, str) else include_fs
-        elif exclude_fs is not None:
+        elif (file_filter is None) and exclude_fs:
             cmd += " -x"
             app_files = [exclude_fs] if isinstance(exclude_fs, str) else exclude_fs
         if not app_files is None:
             for f in app_files:
                 cmd += f" '*/{f}'"
-        self.run(cmd)
+        with self.stats.timed("make_zip", str(arb_dir_path)):
+            log = self.run(cmd) if listing is None else self.run_input(cmd, "".join(f"{f}\n" for f in listing))
+        self.invalidate(zip_path)
+        if return_log:
+            return zip_path, log
         return zip_path
     
     def unzip(self, zip_path: Path, overwrite_existing=True):
@@ -157,6 +379,7 @@ class PathRoot:
         cmd += "unzip -o " if overwrite_existing else "unzip "
         cmd += f"{str(zip_path.name)}"
         self.run(cmd)
+        self.invalidate(zip_path.parent, recursive=True)
 
 
     # Replace ls parsing with using jc library
@@ -192,9 +415,43 @@ class PathRoot:
                 data[f] = splitline
         return data
     
+    @contextmanager
+    def shared_sftp(self):
+        """ The root's reused SFTP channel (opened on first use), held for the duration of the with block """
+        self.ssh  # picks up a fresh pooled connection (and drops the old SFTP channel) if needed
+        # One SFTP client can't serve overlapping requests from several threads, so users take turns
+        with self.list_lock:
+            if self._list_sftp is None:
+                self.stats.count("channels")
+                self._list_sftp = self._ssh.open_sftp()
+            yield self._list_sftp
+
+    def list_dir(self, path: Path | str) -> list[ListEntry]:
+        """ Return a ListEntry (name, is_dir, size, mtime) for everything in path, from a single listing """
+        if not self.remote:
+            return list_local(path)
+        with self.shared_sftp() as sftp, self.stats.timed("list_dir", str(path)):
+            return list_sftp(sftp, str(path).replace("\\", "/"))
+
+    def path(self, path: Path | str) -> RemotePath | Path:
+        """ Lazy pathlib-style handle on path: a RemotePath (see remotepath.py) for remote roots, a Path for local ones """
+        if not self.remote:
+            return Path(path)
+        return RemotePath(self, path)
+
+    def invalidate(self, path: Path | str, recursive: bool = False):
+        """ Drop cached metadata of path (and, with recursive, of everything below it) after writing to it """
+        self.metadata.invalidate(str(path).replace("\\", "/"), recursive=recursive)
+
     def get_ls_l_file_info(self, path: str):
+        """ Return a dictionary of files and directories in path ({name: {"isdir", "size", "time"}}) """
+        if self.listing_backend == "sftp":
+            return entries_to_file_info(self.list_dir(path))
+        return self.get_ls_l_file_info_from_ls(path)
+
+    def get_ls_l_file_info_from_ls(self, path: str):
         """ Return a dictionary of files and directories in path extracted from ls -l data """
-        path = path.replace("\\", "/")
+        path = str(path).replace("\\", "/")
         ls_l_data = self.get_ls_l_fs(path)
         file_info = {}
         for f in ls_l_data:
@@ -210,23 +467,193 @@ class PathRoot:
                 file_info[f]["time"] = timeo
         return file_info
     
+    def iter_manifest(self, path: Path, maxdepth: int | None = None, chunk_size: int = 1 << 16, file_filter=None):
+        """
+        Yield (relative path, info) for everything below path from a single recursive listing.
+
+        A FileFilter is pushed into the listing, so the directories it prunes are never walked
+        (on a remote root, find applies it; what find cannot check is dropped as the listing arrives).
+        """
+        path = str(path).replace("\\", "/")
+        if self.remote:
+            cmd = f"find '{path}' -mindepth 1"
+            if not maxdepth is None:
+                cmd += f" -maxdepth {maxdepth}"
+            printf = "-printf '%y\\t%s\\t%T@\\t%P\\0'"
+            cmd += " " + (printf if file_filter is None else file_filter.find_expression(path, action=printf))
+            out = self.exec_command(cmd)
+            def chunks():
+                for chunk in iter(lambda: out[1].read(chunk_size), b""):
+                    self.stats.count("bytes_down", len(chunk))
+                    yield chunk
+            for relpath, info in parse_manifest_stream(chunks()):
+                if (file_filter is None) or info["isdir"] or file_filter.match_file(relpath, info["size"], info["time"].timestamp()):
+                    yield relpath, info
+        else:
+            root_depth = len(Path(path).parts)
+            for dirpath, dirnames, filenames in os.walk(path):
+                reldir = Path(os.path.relpath(dirpath, path)).as_posix()
+                reldir = "" if reldir == "." else reldir + "/"
+                if not file_filter is None:
+                    dirnames[:] = [d for d in dirnames if file_filter.match_dir(reldir + d)]
+                subdirs = list(dirnames)
+                if (not maxdepth is None) and (len(Path(dirpath).parts) - root_depth + 1) >= maxdepth:
+                    dirnames.clear()
+                for f in subdirs + filenames:
+                    full = opj(dirpath, f)
+                    try:
+                        st = os.lstat(full)
+                    except FileNotFoundError:
+                        continue
+                    if (not file_filter is None) and (not f in subdirs) and not file_filter.match_file(reldir + f, st.st_size, st.st_mtime):
+                        continue
+                    yield reldir + f, {
+                        "isdir": f in subdirs,
+                        "size": st.st_size,
+                        "time": datetime.fromtimestamp(st.st_mtime),
+                    }
+
+    def get_manifest(self, path: Path, maxdepth: int | None = None, file_filter=None):
+        """ Return a dictionary of every file and directory below path (keyed by relative path) """
+        return dict(self.iter_manifest(path, maxdepth=maxdepth, file_filter=file_filter))
+
+    def get_hashes(self, paths: list[Path | str], algorithm: str = "sha256", n_workers: int = 8, cache=None) -> dict[str, str]:
+        """ Return {path: digest}, hashed by one batched remote command or a local thread pool """
+        if not self.remote:
+            return hash_local_files(paths, algorithm=algorithm, n_workers=n_workers, cache=cache)
+        if not len(paths):
+            return {}
+        with self.stats.timed("hash", f"{len(paths)} files"):
+            stdin, stdout, _ = self.exec_command(f"xargs -0 {algorithm}sum --")
+            listing = "".join(f"{path}\0" for path in paths)
+            self.stats.count("bytes_up", len(listing))
+            def feed():
+                # Written from a thread so a long path list can't deadlock against the digests coming back
+                stdin.write(listing)
+                stdin.channel.shutdown_write()
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            out = stdout.read()
+            feeder.join()
+        self.stats.count("bytes_down", len(out))
+        return parse_hashsum_output(out.decode(errors="surrogateescape"))
+
+    def get_block_hashes(self, path: Path | str, block_size: int) -> tuple[int, list[str]]:
+        """ Return (size, [md5 of each block_size block]) of a file (remote roots need python3) """
+        if not self.remote:
+            return os.path.getsize(path), block_hashes(path, block_size)
+        out = self.run(f"python3 -c {shlex.quote(block_hashes_script)} {int(block_size)} {shlex.quote(str(path))}")
+        return parse_block_hashes_output(out)
+
+    # Shell tests/commands for batch(); {path}, {parent} and {name} are substituted shell-quoted
+    batch_op_templates = {
+        "exists": "[ -e {path} ]",
+        "isdir": "[ -d {path} ]",
+        "isfile": "[ -f {path} ]",
+        "mkdir": "mkdir -p -- {path}",
+        "rm": "rm -r -- {path}",
+        "unzip": "cd {parent} && unzip -o {name}",
+        "unzip_keep": "cd {parent} && unzip -n {name}",
+    }
+    # Operations that modify the tree and so must stay inside root
+    batch_write_ops = ["mkdir", "rm", "unzip", "unzip_keep"]
+
+    def batch(self, ops: list[tuple[str, Path | str]]) -> list[dict]:
+        """
+        Run many (operation, path) pairs (see batch_op_templates) in one round trip.
+
+        Returns one {"op", "path", "ok", "error"} dictionary per operation, in order. For the
+        tests (exists/isdir/isfile) "ok" is the answer; for the rest it says whether it succeeded.
+        Operations run in order and a failure does not stop the ones after it.
+        """
+        ops = [(op, Path(path)) for op, path in ops]
+        for op, path in ops:
+            if not op in self.batch_op_templates:
+                raise ValueError(f"Unknown batch operation {op} (options are {list(self.batch_op_templates)})")
+            if op in self.batch_write_ops and not path.is_relative_to(self.root):
+                raise ValueError(f"Path {path} does not contain root {self.root}")
+        if not len(ops):
+            return []
+        if not self.remote:
+            return [self._local_batch_op(op, path) for op, path in ops]
+        lines = [
+            "_r() { if [ \"$2\" -eq 0 ]; then printf '%s\\t1\\n' \"$1\"; "
+            "else printf '%s\\t0\\t%s\\n' \"$1\" \"$(printf '%s' \"$3\" | tr '\\n\\t' '  ')\"; fi; }"
+        ]
+        for i, (op, path) in enumerate(ops):
+            cmd = self.batch_op_templates[op].format(
+                path=shlex.quote(path.as_posix()), parent=shlex.quote(path.parent.as_posix()), name=shlex.quote(path.name),
+                )
+            lines.append(f"_o=$( ({cmd}) 2>&1 >/dev/null); _r {i} $? \"$_o\"")
+        script = "\n".join(lines) + "\n"
+        with self.stats.timed("batch", f"{len(ops)} operations"):
+            stdin, stdout, _ = self.exec_command("sh -s")
+            def feed():
+                # From a thread, since the results of a long script fill the channel window before it is all written
+                stdin.write(script)
+                stdin.channel.shutdown_write()
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            out = stdout.read()
+            feeder.join()
+        self.stats.count("bytes_up", len(script))
+        self.stats.count("bytes_down", len(out))
+        self._invalidate_batch(ops)
+        results = [{"op": op, "path": path, "ok": False, "error": "no result"} for op, path in ops]
+        for line in out.decode(errors="surrogateescape").split("\n"):
+            fields = line.split("\t")
+            if len(fields) < 2 or not fields[0].isdigit():
+                continue
+            result = results[int(fields[0])]
+            result["ok"] = fields[1] == "1"
+            result["error"] = fields[2].strip() if len(fields) > 2 else ""
+        return results
+
+    def _invalidate_batch(self, ops: list[tuple[str, Path]]):
+        for op, path in ops:
+            if op == "mkdir":
+                # mkdir -p may have made any missing parent below root too
+                for d in [path] + [d for d in path.parents if d.is_relative_to(self.root) and d != self.root]:
+                    self.invalidate(d.as_posix())
+            elif op == "rm":
+                self.invalidate(path.as_posix(), recursive=True)
+            elif op in ("unzip", "unzip_keep"):
+                self.invalidate(path.parent.as_posix(), recursive=True)
+
+    def _local_batch_op(self, op: str, path: Path) -> dict:
+        result = {"op": op, "path": path, "ok": True, "error": ""}
+        try:
+            if op == "exists":
+                result["ok"] = path.exists()
+            elif op == "isdir":
+                result["ok"] = path.is_dir()
+            elif op == "isfile":
+                result["ok"] = path.is_file()
+            elif op == "mkdir":
+                path.mkdir(parents=True, exist_ok=True)
+            elif op == "rm":
+                shutil.rmtree(path) if path.is_dir() else path.unlink()
+            else:
+                self.unzip(path, overwrite_existing=op == "unzip")
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        return result
+
     def ope(self, path: Path):
         if self.remote:
-            out = self.ssh.exec_command(f"[ -e {str(path)} ] || echo 'yes'")
-            line = out[2].read().decode().strip().split(":")[-1]
-            return not "yes" in line
+            return self.batch([("exists", path)])[0]["ok"]
         else:
             return ope(path)
         
     def isdir(self, path: Path):
         if self.remote:
-            out = self.ssh.exec_command(f"[ -d {str(path)} ] || echo 'yes'")
-            line = out[2].read().decode().strip().split(":")[-1]
-            return "yes" in line
+            return self.batch([("isdir", path)])[0]["ok"]
         else:
-            return path.is_dir()
+            return Path(path).is_dir()
         
     def rm(self, path: Path):
+        path = Path(path)
         if not path.is_relative_to(self.root):
             raise ValueError(f"Path {path} does not contain root {self.root}")
         if not self.remote:
@@ -234,33 +661,33 @@ class PathRoot:
                 return shutil.rmtree(path)
             return path.unlink()
         else:
-            cmd = "rm -r " if self.isdir(path) else "rm "
-            cmd += str(path)
-            return self.run(cmd)
+            return self.batch([("rm", path)])[0]["error"]
         
     def mkdir(self, path: Path):
+        path = Path(path)
         if not path.is_relative_to(self.root):
             raise ValueError(f"Path {path} does not contain root {self.root}")
         if not self.remote:
             return path.mkdir(parents=True, exist_ok=True)
         else:
-            out = self.ssh.exec_command(f"mkdir -p {path}")
-            return out[2].read().decode().strip()
+            return self.batch([("mkdir", path)])[0]["error"]
         
     def pcat(self, root, fs, force=False):
         path = root
         for f in fs:
             path = opj(path, f)
-            if force:
-                if not self.ope(path):
-                    print(f"making {path}")
-                    self.mkdir(path)
+        if force:
+            # mkdir -p creates every missing component in one go
+            result = self.batch([("mkdir", path)])[0]
+            if not result["ok"]:
+                print(f"Error making {path}: {result['error']}")
         return path
     
     def listdirs(self, path):
-        if self.remote:
-            fs = self.get_ls_l_file_info(path)
-            fs = [f for f in fs if fs[f]["isdir"]]
-            return fs
-        else:
-            return listdir(path)
\ No newline at end of file
+        """ Names of the subdirectories of a remote path (every entry of a local one, as before) """
+        if not self.remote:
+            return listdir(path)
+        if self.listing_backend == "sftp":
+            return [e.name for e in self.list_dir(path) if e.is_dir]
+        fs = self.get_ls_l_file_info(path)
+        return [f for f in fs if fs[f]["isdir"]]
\ No newline at end of file
@@ -4,9 +4,56 @@ from os import listdir
 from datetime import datetime
 import time
 import os
+import re
+import threading
 from pathlib import Path
 from shutil import copy2 as cp
-from remotePathSync.pathroot import PathRoot
+from remotePathSync.pathroot import PathRoot, connection_pool
+from remotePathSync.transfer import TransferEngine, TransferReport
+from remotePathSync.syncindex import SyncIndex
+from remotePathSync.delta import delta_download
+from remotePathSync.scan import scan_tree, is_excluded
+from remotePathSync.jobs import JobStore, JobHistory
+from remotePathSync.compression import CompressionPolicy, parse_zip_log, file_key
+from remotePathSync.instrument import Stats, CountingFile, report_progress
+from remotePathSync.plan import SyncPlan, PlanEntry
+from remotePathSync.localwatch import PushWatcher
+from remotePathSync.watcher import JobWatcher
+from remotePathSync.localcopy import LocalCopyEngine, scan_dir
+from remotePathSync.filters import FileFilter
+from remotePathSync.tarstream import tar_create_command, tar_create_list_command, tar_extract_command, write_tar_stream, write_tar_stream_many, write_tar_stream_files, extract_tar_stream
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+@contextmanager
+def feeding_stdin(stdin, stdout, data: str):
+    """
+    Write data to a remote command's stdin from a thread while the with block reads its output.
+
+    The thread is always joined. If the block fails, the channel is closed first so a write stuck
+    on a full window returns; otherwise an error from the write is raised once the block is done.
+    """
+    errors = []
+
+    def feed():
+        try:
+            stdin.write(data)
+            stdin.channel.shutdown_write()
+        except Exception as e:
+            errors.append(e)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        yield
+    except BaseException:
+        stdout.channel.close()
+        raise
+    finally:
+        feeder.join()
+    if len(errors):
+        raise errors[0]
 
 
 class PathRootPair:
@@ -16,8 +63,14 @@ class PathRootPair:
     remote: PathRoot
     remote_root: Path | str | None = None
     remote_roots: dict[str, str | Path] | None = None
-    job_cache: dict[str, dict] = {}
+    # Seconds before the job store polls sacct (or squeue) again
     job_cache_refresh_time: float = 60
+    # Answer path_is_currently_running/pending/on_slurm_queue from squeue instead of the sacct history
+    use_squeue: bool = False
+    # Keep the job history in the cache directory so new sessions only fetch what changed since the last one
+    persist_job_history: bool = True
+    # Let compression_policy pick zip levels and stored file types from recorded ratios and link speed
+    adaptive_compression: bool = True
     hostname: str | None = None
     username: str | None = None
     hostnames: dict[str, str] | None = None
@@ -26,11 +79,30 @@ class PathRootPair:
     submit_command_template: str = "cd {path}; sbatch {slurm_file_name}"
     slurm_file_name: str = "psubmit.sh"
     exclude_fs_default = ["wfns", "n_up", "n_dn", "fluidState", "out_wforce.logx", "force"]
+    # Used instead of exclude_fs_default by transfers given neither exclude_fs nor file_filter
+    file_filter_default: FileFilter | None = None
+    # List the whole remote tree in one command in update_dir_contents instead of once per directory
+    use_manifest: bool = False
+    # Number of concurrent SFTP channels used for per-file transfers
+    transfer_workers: int = 4
+    # Digest used by checksum=True change detection (must have a matching <algorithm>sum command remotely)
+    hash_algorithm: str = "sha256"
+    # delta=True only patches files at least this large, smaller ones are re-downloaded whole
+    delta_min_size: int = 1 << 26
+    delta_block_size: int = 1 << 20
+    # Scheduled syncs bundle files smaller than bundle_threshold into one archive stream (when there are at least min_bundle_files)
+    bundle_threshold: int = 1 << 20
+    min_bundle_files: int = 8
+    # Move directories in download_dir/upload_dir as a bundle of small files plus large files in parallel (see hybrid)
+    use_hybrid: bool = False
 
 
     def __init__(self, local: PathRoot, remote: PathRoot):
         self.local = local
         self.remote = remote
+        self._sync_index = None
+        self._job_store = None
+        self._compression_policy = None
 
     @classmethod
     def from_paths(
@@ -46,7 +118,9 @@ class PathRootPair:
         usernames: dict[str, str] | None = None,
         keepalive_interval: int | None = 60, 
         try_agent=True, 
+        compress: bool | None = None,
         ):
+        """ compress turns SSH transport compression on/off (None lets the compression policy decide from the recorded link speed) """
         # TODO: Refactor to reduce redundancy with all this checking
         if (local_roots is None) and (not cls.local_roots is None):
             local_roots = cls.local_roots
@@ -85,16 +159,54 @@ class PathRootPair:
             else:
                 raise ValueError("hostname must be provided either directly or through hostnames dictionary and cluster name")
         print(f"Connecting to {hostname} (user: {username}, remote root: {remote_root}, local root: {local_root})")
+        if compress is None:
+            compress = cls.adaptive_compression and CompressionPolicy(host=hostname).ssh_compression()
         local = PathRoot(local_root, None)
-        remote = PathRoot(remote_root, hostname, try_agent, username=username)
+        remote = PathRoot(remote_root, hostname, try_agent, username=username, compress=compress)
         instance = cls(local, remote)
         if not keepalive_interval is None:
             instance.set_keepalive(keepalive_interval)
         return instance
     
-    def reconnect(self, try_agent=True):
-        hostname = self.remote.hostname
-        self.remote = PathRoot(self.remote.root, hostname, try_agent)
+    def reconnect(self, try_agent=True, compress: bool | None = None):
+        remote = self.remote
+        if compress is None:
+            compress = remote.compress
+        connection_pool.drop(remote.hostname, remote.username, port=remote.port)
+        self.remote = PathRoot(
+            remote.root, remote.hostname, try_agent,
+            username=remote.username, port=remote.port, keepalive_interval=remote.keepalive_interval,
+            compress=compress,
+            )
+        self.remote.stats = remote.stats
+
+    def set_ssh_compression(self, compress: bool | None = None):
+        """ Reconnect with SSH transport compression on or off (None: whatever the compression policy recommends) """
+        if compress is None:
+            compress = self.compression_policy.ssh_compression()
+        if compress != self.remote.compress:
+            self.reconnect(compress=compress)
+
+    @property
+    def compression_policy(self) -> CompressionPolicy:
+        """ Recorded compression ratios and link speed for this pair's host """
+        if self._compression_policy is None:
+            self._compression_policy = CompressionPolicy(host=self.remote.hostname)
+        return self._compression_policy
+
+    @property
+    def stats(self) -> Stats:
+        """
+        Counters, latency histograms and tracing hooks of this pair's remote traffic (shared with self.remote).
+
+        stats.snapshot() returns the current totals, stats.reset() starts over and
+        stats.add_hook(fn) calls fn(TraceEvent) after every timed remote operation.
+        """
+        return self.remote.stats
+
+    def _record_report(self, report: TransferReport):
+        if self.adaptive_compression:
+            self.compression_policy.record_throughput(report.n_bytes, report.elapsed)
         
 
     def set_keepalive(self, interval: int = 60):
@@ -125,87 +237,458 @@ class PathRootPair:
     def download(self, arb_path: Path | str, p=True):
         local_file, remote_file = self.get_local_remote_from_arb(Path(arb_path))
         self.local.mkdir(local_file.parent)
-        if p:
-            print(f"{remote_file} --> {local_file}")
-        self.remote.scp.get(str(remote_file), str(local_file))
+        report_progress(p, "transfer", f"{remote_file} --> {local_file}", src=remote_file, dst=local_file, download=True)
+        with self.remote.scp_lock, self.stats.timed("scp_get", str(remote_file)):
+            self.remote.scp.get(str(remote_file), str(local_file))
+        self.stats.count("channels")
+        self.stats.count("files_down")
+        if local_file.is_file():
+            self.stats.count("bytes_down", local_file.stat().st_size)
+
+    def get_transfer_engine(self, n_workers: int | None = None, p=True, resume: bool = False, verify: bool = False) -> TransferEngine:
+        """
+        Get a TransferEngine running n_workers SFTP channels over the remote SSH transport
+
+        With resume, files are moved in chunks through '.part' files whose progress is kept in the sync index,
+        so an interrupted transfer (dropped connection, reconnect, restart) continues where it stopped.
+        With verify, every finished file is also checked against a remote digest.
+        """
+        if n_workers is None:
+            n_workers = self.transfer_workers
+        remote_digest = None
+        if verify:
+            remote_digest = lambda path: self.remote.get_hashes([str(path)], algorithm=self.hash_algorithm).get(str(path))
+        return TransferEngine(
+            [self.remote.ssh.get_transport()], n_workers=n_workers, p=p,
+            resume_index=self.sync_index if resume else None,
+            remote_digest=remote_digest, digest_algorithm=self.hash_algorithm,
+            stats=self.stats, on_upload=self.remote.invalidate,
+            )
+
+    def download_many(self, arb_paths: list[Path | str], p=True, n_workers: int | None = None, resume: bool = False, verify: bool = False) -> TransferReport:
+        """ Download many files concurrently """
+        with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+            for arb_path in arb_paths:
+                local_file, remote_file = self.get_local_remote_from_arb(Path(arb_path))
+                engine.submit_download(remote_file, local_file)
+            report = engine.wait()
+        self._record_report(report)
+        report_progress(p, "report", str(report), report=report)
+        return report
+
+    def upload_many(self, arb_paths: list[Path | str], p=True, n_workers: int | None = None, resume: bool = False, verify: bool = False) -> TransferReport:
+        """ Upload many files concurrently """
+        local_remote = [self.get_local_remote_from_arb(Path(arb_path)) for arb_path in arb_paths]
+        self.remote.batch([("mkdir", remote_dir) for remote_dir in {remote_file.parent for _, remote_file in local_remote}])
+        with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+            for local_file, remote_file in local_remote:
+                engine.submit_upload(local_file, remote_file)
+            report = engine.wait()
+        self._record_report(report)
+        report_progress(p, "report", str(report), report=report)
+        return report
     
 
-    def zip_download(self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None):
-        self.zip_transfer(arb_path, True, p=p, exclude_fs=exclude_fs, include_fs=include_fs)
+    def get_file_filter(self, exclude_fs: list[str] | None = None, include_fs=None, file_filter: FileFilter | None = None) -> FileFilter:
+        """
+        The FileFilter a transfer selects files with: file_filter if given, otherwise one built from
+        the exclude_fs/include_fs name lists (file_filter_default, or exclude_fs_default, when neither is given)
+        """
+        if not file_filter is None:
+            return file_filter
+        if (exclude_fs is None) and (include_fs is None) and (not self.file_filter_default is None):
+            return self.file_filter_default
+        return FileFilter.from_lists(self.exclude_fs_default if exclude_fs is None else exclude_fs, include_fs)
+
+    def zip_download(self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None, file_filter: FileFilter | None = None):
+        self.zip_transfer(arb_path, True, p=p, exclude_fs=exclude_fs, include_fs=include_fs, file_filter=file_filter)
 
-    def zip_upload(self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None):
-        self.zip_transfer(arb_path, False, p=p, exclude_fs=exclude_fs, include_fs=include_fs)
+    def zip_upload(self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None, file_filter: FileFilter | None = None):
+        self.zip_transfer(arb_path, False, p=p, exclude_fs=exclude_fs, include_fs=include_fs, file_filter=file_filter)
 
-    def zip_transfer(self, arb_path: Path, download: bool, p: bool = True, exclude_fs=["wfns"], include_fs=None, overwrite_existing=True):
+    def zip_transfer(
+            self, arb_path: Path, download: bool, p: bool = True, exclude_fs=["wfns"], include_fs=None, overwrite_existing=True,
+            file_filter: FileFilter | None = None,
+            ):
         ret_step = -1 if download else 1
         uploader, downloader = (self.local, self.remote)[::ret_step]
         upload_dir, download_dir = self.get_local_remote_from_arb(arb_path)[::ret_step]
-        upload_zip, download_zip = self.get_local_remote_from_arb(
-                uploader.make_zip(upload_dir, exclude_fs=exclude_fs, include_fs=include_fs)
-                )[::ret_step]
-        _ = self.download(download_zip, p=p) if download else self.upload(upload_zip, p=p)
+        level, store_suffixes = None, None
+        if self.adaptive_compression:
+            level, store_suffixes = self.compression_policy.zip_level(), self.compression_policy.store_suffixes()
+        zip_path, log = uploader.make_zip(
+            upload_dir, level=level, store_suffixes=store_suffixes, return_log=True,
+            file_filter=self.get_file_filter(exclude_fs, include_fs, file_filter),
+            )
+        upload_zip, download_zip = self.get_local_remote_from_arb(zip_path)[::ret_step]
+        start = time.time()
+        with self.stats.timed("zip_transfer", str(upload_dir)):
+            _ = self.download(download_zip, p=p) if download else self.upload(upload_zip, p=p)
+        if self.adaptive_compression:
+            policy = self.compression_policy
+            policy.record_throughput(os.path.getsize(download_zip if download else upload_zip), time.time() - start)
+            if level != 0:
+                # Files zip was told to store say nothing about how well their type compresses
+                stored = set(store_suffixes)
+                policy.record_ratios({f: r for f, r in parse_zip_log(log).items() if not file_key(f) in stored})
         uploader.rm(upload_zip)
-        downloader.unzip(download_zip, overwrite_existing=overwrite_existing)
-        downloader.rm(download_zip)
+        results = downloader.batch([("unzip" if overwrite_existing else "unzip_keep", download_zip), ("rm", download_zip)])
+        for result in results:
+            if not result["ok"]:
+                report_progress(p, "error", f"Error running {result['op']} on {result['path']}: {result['error']}", always=True, **result)
+
+
+    def tar_download(
+            self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None, compress: str | None = "gz",
+            file_filter: FileFilter | None = None,
+            ):
+        self.tar_transfer(arb_path, True, p=p, exclude_fs=exclude_fs, include_fs=include_fs, compress=compress, file_filter=file_filter)
+
+    def tar_upload(
+            self, arb_path: Path, p: bool = True, exclude_fs=["wfns"], include_fs=None, compress: str | None = "gz",
+            file_filter: FileFilter | None = None,
+            ):
+        self.tar_transfer(arb_path, False, p=p, exclude_fs=exclude_fs, include_fs=include_fs, compress=compress, file_filter=file_filter)
+
+    def tar_transfer(
+            self, arb_path: Path, download: bool, p: bool = True, exclude_fs=["wfns"], include_fs=None, compress: str | None = "gz",
+            file_filter: FileFilter | None = None,
+            ):
+        """
+        Stream a directory through an exec channel as a (optionally compressed) tar archive.
+
+        Nothing is written to disk on either side besides the extracted files, and archiving,
+        transfer and extraction all run at the same time. compress="auto" lets the compression
+        policy choose the codec for this link.
+        """
+        if compress == "auto":
+            compress = self.compression_policy.tar_codec()
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        local_dir, remote_dir = self.get_local_remote_from_arb(arb_path)
+        with self.stats.timed("tar_stream", str(remote_dir)):
+            if download:
+                report_progress(p, "transfer", f"{remote_dir} --> {local_dir} (tar stream)", src=remote_dir, dst=local_dir, download=True)
+                if file_filter.find_exact:
+                    stdin, stdout, stderr = self.remote.exec_command(
+                        tar_create_command(remote_dir, compress=compress, file_filter=file_filter)
+                        )
+                    stdin.channel.shutdown_write()
+                    extract_tar_stream(CountingFile(stdout, self.stats, "bytes_down"), local_dir.parent, compress=compress)
+                else:
+                    # The filter needs the listing checked in Python, so tar gets the names it kept
+                    names = [remote_dir.name] + [f"{remote_dir.name}/{f}" for f, _ in self.remote.iter_manifest(remote_dir, file_filter=file_filter)]
+                    stdin, stdout, stderr = self.remote.exec_command(tar_create_list_command(remote_dir.parent, compress=compress, recursive=False))
+                    with feeding_stdin(stdin, stdout, "".join(f"{name}\0" for name in names)):
+                        extract_tar_stream(CountingFile(stdout, self.stats, "bytes_down"), local_dir.parent, compress=compress)
+            else:
+                report_progress(p, "transfer", f"{local_dir} --> {remote_dir} (tar stream)", src=local_dir, dst=remote_dir, download=False)
+                stdin, stdout, stderr = self.remote.exec_command(tar_extract_command(remote_dir.parent, compress=compress))
+                write_tar_stream(CountingFile(stdin, self.stats, "bytes_up"), local_dir, compress=compress, file_filter=file_filter)
+                stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+        if not download:
+            self.remote.invalidate(remote_dir, recursive=True)
+        if status != 0:
+            raise RuntimeError(f"Remote tar exited with status {status}: {stderr.read().decode().strip()}")
 
+    def tar_upload_many(
+            self, arb_paths: list[Path], p: bool = True, exclude_fs=["wfns"], include_fs=None, compress: str | None = "gz",
+            file_filter: FileFilter | None = None,
+            ):
+        """ Upload several directories through a single tar stream (stored relative to the roots, so they land at their remote paths) """
+        local_dirs = [self.get_local_remote_from_arb(arb_path)[0] for arb_path in arb_paths]
+        if not len(local_dirs):
+            return
+        if compress == "auto":
+            compress = self.compression_policy.tar_codec()
+        report_progress(p, "transfer", f"{len(local_dirs)} directories --> {self.remote.root} (tar stream)", src=local_dirs, dst=self.remote.root, download=False)
+        with self.stats.timed("tar_stream", f"{len(local_dirs)} directories"):
+            stdin, stdout, stderr = self.remote.exec_command(tar_extract_command(self.remote.root, compress=compress))
+            write_tar_stream_many(
+                CountingFile(stdin, self.stats, "bytes_up"), local_dirs, self.local.root,
+                compress=compress, file_filter=self.get_file_filter(exclude_fs, include_fs, file_filter),
+                )
+            stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+        for local_dir in local_dirs:
+            self.remote.invalidate(self.get_remote_path(local_dir), recursive=True)
+        if status != 0:
+            raise RuntimeError(f"Remote tar exited with status {status}: {stderr.read().decode().strip()}")
 
     def download_dir(self, arb_path: Path, p: bool = True, as_zip: bool = True,
                      exclude_fs: list[str] | None = None,
-                     include_fs=None, update_existing=True):
-        if exclude_fs is None:
-            exclude_fs = self.exclude_fs_default
-        if not as_zip:
+                     include_fs=None, update_existing=True, manifest: bool | None = None,
+                     n_workers: int | None = None, checksum: bool = False, delta: bool = False,
+                     as_tar: bool = False, compress: str | None = "gz",
+                     resume: bool = False, verify: bool = False,
+                     hybrid: bool | None = None, bundle_threshold: int | None = None, min_bundle_files: int | None = None,
+                     file_filter: FileFilter | None = None):
+        """
+        Download a remote directory as a zip archive, a tar stream (as_tar) or file by file (as_zip=False).
+
+        File by file with resume, files that are already complete locally are kept (regardless of update_existing)
+        and interrupted downloads continue from their last completed chunk.
+        hybrid (default use_hybrid) splits the directory by its listing instead: files below bundle_threshold
+        come down as one tar stream and the rest file by file in parallel (see execute_plan), skipping
+        unchanged files unless update_existing. The returned TransferReport shows how each part moved.
+        Every mode selects files with the same FileFilter (see get_file_filter).
+        """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        if hybrid is None:
+            hybrid = self.use_hybrid
+        if hybrid:
+            # One find for the whole tree unless asked otherwise, per-directory listings would cost more than the bundle saves
+            plan = self.plan_update(
+                Path(arb_path), file_filter=file_filter,
+                force_download=update_existing and not resume, checksum=checksum,
+                manifest=True if manifest is None else manifest,
+                )
+            return self.execute_plan(
+                plan, p=p, n_workers=n_workers, bundle_threshold=bundle_threshold, min_bundle_files=min_bundle_files,
+                compress=compress, delta=delta, resume=resume, verify=verify,
+                )
+        if as_tar:
+            self.tar_download(Path(arb_path), p=p, compress=compress, file_filter=file_filter)
+        elif not as_zip:
             self.update_dir_contents(
                 Path(arb_path),
-                p=p, force_download=update_existing,
+                p=p, force_download=update_existing and not resume,
+                file_filter=file_filter,
+                manifest=manifest,
+                n_workers=n_workers,
+                checksum=checksum,
+                delta=delta,
+                resume=resume,
+                verify=verify,
                 )
         else:
-            self.zip_download(Path(arb_path), p=p, exclude_fs=exclude_fs, include_fs=include_fs)
+            self.zip_download(Path(arb_path), p=p, file_filter=file_filter)
             
 
     def upload_dir(self, arb_path: Path, p: bool = True, as_zip: bool = True,
                      exclude_fs: list[str] | None = None,
-                     include_fs=None, update_existing=True):
-        if exclude_fs is None:
-            exclude_fs = self.exclude_fs_default
-        if not as_zip:
+                     include_fs=None, update_existing=True, n_workers: int | None = None,
+                     as_tar: bool = False, compress: str | None = "gz",
+                     resume: bool = False, verify: bool = False,
+                     hybrid: bool | None = None, bundle_threshold: int | None = None, min_bundle_files: int | None = None,
+                     file_filter: FileFilter | None = None):
+        """
+        Upload a local directory as a zip archive, a tar stream (as_tar) or file by file (as_zip=False).
+
+        File by file with resume, files already complete remotely are skipped and interrupted uploads
+        continue from their last completed chunk.
+        hybrid works as in download_dir, from a local scan and one remote listing (see plan_upload).
+        """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        if hybrid is None:
+            hybrid = self.use_hybrid
+        if hybrid:
+            plan = self.plan_upload(Path(arb_path), file_filter=file_filter, update_existing=update_existing)
+            return self.execute_plan(
+                plan, p=p, n_workers=n_workers, bundle_threshold=bundle_threshold, min_bundle_files=min_bundle_files,
+                compress=compress, resume=resume, verify=verify,
+                )
+        if as_tar:
+            self.tar_upload(Path(arb_path), p=p, compress=compress, file_filter=file_filter)
+        elif not as_zip:
             self.upload_recursive(
                 Path(arb_path),
                 p=p,
+                n_workers=n_workers,
+                resume=resume,
+                verify=verify,
+                file_filter=file_filter,
                 )
         else:
-            self.zip_upload(Path(arb_path), p=p, exclude_fs=exclude_fs, include_fs=include_fs)
+            self.zip_upload(Path(arb_path), p=p, file_filter=file_filter)
             
 
     def upload(self, arb_file_path: Path | str, p=True):
         local_file, remote_file = self.get_local_remote_from_arb(Path(arb_file_path))
         msg = self.remote.mkdir(remote_file.parent)
-        if p:
-            print(msg)
-            print(f"{local_file} --> {remote_file}")
-        self.remote.scp.put(str(local_file), str(remote_file.parent))
+        if msg:
+            report_progress(p, "error", msg, path=remote_file.parent)
+        report_progress(p, "transfer", f"{local_file} --> {remote_file}", src=local_file, dst=remote_file, download=False)
+        with self.remote.scp_lock, self.stats.timed("scp_put", str(local_file)):
+            self.remote.scp.put(str(local_file), str(remote_file.parent))
+        self.remote.invalidate(remote_file)
+        self.stats.count("channels")
+        self.stats.count("files_up")
+        self.stats.count("bytes_up", local_file.stat().st_size)
 
     def uploads(self, arb_dir_path: Path, file_list: list[str], p=True):
         local_dir, remote_dir = self.get_local_remote_from_arb(arb_dir_path)
-        if p:
-            print(f"{file_list}: {local_dir} --> {remote_dir}")
-        self.remote.scp.put(" ".join([str(local_dir / f) for f in file_list]), remote_dir)
+        report_progress(p, "transfer", f"{file_list}: {local_dir} --> {remote_dir}", src=local_dir, dst=remote_dir, files=file_list, download=False)
+        with self.remote.scp_lock, self.stats.timed("scp_put", str(local_dir)):
+            self.remote.scp.put(" ".join([str(local_dir / f) for f in file_list]), remote_dir)
+        for f in file_list:
+            self.remote.invalidate(remote_dir / f)
+        self.stats.count("channels")
+        self.stats.count("files_up", len(file_list))
+
+    def upload_recursive(
+            self, arb_path: Path, p=True, n_workers: int | None = None, resume: bool = False, verify: bool = False,
+            exclude_fs: list[str] | None = None, chunk_size: int = 1000, file_filter: FileFilter | None = None,
+            ):
+        """
+        Upload a local directory file by file.
 
-    def upload_recursive(self, arb_path: Path, p=True):
+        The local tree is scanned in parallel (see scan_tree) and uploads start while the scan is
+        still running: every chunk_size entries, the new remote directories are created in one round
+        trip and the files are queued on the transfer engine. Symlinks are followed, so linked
+        directories go up as directories (broken links are skipped).
+        """
         local_path, remote_path = self.get_local_remote_from_arb(arb_path)
-        self.remote.mkdir(remote_path)
-        subfiles = [f for f in listdir(local_path) if not (local_path / f).is_dir()]
-        subfiles = [f for f in subfiles if not f.startswith("._")]
-        subdirs = [f for f in listdir(local_path) if (local_path / f).is_dir()]
-        for f in subfiles:
-            self.upload(local_path / f, p=p)
-        for d in subdirs:
-            self.upload_recursive(local_path / d, p=p)
+        file_filter = self.get_file_filter(exclude_fs or [], None, file_filter)
+        remote_files = None
+        if resume:
+            # One listing of what already made it across on a previous attempt
+            remote_files = {str(remote_path / f): info for f, info in self.remote.iter_manifest(remote_path)}
+        with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+            subdirs = [local_path]
+            subfiles = []
+            def flush():
+                # Parents come out of the scan before their contents, so these mkdirs cover every queued file
+                for result in self.remote.batch([("mkdir", self.get_remote_path(d)) for d in subdirs]):
+                    if not result["ok"]:
+                        report_progress(p, "error", f"Error making {result['path']}: {result['error']}", always=True, **result)
+                for entry in subfiles:
+                    remote_file = self.get_remote_path(entry.path)
+                    if not remote_files is None:
+                        info = remote_files.get(str(remote_file))
+                        if (not info is None) and info["size"] == entry.size and info["time"].timestamp() >= entry.mtime:
+                            continue
+                    engine.submit_upload(Path(entry.path), remote_file)
+                subdirs.clear()
+                subfiles.clear()
+            for entry in scan_tree(local_path, exclude=["._*"], file_filter=file_filter, follow_symlinks=True):
+                if entry.is_dir:
+                    subdirs.append(Path(entry.path))
+                else:
+                    subfiles.append(entry)
+                if len(subdirs) + len(subfiles) >= chunk_size:
+                    flush()
+            flush()
+            report = engine.wait()
+            report_progress(p, "report", str(report), report=report)
+
+    def watch_push(self, arb_dir: Path | None = None, start: bool = True, **kwargs) -> PushWatcher:
+        """
+        Push local edits below arb_dir (default the whole local root) to the remote as they happen.
+
+        Returns the PushWatcher (started unless start=False), stop() it to end the watch. kwargs are
+        passed on to PushWatcher (exclude_fs, debounce, max_delay, use_inotify, poll_interval, p, on_push).
+        """
+        watcher = PushWatcher(self, arb_dir=arb_dir, **kwargs)
+        if start:
+            watcher.start()
+        return watcher
+
+    def watch_jobs(self, paths: list[Path], start: bool = True, **kwargs) -> JobWatcher:
+        """
+        Pull the results of each of paths as soon as its Slurm job finishes.
+
+        Returns the JobWatcher (started unless start=False, or run() it as an asyncio task), stop() it
+        to end the watch. kwargs are passed on to JobWatcher (interval, check_days, on_transition,
+        on_synced, download_kwargs, download_workers, include_finished, untrack_synced, p).
+        """
+        watcher = JobWatcher(self, paths=paths, **kwargs)
+        if start:
+            watcher.start()
+        return watcher
+
+    @property
+    def sync_index(self) -> SyncIndex:
+        """ Persistent index of the last known remote state of synced files (stored outside the data directories) """
+        if self._sync_index is None:
+            self._sync_index = SyncIndex.for_roots(self.remote.hostname, self.remote.root, self.local.root)
+        return self._sync_index
+
+    def get_index_key(self, arb_path: Path | str) -> str:
+        """ Key of a local or remote path in the sync index (path relative to the roots) """
+        key = self.get_local_remote_from_arb(arb_path)[1].relative_to(self.remote.root).as_posix()
+        return "" if key == "." else key
+
+    def download_delta(self, arb_path: Path | str, p=True, block_size: int | None = None, sftp=None) -> int:
+        """
+        Bring an existing local copy up to date by fetching only the blocks that differ from the remote file.
+
+        Blocks are compared at fixed offsets, which covers appended output and in-place edits.
+        Returns the number of bytes fetched.
+        """
+        local_file, remote_file = self.get_local_remote_from_arb(Path(arb_path))
+        if block_size is None:
+            block_size = self.delta_block_size
+        report_progress(p, "transfer", f"{remote_file} --> {local_file} (delta)", src=remote_file, dst=local_file, download=True)
+        remote_size, remote_hashes = self.remote.get_block_hashes(remote_file, block_size)
+        if sftp is None:
+            with self.remote.open_sftp() as sftp:
+                return delta_download(sftp, remote_file, local_file, remote_size, remote_hashes, block_size)
+        return delta_download(sftp, remote_file, local_file, remote_size, remote_hashes, block_size)
+
+    def _submit_indexed_download(self, engine: TransferEngine, remote_file: Path, local_file: Path, info: dict, delta: bool = False):
+        """ Queue a download and record the remote metadata in the sync index once it succeeds """
+        key = self.get_index_key(remote_file)
+        entry = {"isdir": False, "size": int(info["size"]), "mtime": info["time"].timestamp()}
+        if delta and int(info["size"]) >= self.delta_min_size and local_file.exists():
+            future = engine.submit_task(
+                str(remote_file),
+                lambda sftp: self.download_delta(remote_file, p=engine.p, sftp=sftp),
+                )
+        else:
+            future = engine.submit_download(remote_file, local_file)
+        future.add_done_callback(lambda fut: self._index_if_succeeded(fut, {key: entry}))
+
+    def _index_if_succeeded(self, future, entries: dict[str, dict]):
+        """ Record entries in the sync index if the transfer future finished without an error """
+        # Engine futures resolve to False on failure, and a delta that found nothing to fetch moved 0 bytes
+        if future.exception() is None and future.result() is not False:
+            self.sync_index.update(entries)
+
+    def _index_says_changed(self, key: str, info: dict) -> bool | None:
+        """ True/False if the sync index knows whether the remote file changed, None if it has no entry """
+        entry = self.sync_index.get(key)
+        if entry is None:
+            return None
+        # Whole seconds, since SFTP listings carry no fractional mtimes while find manifests do
+        return not (entry["size"] == int(info["size"]) and int(entry["mtime"]) == int(info["time"].timestamp()))
+
+    def get_changed_by_checksum(self, candidates: dict[str, tuple[Path, Path, dict]], n_workers: int = 8) -> list[str]:
+        """
+        Return the keys of candidates ({key: (remote_file, local_file, remote info)}) whose contents differ.
+
+        Files with differing sizes are changed without hashing. The rest are hashed remotely in one
+        batched command while the local copies are hashed in a thread pool.
+        """
+        changed = []
+        same_size = {}
+        for key, (remote_file, local_file, info) in candidates.items():
+            if local_file.stat().st_size != int(info["size"]):
+                changed.append(key)
+            else:
+                same_size[key] = (remote_file, local_file, info)
+        if not len(same_size):
+            return changed
+        remote_files = [str(remote_file) for remote_file, _, _ in same_size.values()]
+        local_files = [str(local_file) for _, local_file, _ in same_size.values()]
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            remote_future = pool.submit(self.remote.get_hashes, remote_files, algorithm=self.hash_algorithm)
+            local_hashes = self.local.get_hashes(local_files, algorithm=self.hash_algorithm, n_workers=n_workers, cache=self.sync_index)
+            remote_hashes = remote_future.result()
+        unchanged = {}
+        for key, (remote_file, local_file, info) in same_size.items():
+            remote_hash = remote_hashes.get(str(remote_file))
+            if (remote_hash is None) or (remote_hash != local_hashes[str(local_file)]):
+                changed.append(key)
+            else:
+                unchanged[self.get_index_key(remote_file)] = {
+                    "isdir": False, "size": int(info["size"]), "mtime": info["time"].timestamp(), "hash": remote_hash,
+                    }
+        self.sync_index.update(unchanged)
+        return changed
 
     def write_dir_updated_timestamp(self, path):
-        with open(opj(path, "last_updated.txt"), "w") as f:
-            f.write(str(float(time.time())))
-        f.close()
+        self.sync_index.set_synced(self.get_index_key(path))
 
     def update_dir_contents(
             self, arb_dir: Path, 
@@ -214,56 +697,477 @@ class PathRootPair:
             include_fs=None,
             recursive=True,
             force_download=False,
+            manifest: bool | None = None,
+            n_workers: int | None = None,
+            skip_unchanged_dirs: bool = False,
+            checksum: bool = False,
+            delta: bool = False,
+            resume: bool = False,
+            verify: bool = False,
+            dry_run: bool = False,
+            scheduled: bool = False,
+            priority: list[str] | None = None,
+            file_filter: FileFilter | None = None,
+            engine: TransferEngine | None = None,
+            _visited_dirs: dict[str, dict] | None = None,
+            _reldir: str = "",
             ):
-        if exclude_fs is None:
-            exclude_fs = self.exclude_fs_default
+        """
+        Download new and outdated files from the remote copy of arb_dir.
+
+        Files whose remote size/mtime match the sync index are skipped without comparing local metadata.
+        With skip_unchanged_dirs, subdirectories whose remote mtime has not moved since the last complete
+        sync are skipped together with everything below them. A directory's mtime only moves when entries
+        are added to, removed from or renamed in that directory itself, so this misses files edited in
+        place and any file created, changed or removed in a deeper subdirectory. Only use it for trees
+        written once per directory (finished calculation outputs), and run a full update now and then.
+        With checksum, existing local files are compared by content digest instead of time and size.
+        With delta, outdated local files above delta_min_size are patched block by block instead of re-downloaded.
+        resume and verify are passed on to get_transfer_engine.
+        With dry_run, nothing moves and the SyncPlan (see plan_update) is returned instead. With scheduled,
+        the plan is carried out by execute_plan, which bundles small files and moves priority patterns first.
+        file_filter (see get_file_filter) replaces exclude_fs/include_fs, and the subdirectories it prunes are never listed.
+        """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        if manifest is None:
+            manifest = self.use_manifest
+        if dry_run or scheduled:
+            plan = self.plan_update(
+                arb_dir, file_filter=file_filter, recursive=recursive,
+                force_download=force_download, checksum=checksum, manifest=manifest,
+                )
+            if dry_run:
+                estimate = self.estimate_plan(plan, n_workers=n_workers)
+                report_progress(
+                    p, "plan", f"{plan}\nEstimated {estimate['scheduled']:.1f} s scheduled, {estimate['per_file']:.1f} s file by file",
+                    plan=plan, estimate=estimate,
+                    )
+                return plan
+            return self.execute_plan(plan, p=p, n_workers=n_workers, priority=priority, delta=delta, resume=resume, verify=verify)
+        if manifest:
+            return self.update_dir_contents_manifest(
+                arb_dir, file_filter=file_filter, p=p,
+                recursive=recursive, force_download=force_download,
+                n_workers=n_workers, checksum=checksum, delta=delta,
+                resume=resume, verify=verify,
+                )
+        if engine is None:
+            # The engine's worker threads and SFTP channels are released even if the walk fails
+            with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+                visited_dirs = {}
+                self.update_dir_contents(
+                    arb_dir, file_filter=file_filter, recursive=recursive, force_download=force_download, p=p,
+                    skip_unchanged_dirs=skip_unchanged_dirs, checksum=checksum, delta=delta,
+                    engine=engine, _visited_dirs=visited_dirs, _reldir=_reldir,
+                    )
+                report = engine.wait()
+            self._record_report(report)
+            report_progress(p, "report", str(report), report=report)
+            # Only trust directory mtimes once everything below them made it across
+            if not len(report.errors):
+                self.sync_index.update(visited_dirs)
+            return
         local_dir, remote_dir = self.get_local_remote_from_arb(arb_dir)
         local_dir.mkdir(parents=True, exist_ok=True)
         remote_files = self.remote.get_ls_l_file_info(remote_dir)
         local_files = self.local.get_ls_fs(local_dir)
-        download_fs = list(remote_files.keys())
-        download_fs = [f for f in download_fs if not remote_files[f]["isdir"]]
-        download_fs = [f for f in download_fs if not f in exclude_fs]
-        if not include_fs is None:
-            download_fs = [f for f in download_fs if f in include_fs]
+        download_fs = [
+            f for f, info in remote_files.items()
+            if (not info["isdir"]) and file_filter.match_file(_reldir + f, int(info["size"]), info["time"].timestamp())
+        ]
         need_fs = [f for f in download_fs if (not f in local_files)]
         update_fs = [f for f in download_fs if not f in need_fs]
         if not force_download:
             _update_fs = []
+            up_to_date = {}
+            checksum_fs = {}
             for f in update_fs:
-                local_time = datetime.fromtimestamp(getatime(opj(local_dir, f)))
-                remote_time = remote_files[f]["time"]
-                local_size = os.path.getsize(opj(local_dir, f))
-                remote_size = remote_files[f]["size"]
-                outdated = local_time < remote_time
-                dif_size = local_size != int(remote_size)
-                if outdated or dif_size:
+                key = self.get_index_key(remote_dir / f)
+                changed = self._index_says_changed(key, remote_files[f])
+                if checksum and (changed is not False):
+                    checksum_fs[f] = (remote_dir / f, local_dir / f, remote_files[f])
+                    continue
+                if changed is None:
+                    local_time = datetime.fromtimestamp(getatime(opj(local_dir, f)))
+                    remote_time = remote_files[f]["time"]
+                    local_size = os.path.getsize(opj(local_dir, f))
+                    remote_size = remote_files[f]["size"]
+                    outdated = local_time < remote_time
+                    dif_size = local_size != int(remote_size)
+                    changed = outdated or dif_size
+                    if not changed:
+                        up_to_date[key] = {"isdir": False, "size": int(remote_size), "mtime": remote_time.timestamp()}
+                if changed:
                     _update_fs.append(f)
+            if len(checksum_fs):
+                _update_fs += self.get_changed_by_checksum(checksum_fs)
             update_fs = _update_fs
+            self.sync_index.update(up_to_date)
         if len(need_fs) or len(update_fs):
-            print(f"Updating {remote_dir} --> {local_dir}")
-            print(f"Updating files {update_fs}")
-            print(f"Downloading files {need_fs}")
+            report_progress(
+                p, "plan", f"Updating {remote_dir} --> {local_dir}\nUpdating files {update_fs}\nDownloading files {need_fs}",
+                src=remote_dir, dst=local_dir, update=update_fs, new=need_fs,
+                )
             download_fs = update_fs + need_fs
             for f in download_fs:
-                self.download(remote_dir / f, p=p)
+                self._submit_indexed_download(engine, remote_dir / f, local_dir / f, remote_files[f], delta=delta)
         self.write_dir_updated_timestamp(local_dir)
         if recursive:
-            remote_dirs = [f for f in remote_files if remote_files[f]["isdir"]]
+            remote_dirs = [f for f in remote_files if remote_files[f]["isdir"] and file_filter.match_dir(_reldir + f)]
             for d in remote_dirs:
+                key = self.get_index_key(remote_dir / d)
+                _visited_dirs[key] = {"isdir": True, "size": int(remote_files[d]["size"]), "mtime": remote_files[d]["time"].timestamp()}
+                if skip_unchanged_dirs and (not force_download) and self._index_says_changed(key, remote_files[d]) is False:
+                    continue
                 self.update_dir_contents(
                     local_dir / d,
-                    exclude_fs=exclude_fs,
-                    include_fs=include_fs,
+                    file_filter=file_filter,
                     recursive=recursive,
                     force_download=force_download,
-                    p=p
+                    p=p,
+                    skip_unchanged_dirs=skip_unchanged_dirs,
+                    checksum=checksum,
+                    delta=delta,
+                    engine=engine,
+                    _visited_dirs=_visited_dirs,
+                    _reldir=f"{_reldir}{d}/",
                     )
 
+    def update_dir_contents_manifest(
+            self, arb_dir: Path,
+            exclude_fs: list[str] | None = None,
+            p=True,
+            include_fs=None,
+            recursive=True,
+            force_download=False,
+            n_workers: int | None = None,
+            checksum: bool = False,
+            delta: bool = False,
+            resume: bool = False,
+            verify: bool = False,
+            file_filter: FileFilter | None = None,
+            ):
+        """ Same as update_dir_contents, but diffs the whole tree from one remote listing (with file_filter pushed into it) instead of one per directory """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        local_dir, remote_dir = self.get_local_remote_from_arb(arb_dir)
+        local_dir.mkdir(parents=True, exist_ok=True)
+        maxdepth = None if recursive else 1
+        local_files = self.local.get_manifest(local_dir, maxdepth=maxdepth)
+        download_fs = {}
+        up_to_date = {}
+        checksum_fs = {}
+        seen = set()
+        dirs = [""]
+        for f, info in self.remote.iter_manifest(remote_dir, maxdepth=maxdepth, file_filter=file_filter):
+            if info["isdir"]:
+                dirs.append(f)
+                continue
+            key = self.get_index_key(remote_dir / f)
+            seen.add(key)
+            if (not f in local_files) or force_download:
+                download_fs[f] = info
+                continue
+            changed = self._index_says_changed(key, info)
+            if checksum and (changed is not False):
+                checksum_fs[f] = (remote_dir / f, local_dir / f, info)
+                continue
+            if changed is None:
+                outdated = local_files[f]["time"] < info["time"]
+                dif_size = local_files[f]["size"] != info["size"]
+                changed = outdated or dif_size
+                if not changed:
+                    up_to_date[key] = {"isdir": False, "size": info["size"], "mtime": info["time"].timestamp()}
+            if changed:
+                download_fs[f] = info
+        self.sync_index.update(up_to_date)
+        if len(checksum_fs):
+            for f in self.get_changed_by_checksum(checksum_fs):
+                download_fs[f] = checksum_fs[f][2]
+        if recursive:
+            indexed = self.sync_index.get_many(self.get_index_key(remote_dir))
+            self.sync_index.remove([k for k in indexed if (not indexed[k]["isdir"]) and (not k in seen)])
+        if len(download_fs):
+            report_progress(
+                p, "plan", f"Updating {remote_dir} --> {local_dir}\nDownloading files {list(download_fs)}",
+                src=remote_dir, dst=local_dir,
+                update=[f for f in download_fs if f in local_files], new=[f for f in download_fs if not f in local_files],
+                )
+            with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+                for f, info in download_fs.items():
+                    self._submit_indexed_download(engine, remote_dir / f, local_dir / f, info, delta=delta)
+                report = engine.wait()
+            self._record_report(report)
+            report_progress(p, "report", str(report), report=report)
+        for d in dirs:
+            (local_dir / d).mkdir(parents=True, exist_ok=True)
+        self.sync_index.set_synced_many([self.get_index_key(local_dir / d) for d in dirs])
+
+    def _remote_file_tree(
+            self, remote_dir: Path, recursive: bool = True, manifest: bool = False, file_filter: FileFilter | None = None,
+            ) -> dict[str, dict]:
+        """ {relative path: {"isdir", "size", "time"}} of everything below remote_dir that file_filter keeps, from one find or one listing per directory """
+        if manifest:
+            return self.remote.get_manifest(remote_dir, maxdepth=None if recursive else 1, file_filter=file_filter)
+        tree = {}
+        pending = [""]
+        while len(pending):
+            reldir = pending.pop()
+            for name, info in self.remote.get_ls_l_file_info(remote_dir / reldir if len(reldir) else remote_dir).items():
+                relpath = f"{reldir}/{name}" if len(reldir) else name
+                if not file_filter is None:
+                    if info["isdir"] and not file_filter.match_dir(relpath):
+                        continue
+                    if (not info["isdir"]) and not file_filter.match_file(relpath, int(info["size"]), info["time"].timestamp()):
+                        continue
+                tree[relpath] = info
+                if info["isdir"] and recursive:
+                    pending.append(relpath)
+        return tree
+
+    def plan_update(
+            self, arb_dir: Path,
+            exclude_fs: list[str] | None = None,
+            include_fs=None,
+            recursive=True,
+            force_download=False,
+            checksum: bool = False,
+            manifest: bool | None = None,
+            file_filter: FileFilter | None = None,
+            ) -> SyncPlan:
+        """
+        Work out what update_dir_contents would download for arb_dir, without moving anything.
+
+        Remote files are "new" if missing locally, "changed" if the sync index (or, without an index
+        entry, the local mtime and size, or with checksum their digests) says so and "skipped" otherwise,
+        with the reason in each entry. Local files the remote no longer has are listed as "deleted".
+        Subtrees pruned by file_filter are never listed; files failing only its size/age predicates
+        are listed as "skipped", so their local copies are not mistaken for deletions.
+        """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        if manifest is None:
+            manifest = self.use_manifest
+        local_dir, remote_dir = self.get_local_remote_from_arb(arb_dir)
+        remote_files = self._remote_file_tree(remote_dir, recursive=recursive, manifest=manifest, file_filter=file_filter.paths_only())
+        local_files = self.local.get_manifest(local_dir, maxdepth=None if recursive else 1)
+        plan = SyncPlan(remote_dir, local_dir, download=True)
+        plan.dirs = [f for f, info in remote_files.items() if info["isdir"]]
+
+        checksum_fs = {}
+        for f, info in remote_files.items():
+            if info["isdir"]:
+                continue
+            size, mtime = int(info["size"]), info["time"]
+            if not file_filter.match_file(f, size, mtime.timestamp()):
+                plan.add(f, "skipped", size, mtime, "excluded")
+            elif not f in local_files:
+                plan.add(f, "new", size, mtime, "not local")
+            elif force_download:
+                plan.add(f, "changed", size, mtime, "forced")
+            else:
+                changed = self._index_says_changed(self.get_index_key(remote_dir / f), info)
+                if checksum and (changed is not False):
+                    checksum_fs[f] = (remote_dir / f, local_dir / f, info)
+                    continue
+                reason = "sync index"
+                if changed is None:
+                    reason = "local mtime/size"
+                    changed = (local_files[f]["time"] < mtime) or (local_files[f]["size"] != size)
+                plan.add(f, "changed" if changed else "skipped", size, mtime, reason)
+        if len(checksum_fs):
+            changed = set(self.get_changed_by_checksum(checksum_fs))
+            for f, (_, _, info) in checksum_fs.items():
+                plan.add(f, "changed" if f in changed else "skipped", info["size"], info["time"], "checksum")
+        for f, info in local_files.items():
+            if (not info["isdir"]) and (not f in remote_files) and file_filter.selects(f):
+                plan.add(f, "deleted", info["size"], info["time"], "not on the remote")
+        return plan
+
+    def estimate_plan(self, plan: SyncPlan, n_workers: int | None = None) -> dict[str, float]:
+        """ SyncPlan.estimate with the round trip time measured in stats and the link speed and compression ratios recorded so far """
+        exec_latency = self.stats.snapshot()["latency"].get("exec")
+        # Starting a command is a channel open plus the exec request, two round trips
+        rtt = None if exec_latency is None else exec_latency["p50"] / 2
+        ratio = None
+        if self.adaptive_compression:
+            ratio = lambda relpath: self.compression_policy.expected_ratio(relpath) or 1.0
+        return plan.estimate(
+            rtt=rtt, bandwidth=self.compression_policy.link_speed,
+            n_workers=self.transfer_workers if n_workers is None else n_workers,
+            bundle_threshold=self.bundle_threshold, min_bundle_files=self.min_bundle_files, ratio=ratio,
+            )
+
+    def _bundle_download(self, remote_dir: Path, local_dir: Path, entries: list[PlanEntry], compress: str | None = "gz") -> int:
+        """ Stream entries (relative to remote_dir) down as one tar archive, returning the bytes received """
+        received = Stats()
+        with self.stats.timed("tar_stream", f"{len(entries)} files"):
+            stdin, stdout, stderr = self.remote.exec_command(tar_create_list_command(remote_dir, compress=compress))
+            # tar starts writing before it has read every name, so the list goes in from a thread
+            with feeding_stdin(stdin, stdout, "".join(f"{e.relpath}\0" for e in entries)):
+                extract_tar_stream(CountingFile(stdout, received, "bytes"), local_dir, compress=compress)
+            status = stdout.channel.recv_exit_status()
+        n_bytes = received.counters.get("bytes", 0)
+        self.stats.count("bytes_down", n_bytes)
+        if status != 0:
+            raise RuntimeError(f"Remote tar exited with status {status}: {stderr.read().decode().strip()}")
+        self.stats.count("files_down", len(entries))
+        return n_bytes
+
+    def plan_upload(
+            self, arb_dir: Path,
+            exclude_fs: list[str] | None = None,
+            include_fs=None,
+            update_existing=True,
+            file_filter: FileFilter | None = None,
+            ) -> SyncPlan:
+        """
+        Work out what uploading arb_dir would do, from a parallel local scan and one remote listing.
+
+        Local files are "new" if the remote lacks them and, with update_existing, "changed" otherwise.
+        Without update_existing, remote copies of the same size that are not older are "skipped".
+        Remote files missing locally are listed as "deleted". file_filter prunes both sides the same way.
+        """
+        file_filter = self.get_file_filter(exclude_fs, include_fs, file_filter)
+        paths_filter = file_filter.paths_only()
+        local_dir, remote_dir = self.get_local_remote_from_arb(arb_dir)
+        exclude = ["._*"]
+        remote_files = self._remote_file_tree(remote_dir, manifest=True, file_filter=paths_filter)
+        plan = SyncPlan(local_dir, remote_dir, download=False)
+        seen = set()
+        for entry in scan_tree(local_dir, exclude=exclude, file_filter=paths_filter, follow_symlinks=True):
+            if entry.is_dir:
+                plan.dirs.append(entry.relpath)
+                continue
+            seen.add(entry.relpath)
+            mtime = datetime.fromtimestamp(entry.mtime)
+            remote = remote_files.get(entry.relpath)
+            if not file_filter.match_file(entry.relpath, entry.size, entry.mtime):
+                plan.add(entry.relpath, "skipped", entry.size, mtime, "excluded")
+            elif remote is None:
+                plan.add(entry.relpath, "new", entry.size, mtime, "not on the remote")
+            elif update_existing:
+                plan.add(entry.relpath, "changed", entry.size, mtime, "forced")
+            elif (remote["size"] != entry.size) or (remote["time"].timestamp() < int(entry.mtime)):
+                plan.add(entry.relpath, "changed", entry.size, mtime, "remote mtime/size")
+            else:
+                plan.add(entry.relpath, "skipped", entry.size, mtime, "remote mtime/size")
+        for f, info in remote_files.items():
+            if (not info["isdir"]) and (not f in seen) and not any(is_excluded(part, exclude) for part in f.split("/")):
+                plan.add(f, "deleted", info["size"], info["time"], "not local")
+        return plan
+
+    def _bundle_upload(self, local_dir: Path, remote_dir: Path, entries: list[PlanEntry], compress: str | None = "gz") -> int:
+        """ Stream entries (relative to local_dir) up as one tar archive extracted into remote_dir, returning the bytes sent """
+        sent = Stats()
+        with self.stats.timed("tar_stream", f"{len(entries)} files"):
+            stdin, stdout, stderr = self.remote.exec_command(tar_extract_command(remote_dir, compress=compress))
+            write_tar_stream_files(
+                CountingFile(stdin, sent, "bytes"), [(local_dir / e.relpath, e.relpath) for e in entries], compress=compress,
+                )
+            stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+        for e in entries:
+            self.remote.invalidate(remote_dir / e.relpath)
+        n_bytes = sent.counters.get("bytes", 0)
+        self.stats.count("bytes_up", n_bytes)
+        if status != 0:
+            raise RuntimeError(f"Remote tar exited with status {status}: {stderr.read().decode().strip()}")
+        self.stats.count("files_up", len(entries))
+        return n_bytes
+
+    def execute_plan(
+            self, plan: SyncPlan, p=True, n_workers: int | None = None, priority: list[str] | None = None,
+            bundle_threshold: int | None = None, min_bundle_files: int | None = None,
+            compress: str | None = "auto", delete: bool = False,
+            delta: bool = False, resume: bool = False, verify: bool = False,
+            ) -> TransferReport:
+        """
+        Carry out a SyncPlan (from plan_update or plan_upload) in the order given by plan.schedule.
+
+        Files steps are queued on a transfer engine and bundles stream through tar on this thread
+        at the same time. Files matching priority are started first. With delete, files the plan
+        lists as "deleted" are removed from the destination. bundle_threshold and min_bundle_files
+        default to the class attributes and compress applies to the bundles. With "auto", the
+        compression policy picks the codec for the link and then, bundle by bundle, stores the ones
+        made up mostly of file types that do not compress (see CompressionPolicy.bundle_codec).
+        The returned report breaks the transfers down into bundled and direct ones.
+        """
+        if bundle_threshold is None:
+            bundle_threshold = self.bundle_threshold
+        if min_bundle_files is None:
+            min_bundle_files = self.min_bundle_files
+        per_bundle = compress == "auto" and self.adaptive_compression
+        if compress == "auto":
+            compress = self.compression_policy.tar_codec()
+        src_dir, dst_dir = plan.src_dir, plan.dst_dir
+        remote_dir = src_dir if plan.download else dst_dir
+        steps = plan.schedule(bundle_threshold=bundle_threshold, min_bundle_files=min_bundle_files, priority=priority)
+        report_progress(p, "plan", str(plan), plan=plan, steps=steps)
+        if plan.download:
+            for d in [""] + plan.dirs:
+                (dst_dir / d).mkdir(parents=True, exist_ok=True)
+            # Skipped files were found to match their remote copy, which saves the comparison next time
+            self.sync_index.update({
+                self.get_index_key(remote_dir / e.relpath): {"isdir": False, "size": e.size, "mtime": e.time.timestamp()}
+                for e in plan.skipped if e.reason != "excluded"
+            })
+        else:
+            for result in self.remote.batch([("mkdir", dst_dir / d) for d in [""] + plan.dirs]):
+                if not result["ok"]:
+                    report_progress(p, "error", f"Error making {result['path']}: {result['error']}", always=True, **result)
+        with self.get_transfer_engine(n_workers=n_workers, p=p, resume=resume, verify=verify) as engine:
+            engine.report.settings = {"bundle_threshold": bundle_threshold, "min_bundle_files": min_bundle_files}
+            for step in steps:
+                if step.kind == "files":
+                    for e in step.entries:
+                        if plan.download:
+                            self._submit_indexed_download(engine, src_dir / e.relpath, dst_dir / e.relpath, e.info, delta=delta)
+                        else:
+                            engine.submit_upload(src_dir / e.relpath, dst_dir / e.relpath)
+                    continue
+                report_progress(
+                    p, "transfer", f"{src_dir} --> {dst_dir} ({len(step.entries)} files bundled)",
+                    src=src_dir, dst=dst_dir, files=[e.relpath for e in step.entries], download=plan.download,
+                    )
+                label = f"{src_dir} (bundle of {len(step.entries)} files)"
+                codec = compress
+                if per_bundle:
+                    # Only local files (uploads) can be sampled, remote ones are judged by name and learned ratios
+                    codec = self.compression_policy.bundle_codec(
+                        [(src_dir / e.relpath, e.size) for e in step.entries], compress, sample=not plan.download,
+                        )
+                try:
+                    if plan.download:
+                        n_bytes = self._bundle_download(src_dir, dst_dir, step.entries, compress=codec)
+                    else:
+                        n_bytes = self._bundle_upload(src_dir, dst_dir, step.entries, compress=codec)
+                except Exception as e:
+                    report_progress(p, "error", f"Error transferring {label}: {e}", always=True, error=e)
+                    engine.report.add(label, error=e)
+                    continue
+                engine.report.add(label, n_bytes, n_files=len(step.entries), mode="bundle")
+                if plan.download:
+                    self.sync_index.update({
+                        self.get_index_key(remote_dir / e.relpath): {"isdir": False, "size": e.size, "mtime": e.time.timestamp()}
+                        for e in step.entries
+                    })
+            report = engine.wait()
+        if delete and len(plan.deleted):
+            if plan.download:
+                for e in plan.deleted:
+                    self.local.rm(dst_dir / e.relpath)
+            else:
+                self.remote.batch([("rm", dst_dir / e.relpath) for e in plan.deleted])
+        if plan.download:
+            self.sync_index.set_synced_many([self.get_index_key(dst_dir / d) for d in [""] + plan.dirs])
+        self._record_report(report)
+        report_progress(p, "report", str(report), report=report)
+        return report
+
     def get_dir_updated_timestamp(self, local_path: Path):
+        last_updated = self.sync_index.get_synced(self.get_index_key(local_path))
         fname = local_path / "last_updated.txt"
-        last_updated = None
-        if fname.exists():
+        if last_updated is None and fname.exists():
+            # Marker written by older versions into the data directory
             timestamp = ""
             with open(fname, "r") as f:
                 for line in f:
@@ -312,30 +1216,24 @@ class PathRootPair:
 
     def get_slurm_job_history(self, days=1):
         return self.access_job_cache(days=days)
-    
-    def _get_slurm_jobs_history(self, days=1):
-        user = self.get_user()
-        cmd = f'sacct -X -u {user} -S $(date -d "{days} days ago" +%D-%R) --format=jobname%-100,workdir%-200,jobid,state,elapsed'
-        out = self.remote.run(cmd).strip().split("\n")[2:]
-        slurm_jobs = {}
-        for line in out:
-            path, info = self.parse_slurm_line(line)
-            if not path in slurm_jobs:
-                slurm_jobs[path] = []
-            slurm_jobs[path].append(info)
-        return slurm_jobs
+
+    @property
+    def job_store(self) -> JobStore:
+        """ Incrementally polled index of this user's Slurm jobs on the remote """
+        if self._job_store is None:
+            user = self.remote.username if not self.remote.username is None else self.get_user()
+            history = JobHistory() if self.persist_job_history else None
+            self._job_store = JobStore(
+                lambda cmd: self.remote.run(cmd), user, refresh_time=self.job_cache_refresh_time,
+                history=history, cluster=f"{user}@{self.remote.hostname}",
+                )
+        return self._job_store
     
     def update_job_cache(self, days=1):
-        self.job_cache[str(days)] = {
-            "slurm_jobs": self._get_slurm_jobs_history(days=days),
-            "time": time.time()
-        }
+        self.job_store.refresh(days=days, force=True)
 
     def access_job_cache(self, days=1):
-        cur_time = time.time()
-        if (str(days) not in self.job_cache) or ((cur_time - self.job_cache[str(days)]["time"]) > self.job_cache_refresh_time):
-            self.update_job_cache(days=days)
-        return self.job_cache[str(days)]["slurm_jobs"]
+        return self.job_store.get_history(days=days)
     
     def get_job_state(self, path: Path, check_days=3) -> str | None:
         """ Get the slurm STATE of a job associated with a local or remote path """
@@ -349,68 +1247,168 @@ class PathRootPair:
     def get_job_states(self, path: Path, check_days=3) -> str | None:
         """ Get the slurm STATE of a job associated with a local or remote path """
         path = str(self.get_local_remote_from_arb(path)[1])
-        slurm_jobs_history = self.get_slurm_jobs_history(days=check_days)
+        slurm_jobs_history = self.get_slurm_job_history(days=check_days)
         curstates = []
         if path in slurm_jobs_history:
             curstates = [slurm_jobs_history[path][i]["state"] for i in range(len(slurm_jobs_history[path]))]
         return curstates
     
+    def get_active_job_state(self, path: Path, check_days=3) -> str | None:
+        """ get_job_state, or the squeue state when use_squeue is set (pending/running jobs only) """
+        if not self.use_squeue:
+            return self.get_job_state(path, check_days=check_days)
+        return self.job_store.get_active_state(str(self.get_local_remote_from_arb(path)[1]))
+
     def path_is_currently_running(self, path: Path, check_days=3):
-        curstate = self.get_job_state(path, check_days=check_days)
+        curstate = self.get_active_job_state(path, check_days=check_days)
         if curstate is None:
             return False
         else:
             return "RUNNING" in curstate
 
     def path_is_currently_pending(self, path: Path, check_days=3):
-        curstate = self.get_job_state(path, check_days=check_days)
+        curstate = self.get_active_job_state(path, check_days=check_days)
         if curstate is None:
             return False
         else:
             return "PENDING" in curstate
 
     def path_is_on_slurm_queue(self, path: Path, check_days=3):
-        return self.get_job_state(path, check_days=check_days) in ["PENDING", "RUNNING"]
+        return self.get_active_job_state(path, check_days=check_days) in ["PENDING", "RUNNING"]
     
-    def submit_local_path(self, arb_path: Path, check_days=3, force_submit=False, update_local=True, as_zip: bool = True):
+    def submit_local_path(self, arb_path: Path, check_days=3, force_submit=False, update_local=True, as_zip: bool = True, p=True):
         local_path, remote_path = self.get_local_remote_from_arb(arb_path)
         job_state = self.get_job_state(remote_path, check_days=check_days)
         if isinstance(job_state, str):
             if job_state == "RUNNING":
-                print(f"Job is currently running: {remote_path}")
+                report_progress(p, "job", f"Job is currently running: {remote_path}", path=remote_path, state=job_state)
                 return
             if job_state == "PENDING":
-                print(f"Job is currently pending: {remote_path}")
+                report_progress(p, "job", f"Job is currently pending: {remote_path}", path=remote_path, state=job_state)
                 if force_submit:
-                    print("Cancelling preexisting job")
-                    job_id = self.get_slurm_jobs(days=check_days)[remote_path]["jobid"]
-                    self.cancel_jobid(job_id)
+                    report_progress(p, "job", "Cancelling preexisting job", path=remote_path, state=job_state)
+                    job_id = self.get_slurm_jobs(days=check_days)[str(remote_path)]["jobid"]
+                    self.cancel_jobid(job_id, p=p)
                 else:
-                    print("Use force_submit=True to cancel preexisting job")
+                    report_progress(p, "job", "Use force_submit=True to cancel preexisting job", path=remote_path, state=job_state)
                     return
             if job_state == "COMPLETED":
-                print(f"Job is already completed: {remote_path}")
+                report_progress(p, "job", f"Job is already completed: {remote_path}", path=remote_path, state=job_state)
                 if force_submit:
-                    print("Resubmitting job")
+                    report_progress(p, "job", "Resubmitting job", path=remote_path, state=job_state)
                 else:
-                    print("Use force_submit=True to resubmit job")
+                    report_progress(p, "job", "Use force_submit=True to resubmit job", path=remote_path, state=job_state)
                     return
             if job_state == "TIMEOUT":
-                print(f"Job has timed out: {remote_path}")
+                report_progress(p, "job", f"Job has timed out: {remote_path}", path=remote_path, state=job_state)
                 if update_local:
-                    self.download_dir(arb_path, as_zip=as_zip)
-        self.upload_dir(local_path, as_zip=as_zip, update_existing=True)
-        self.submit_path_psubmit(remote_path)
+                    self.download_dir(arb_path, as_zip=as_zip, p=p)
+        self.upload_dir(local_path, as_zip=as_zip, update_existing=True, p=p)
+        self.submit_path_psubmit(remote_path, p=p)
 
 
-    def submit_path_psubmit(self, path: Path, slurm_file_name: str | None = None):
+    def submit_local_paths(
+            self, arb_paths: list[Path], check_days=3, force_submit=False, update_local=True,
+            as_zip: bool = True, compress: str | None = "gz", p=True,
+            ) -> dict[Path, dict]:
+        """
+        Bulk version of submit_local_path.
+
+        Job states come from one query, pending jobs being replaced are cancelled with one scancel,
+        every directory goes up in one tar stream and every sbatch runs from one remote script.
+        Returns {arb_path: {"jobid", "state", "skipped", "error"}} where state is the job state found
+        before submitting and skipped says why a path was not submitted (None if it was).
+        """
+        results = {}
+        slurm_jobs = self.get_slurm_jobs(days=check_days)
+        to_cancel = []
+        to_submit = []
+        for arb_path in arb_paths:
+            remote_path = self.get_local_remote_from_arb(arb_path)[1]
+            job = slurm_jobs.get(str(remote_path))
+            job_state = None if job is None else job["state"]
+            result = {"jobid": None, "state": job_state, "skipped": None, "error": None}
+            results[arb_path] = result
+            if job_state == "RUNNING":
+                result["skipped"] = "running"
+            elif job_state == "PENDING":
+                if force_submit:
+                    to_cancel.append(job["jobid"])
+                else:
+                    result["skipped"] = "pending (use force_submit=True to cancel and resubmit)"
+            elif job_state == "COMPLETED" and not force_submit:
+                result["skipped"] = "completed (use force_submit=True to resubmit)"
+            elif job_state == "TIMEOUT" and update_local:
+                self.download_dir(arb_path, as_zip=as_zip, p=p)
+            if result["skipped"] is None:
+                to_submit.append(arb_path)
+            else:
+                report_progress(p, "job", f"Skipping {remote_path}: {result['skipped']}", path=remote_path, **result)
+        if len(to_cancel):
+            self.cancel_jobid(" ".join(to_cancel), p=p)
+        self.tar_upload_many(to_submit, p=p, compress=compress, file_filter=self.get_file_filter())
+        for arb_path, submitted in zip(to_submit, self.submit_paths_psubmit(to_submit)):
+            results[arb_path]["jobid"] = submitted["jobid"]
+            results[arb_path]["error"] = submitted["error"]
+            report_progress(p, "job", f"{arb_path}: {submitted['output']}", path=arb_path, **submitted)
+        return results
+
+    def submit_path_psubmit(self, path: Path, slurm_file_name: str | None = None, p=True):
         path = str(self.get_local_remote_from_arb(path)[1])
         if slurm_file_name is None:
             slurm_file_name = self.slurm_file_name
-        print(self.remote.run(self.submit_command_template.format(path=path, slurm_file_name=slurm_file_name)))
+        output = self.remote.run(self.submit_command_template.format(path=path, slurm_file_name=slurm_file_name))
+        match = re.search(r"Submitted batch job (\d+)", output)
+        report_progress(p, "job", output.rstrip("\n"), path=path, jobid=None if match is None else match.group(1), output=output)
+        self._invalidate_jobs()
+
+    def submit_paths_psubmit(self, paths: list[Path], slurm_file_name: str | None = None) -> list[dict]:
+        """ Submit many paths from one remote script, returning {"jobid", "output", "error"} per path """
+        if not len(paths):
+            return []
+        if slurm_file_name is None:
+            slurm_file_name = self.slurm_file_name
+        lines = []
+        for i, path in enumerate(paths):
+            path = str(self.get_local_remote_from_arb(path)[1])
+            cmd = self.submit_command_template.format(path=path, slurm_file_name=slurm_file_name)
+            lines.append(f"printf '%s\\t' {i}; ({cmd}) 2>&1 | tr '\\n\\t' '  '; echo")
+        script = "\n".join(lines) + "\n"
+        with self.stats.timed("submit", f"{len(paths)} paths"):
+            stdin, stdout, _ = self.remote.exec_command("sh -s")
+            def feed():
+                # From a thread, since sbatch output for a long path list fills the channel window before the script is all written
+                stdin.write(script)
+                stdin.channel.shutdown_write()
+            feeder = threading.Thread(target=feed, daemon=True)
+            feeder.start()
+            out = stdout.read()
+            feeder.join()
+        self.stats.count("bytes_up", len(script))
+        self.stats.count("bytes_down", len(out))
+        results = [{"jobid": None, "output": "", "error": "no output"} for _ in paths]
+        for line in out.decode(errors="replace").split("\n"):
+            fields = line.split("\t", 1)
+            if len(fields) < 2 or not fields[0].isdigit():
+                continue
+            output = fields[1].strip()
+            match = re.search(r"Submitted batch job (\d+)", output)
+            results[int(fields[0])] = {
+                "jobid": None if match is None else match.group(1),
+                "output": output,
+                "error": None if not match is None else output,
+            }
+        self._invalidate_jobs()
+        return results
+
+    def cancel_jobid(self, jobid, p=True):
+        output = self.remote.run(f"scancel {jobid}")
+        report_progress(p, "job", output.rstrip("\n"), jobid=jobid, output=output)
+        self._invalidate_jobs()
 
-    def cancel_jobid(self, jobid):
-        print(self.remote.run(f"scancel {jobid}"))
+    def _invalidate_jobs(self):
+        if not self._job_store is None:
+            self._job_store.invalidate()
 
 
 
@@ -419,6 +1417,12 @@ class PathRootPair:
 class LocalPathRootPair:
     local1: PathRoot
     local2: PathRoot
+    # Threads copying files in sync_dir_contents/update_dir_contents/upload_recursive
+    copy_workers: int = 8
+    # Try a reflink (a copy-on-write clone, no data copied) before copying file contents
+    use_reflink: bool = True
+    # Written into every synced directory by write_dir_updated_timestamp, and never copied across
+    timestamp_file: str = "last_updated.txt"
 
     def __init__(self, local1: PathRoot, local2: PathRoot):
         self.local1 = local1
@@ -433,185 +1437,172 @@ class LocalPathRootPair:
     
     def get_local1_path(self, local2_path: str):
         """ Get local path from local2 path (<local2_root>/<path tree> -> <local_root>/<path tree>) """
-        local2_root = self.local2.root
-        local_root = self.local1.root
-        local2_path = local2_path.replace(local2_root, "")
-        local_path = opj(local_root, local2_path)
-        return local_path
+        return str(Path(self.local1.root) / Path(local2_path).relative_to(self.local2.root))
     
     def get_local2_path(self, local1_path: str):
         """ Get local2 path from local path (<local_root>/<path tree> -> <local2_root>/<path tree>) """
-        local1_root = self.local1.root
-        local2_root = self.local2.root
-        local1_path = local1_path.replace(local1_root, "")
-        local2_path = opj(local2_root, local1_path)
-        return local2_path
+        return str(Path(self.local2.root) / Path(local1_path).relative_to(self.local1.root))
         
     
     def download(self, local2_file_path: str, local1_dir_path: str | None = None, p=True):
         if local1_dir_path is None:
             local1_dir_path = self.get_local1_path(local2_file_path)
-        if p:
-            print(f"{local2_file_path} --> {local1_dir_path}")
+        report_progress(p, "transfer", f"{local2_file_path} --> {local1_dir_path}", src=local2_file_path, dst=local1_dir_path, download=True)
         cp(local2_file_path, local1_dir_path)
 
 
     def upload(self, local1_file_path, local2_dir_path: str | None = None, p=True):
         if local2_dir_path is None:
             local2_dir_path = self.get_local2_path(local1_file_path)
-        if p:
-            print(f"{local1_file_path} --> {local2_dir_path}")
+        report_progress(p, "transfer", f"{local1_file_path} --> {local2_dir_path}", src=local1_file_path, dst=local2_dir_path, download=False)
         cp(local1_file_path, local2_dir_path)
 
-    def upload_recursive(self, local1_file_path, p=True):
+    def upload_recursive(self, local1_file_path, p=True, exclude_fs: list[str] | None = None, n_workers: int | None = None):
         local2_dir_path = self.get_local2_path(local1_file_path)
         if not self.local2.ope(local2_dir_path):
             self.local2.mkdir(local2_dir_path)
-        for f in listdir(local1_file_path):
-            if isdir(opj(local1_file_path, f)):
-                self.upload_recursive(opj(local1_file_path, f), p=p)
-            else:
-                self.upload(opj(local1_file_path, f), local2_dir_path, p=p)
+        # Directories come out of the scan before their contents, so each one exists before its files are copied
+        with self.get_copy_engine(n_workers=n_workers, p=p) as engine:
+            for entry in scan_tree(local1_file_path, exclude=exclude_fs, follow_symlinks=True):
+                if entry.is_dir:
+                    self.local2.mkdir(self.get_local2_path(entry.path))
+                else:
+                    engine.submit_copy(entry.path, self.get_local2_path(entry.path))
+            report = engine.wait()
+        report_progress(p, "report", str(report), report=report)
+        return report
 
     def write_dir_updated_timestamp(self, path):
-        with open(opj(path, "last_updated.txt"), "w") as f:
+        with open(opj(path, self.timestamp_file), "w") as f:
             f.write(str(float(time.time())))
         f.close()
 
 
+    def get_copy_engine(self, n_workers: int | None = None, p=True) -> LocalCopyEngine:
+        """ LocalCopyEngine with the pair's defaults (use as a context manager, or close() it when done) """
+        return LocalCopyEngine(n_workers=self.copy_workers if n_workers is None else n_workers, reflink=self.use_reflink, p=p)
+
+    def _scan_pair(self, dir1, dir2, exclude_fs=None, exclude_dirs=None, include_fs=None, recursive=True):
+        """ Scan dir1 and dir2 at the same time, once each, into {relative path: ScanEntry} for both """
+        exclude_fs = list(exclude_fs or [])
+
+        def keep(entry):
+            if entry.is_dir:
+                return True
+            name = entry.relpath.rsplit("/", 1)[-1]
+            if name == self.timestamp_file or name in exclude_fs:
+                return False
+            return (include_fs is None) or (name in include_fs)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            scans = [pool.submit(scan_dir, d, exclude_dirs, recursive) for d in (dir1, dir2)]
+            return tuple({relpath: e for relpath, e in scan.result().items() if keep(e)} for scan in scans)
+
+    def _run_copies(self, copies: list[tuple[Path, Path]], p=True, n_workers: int | None = None) -> TransferReport:
+        with self.get_copy_engine(n_workers=n_workers, p=p) as engine:
+            for src, dst in copies:
+                engine.submit_copy(src, dst)
+            report = engine.wait()
+        if len(copies):
+            report_progress(p, "report", str(report), report=report)
+        return report
+
     def sync_dir_contents(
             self, local1_dir, local2_dir = None,
             exclude_fs: list[str] | None = None,
-            p=True, 
+            p=True,
             exclude_dirs=None,
             include_fs=None,
             recursive=True,
             force_download=False,
-            ):
-        if exclude_fs is None:
-            exclude_fs = []
+            n_workers: int | None = None,
+            ) -> TransferReport:
+        """
+        Two-way sync: whatever one side is missing is copied over, and of two differing copies the
+        newer wins (local2_dir's on a tie, or always with force_download).
+
+        Both trees are scanned once, concurrently, and compared on (size, mtime_ns). Copies keep
+        their mtimes, so files synced before compare equal and cost nothing beyond the scan.
+        """
         if local2_dir is None:
             local2_dir = self.get_local2_path(local1_dir)
-        self.update_dir_contents(local1_dir, local2_dir=local2_dir, exclude_fs=exclude_fs, include_fs=include_fs, recursive=recursive, force_download=force_download, p=p, exclude_dirs=exclude_dirs)
-        self.update_dir_contents(local2_dir, local2_dir=local1_dir, exclude_fs=exclude_fs, include_fs=include_fs, recursive=recursive, force_download=force_download, p=p, reverse=True, exclude_dirs=exclude_dirs)
-        
-                
-
-    def update_dir_contents_helper(
-            self, local1_dir: str, local2_dir: str, local1_ls_l: str, local2_ls_l:str,
-            exclude_fs: list[str] | None = None,
-            p=True, 
-            exclude_dirs=None,
-            include_fs=None,
-            recursive=True,
-            force_download=False,
-            reverse=False,
-            ):
-        if exclude_fs is None:
-            exclude_fs = []
-        if exclude_dirs is None:
-            exclude_dirs = []
-        local1_files = list(local1_ls_l.keys())
-        download_fs = list(local2_ls_l.keys())
-        download_fs = [f for f in download_fs if not local2_ls_l[f]["isdir"]]
-        download_fs = [f for f in download_fs if not f in exclude_fs]
-        if not include_fs is None:
-            download_fs = [f for f in download_fs if f in include_fs]
-        need_fs = [f for f in download_fs if (not f in local1_files)]
-        update_fs = [f for f in download_fs if not f in need_fs]
-        if not force_download:
-            _update_fs = []
-            for f in update_fs:
-                local1_time = datetime.fromtimestamp(getatime(opj(local1_dir, f)))
-                local1_time = datetime(local1_time.year, local1_time.month, local1_time.day, local1_time.hour, local1_time.minute)
-                local2_time = datetime.fromtimestamp(getatime(opj(local2_dir, f)))
-                local2_time = datetime(local2_time.year, local2_time.month, local2_time.day, local2_time.hour, local2_time.minute)
-                local1_size = os.path.getsize(opj(local1_dir, f))
-                local2_size = os.path.getsize(opj(local2_dir, f))
-                outdated = local1_time < local2_time
-                dif_size = local1_size != int(local2_size)
-                if outdated or dif_size:
-                    _update_fs.append(f)
-            update_fs = _update_fs
-        if len(need_fs) or len(update_fs):
-            print(f"Updating {local2_dir} --> {local1_dir}")
-            print(f"Updating files {update_fs}")
-            print(f"Downloading files {need_fs}")
-            download_fs = update_fs + need_fs
-            for f in download_fs:
-                self.download(opj(local2_dir, f), local1_dir, p=p)
-        self.write_dir_updated_timestamp(local1_dir)
-        if recursive:
-            local2_dirs = [f for f in local2_ls_l if local2_ls_l[f]["isdir"]]
-            for d in local2_dirs:
-                if not d in exclude_dirs:
-                    if not reverse:
-                        self.update_dir_contents(
-                            self.local1.pcat(local1_dir, [d], force=True),
-                            self.local2.pcat(local2_dir, [d], force=False),
-                            exclude_fs=exclude_fs,
-                            exclude_dirs=exclude_dirs,
-                            include_fs=include_fs,
-                            recursive=recursive,
-                            force_download=force_download,
-                            p=p,
-                            reverse=reverse,
-                            )
-                    else:
-                        self.update_dir_contents(
-                            self.local2.pcat(local1_dir, [d], force=True),
-                            self.local1.pcat(local2_dir, [d], force=False),
-                            exclude_fs=exclude_fs,
-                            exclude_dirs=exclude_dirs,
-                            include_fs=include_fs,
-                            recursive=recursive,
-                            force_download=force_download,
-                            p=p,
-                            reverse=reverse,
-                            )
-        
+        local1_dir, local2_dir = Path(local1_dir), Path(local2_dir)
+        for d in (local1_dir, local2_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        one, two = self._scan_pair(local1_dir, local2_dir, exclude_fs=exclude_fs, exclude_dirs=exclude_dirs, include_fs=include_fs, recursive=recursive)
+        to1, to2, dirs = [], [], []
+        for relpath in sorted(one.keys() | two.keys()):
+            e1, e2 = one.get(relpath), two.get(relpath)
+            if (not e1 is None) and (not e2 is None) and e1.is_dir != e2.is_dir:
+                report_progress(p, "error", f"Skipping {relpath}: a file on one side and a directory on the other", always=True, path=relpath)
+                continue
+            if (e2 if e1 is None else e1).is_dir:
+                dirs.append(relpath)
+            elif e1 is None:
+                to1.append(relpath)
+            elif e2 is None:
+                to2.append(relpath)
+            elif force_download:
+                to1.append(relpath)
+            elif (e1.size, e1.mtime_ns) != (e2.size, e2.mtime_ns):
+                (to2 if e1.mtime_ns > e2.mtime_ns else to1).append(relpath)
+        for relpath in dirs:
+            (local1_dir / relpath).mkdir(parents=True, exist_ok=True)
+            (local2_dir / relpath).mkdir(parents=True, exist_ok=True)
+        if len(to1):
+            report_progress(p, "plan", f"Updating {local2_dir} --> {local1_dir}\nCopying files {to1}", src=local2_dir, dst=local1_dir, files=to1)
+        if len(to2):
+            report_progress(p, "plan", f"Updating {local1_dir} --> {local2_dir}\nCopying files {to2}", src=local1_dir, dst=local2_dir, files=to2)
+        copies = [(local2_dir / r, local1_dir / r) for r in to1] + [(local1_dir / r, local2_dir / r) for r in to2]
+        report = self._run_copies(copies, p=p, n_workers=n_workers)
+        for d in [""] + dirs:
+            self.write_dir_updated_timestamp(local1_dir / d)
+            self.write_dir_updated_timestamp(local2_dir / d)
+        return report
 
     def update_dir_contents(
             self, local1_dir, local2_dir = None,
             exclude_fs: list[str] | None = None,
-            p=True, 
+            p=True,
             exclude_dirs=None,
             include_fs=None,
             recursive=True,
             force_download=False,
             reverse=False,
-            ):
-        if exclude_fs is None:
-            exclude_fs = []
-        if exclude_dirs is None:
-            exclude_dirs = []
-        if not reverse:
-            if local2_dir is None:
-                local2_dir = self.get_local2_path(local1_dir)
-            if not self.local1.ope(local1_dir):
-                self.local1.mkdir(local1_dir)
-            local2_ls_l = self.local2.get_ls_l_file_info(local2_dir)
-            local1_ls_l = self.local1.get_ls_l_file_info(local1_dir)
-        else:
-            if local2_dir is None:
-                local2_dir = self.get_local1_path(local2_dir)
-            if not self.local1.ope(local2_dir):
-                self.local1.mkdir(local2_dir)
-            local1_ls_l = self.local2.get_ls_l_file_info(local1_dir)
-            local2_ls_l = self.local1.get_ls_l_file_info(local2_dir)
-        self.update_dir_contents_helper(
-            local1_dir, local2_dir, local1_ls_l, local2_ls_l,
-            exclude_fs=exclude_fs,
-            exclude_dirs=exclude_dirs,
-            include_fs=include_fs,
-            recursive=recursive,
-            force_download=force_download,
-            p=p,
-            reverse=reverse,
-        )
+            n_workers: int | None = None,
+            ) -> TransferReport:
+        """
+        One-way update of local1_dir from local2_dir (with reverse, local1_dir is below local2's root
+        and local2_dir below local1's). Files that local1_dir is missing, has at a different size or
+        has older are copied (all of them with force_download), after one concurrent scan of both trees.
+        """
+        if local2_dir is None:
+            local2_dir = self.get_local1_path(local1_dir) if reverse else self.get_local2_path(local1_dir)
+        dst_dir, src_dir = Path(local1_dir), Path(local2_dir)
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        dst, src = self._scan_pair(dst_dir, src_dir, exclude_fs=exclude_fs, exclude_dirs=exclude_dirs, include_fs=include_fs, recursive=recursive)
+        dirs, need_fs, update_fs = [], [], []
+        for relpath, entry in sorted(src.items()):
+            if entry.is_dir:
+                dirs.append(relpath)
+            elif not relpath in dst:
+                need_fs.append(relpath)
+            elif force_download or entry.size != dst[relpath].size or entry.mtime_ns > dst[relpath].mtime_ns:
+                update_fs.append(relpath)
+        for relpath in dirs:
+            (dst_dir / relpath).mkdir(parents=True, exist_ok=True)
+        if len(need_fs) or len(update_fs):
+            report_progress(
+                p, "plan", f"Updating {src_dir} --> {dst_dir}\nUpdating files {update_fs}\nDownloading files {need_fs}",
+                src=src_dir, dst=dst_dir, update=update_fs, new=need_fs,
+                )
+        report = self._run_copies([(src_dir / r, dst_dir / r) for r in update_fs + need_fs], p=p, n_workers=n_workers)
+        for d in [""] + dirs:
+            self.write_dir_updated_timestamp(dst_dir / d)
+        return report
 
     def get_dir_updated_timestamp(self, local1_path):
-        fname = opj(local1_path, "last_updated.txt")
+        fname = opj(local1_path, self.timestamp_file)
         last_updated = None
         if ope(fname):
             timestamp = ""
@@ -627,7 +1618,7 @@ class LocalPathRootPair:
             return True
         else:
             cur = time.time()
-            last = self.get_dir_updated_timestamp(self, local1_path)
+            last = self.get_dir_updated_timestamp(local1_path)
             if last is None:
                 return True
             else:
@@ -0,0 +1,183 @@
+from __future__ import annotations
+from datetime import datetime
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import NamedTuple
+
+# What a plan does with each file: "new"/"changed" are transferred, "deleted" only exist at the
+# destination (and are only removed on request), "skipped" are left alone
+plan_actions = ["new", "changed", "deleted", "skipped"]
+
+
+class PlanEntry(NamedTuple):
+    """ One file of a SyncPlan, relative to the planned directory """
+    relpath: str
+    action: str
+    size: int
+    time: datetime | None
+    reason: str
+
+    @property
+    def info(self) -> dict:
+        """ The entry as a listing record ({"isdir", "size", "time"}) """
+        return {"isdir": False, "size": self.size, "time": self.time}
+
+
+class PlanStep(NamedTuple):
+    """ Scheduled unit of work: "bundle" (one archive stream) or "files" (individual parallel transfers) """
+    kind: str
+    entries: list[PlanEntry]
+    priority: bool
+
+    @property
+    def n_bytes(self) -> int:
+        return sum(e.size for e in self.entries)
+
+
+def matches_any(relpath: str, patterns: list[str]) -> bool:
+    """ Whether a relative path or its name matches any of the glob patterns """
+    name = relpath.rsplit("/", 1)[-1]
+    return any(fnmatch(relpath, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+class SyncPlan:
+    """
+    Everything a sync of one directory would do, worked out before anything moves.
+
+    entries holds one PlanEntry per file seen on either side (relative paths, with the size and
+    mtime of the source copy, or of the destination copy for "deleted") and dirs the source
+    directories the destination needs. A plan can be inspected, printed, priced with estimate()
+    and broken into transfer steps with schedule() before PathRootPair.execute_plan runs it.
+    """
+    # Round trips per file moved over SFTP (open, stat, read, close) and per archive stream (channel open, exec)
+    file_round_trips: int = 4
+    stream_round_trips: int = 2
+    # Link assumed by estimate() when nothing has been measured
+    default_rtt: float = 0.05
+    default_bandwidth: float = 1e7
+
+    def __init__(self, src_dir: Path, dst_dir: Path, download: bool = True):
+        self.src_dir = Path(src_dir)
+        self.dst_dir = Path(dst_dir)
+        self.download = download
+        self.entries: list[PlanEntry] = []
+        self.dirs: list[str] = []
+
+    def add(self, relpath: str, action: str, size: int = 0, time: datetime | None = None, reason: str = ""):
+        if not action in plan_actions:
+            raise ValueError(f"Unknown plan action {action} (options are {plan_actions})")
+        self.entries.append(PlanEntry(relpath, action, int(size), time, reason))
+
+    def by_action(self, action: str) -> list[PlanEntry]:
+        return [e for e in self.entries if e.action == action]
+
+    @property
+    def new(self) -> list[PlanEntry]:
+        return self.by_action("new")
+
+    @property
+    def changed(self) -> list[PlanEntry]:
+        return self.by_action("changed")
+
+    @property
+    def deleted(self) -> list[PlanEntry]:
+        return self.by_action("deleted")
+
+    @property
+    def skipped(self) -> list[PlanEntry]:
+        return self.by_action("skipped")
+
+    @property
+    def to_transfer(self) -> list[PlanEntry]:
+        return [e for e in self.entries if e.action in ("new", "changed")]
+
+    @property
+    def n_bytes(self) -> int:
+        """ Bytes the plan would transfer """
+        return sum(e.size for e in self.to_transfer)
+
+    def summary(self) -> dict[str, dict[str, int]]:
+        """ {action: {"files", "bytes"}} """
+        summary = {action: {"files": 0, "bytes": 0} for action in plan_actions}
+        for e in self.entries:
+            summary[e.action]["files"] += 1
+            summary[e.action]["bytes"] += e.size
+        return summary
+
+    def __str__(self):
+        arrow = f"{self.src_dir} --> {self.dst_dir}"
+        counts = ", ".join(
+            f"{s['files']} {action} ({s['bytes'] / 1e6:.2f} MB)" for action, s in self.summary().items()
+        )
+        return f"Plan {arrow}: {counts}"
+
+    def schedule(
+            self, bundle_threshold: int | None = 1 << 20, min_bundle_files: int = 8, priority: list[str] | None = None,
+            ) -> list[PlanStep]:
+        """
+        Break the transfers into steps, in the order they should be started.
+
+        Files matching priority (glob patterns on the relative path or name) go first. Within each
+        group, files smaller than bundle_threshold are bundled into one archive stream if there are
+        at least min_bundle_files of them, and the rest move individually, largest first so the
+        slowest transfers are not left until the end. Files steps come before the bundle of their
+        group since they are only queued, while a bundle streams in the foreground.
+        """
+        transfers = self.to_transfer
+        groups = [(False, transfers)]
+        if priority:
+            groups = [
+                (True, [e for e in transfers if matches_any(e.relpath, priority)]),
+                (False, [e for e in transfers if not matches_any(e.relpath, priority)]),
+            ]
+        steps = []
+        for is_priority, entries in groups:
+            small = []
+            if not bundle_threshold is None:
+                small = [e for e in entries if e.size < bundle_threshold]
+            if len(small) < max(1, min_bundle_files):
+                small = []
+            bundled = {e.relpath for e in small}
+            large = sorted([e for e in entries if not e.relpath in bundled], key=lambda e: -e.size)
+            if len(large):
+                steps.append(PlanStep("files", large, is_priority))
+            if len(small):
+                steps.append(PlanStep("bundle", small, is_priority))
+        return steps
+
+    def estimate(
+            self, rtt: float | None = None, bandwidth: float | None = None, n_workers: int = 4,
+            bundle_threshold: int | None = 1 << 20, min_bundle_files: int = 8, ratio=None,
+            ) -> dict[str, float]:
+        """
+        Rough wall time in seconds of moving the plan file by file, as one bundle, and as scheduled.
+
+        Each file costs file_round_trips round trips spread over n_workers channels and each bundle
+        stream_round_trips, while all bytes share bandwidth (bytes per second). ratio(relpath)
+        gives the compressed / original size expected for a file in a bundle (default 1).
+        """
+        rtt = self.default_rtt if rtt is None else rtt
+        bandwidth = self.default_bandwidth if bandwidth is None else bandwidth
+        ratio = (lambda relpath: 1.0) if ratio is None else ratio
+        n_workers = max(1, n_workers)
+        transfers = self.to_transfer
+
+        def files_latency(entries):
+            return rtt * self.file_round_trips * len(entries) / n_workers
+
+        def bundle_bytes(entries):
+            return sum(e.size * ratio(e.relpath) for e in entries)
+
+        steps = self.schedule(bundle_threshold=bundle_threshold, min_bundle_files=min_bundle_files)
+        file_steps = [e for step in steps if step.kind == "files" for e in step.entries]
+        bundle_steps = [step for step in steps if step.kind == "bundle"]
+        wire_bytes = sum(e.size for e in file_steps) + sum(bundle_bytes(step.entries) for step in bundle_steps)
+        # Bundles stream while the individual files run on the workers, so their latencies overlap
+        scheduled_latency = max(files_latency(file_steps), rtt * self.stream_round_trips * len(bundle_steps))
+        return {
+            "per_file": files_latency(transfers) + self.n_bytes / bandwidth,
+            "bundle": (rtt * self.stream_round_trips + bundle_bytes(transfers) / bandwidth) if len(transfers) else 0.0,
+            "scheduled": scheduled_latency + wire_bytes / bandwidth,
+            "rtt": rtt,
+            "bandwidth": bandwidth,
+        }
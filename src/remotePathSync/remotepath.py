@@ -0,0 +1,312 @@
+from __future__ import annotations
+import errno
+import io
+import stat
+import threading
+import time
+from pathlib import PurePosixPath
+import paramiko
+
+
+class MetadataCache:
+    """
+    Remote stat results and directory listings, each kept for ttl seconds (0 turns caching off).
+
+    Entries are keyed by (kind, path): "stat" holds a SFTPAttributes (or None for a path that does
+    not exist) and "list" the names in a directory. invalidate drops what a write to a path makes
+    stale: the path itself, its parent's listing and, with recursive, everything below it.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._entries: dict[tuple[str, str], tuple[float, object]] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, kind: str, path: str) -> tuple[bool, object]:
+        """ (True, value) for a live entry, (False, None) otherwise """
+        with self._lock:
+            entry = self._entries.get((kind, path))
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._entries[(kind, path)]
+                return False, None
+            return True, entry[1]
+
+    def put(self, kind: str, path: str, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[(kind, path)] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, path: str, recursive: bool = False):
+        parent = str(PurePosixPath(path).parent)
+        prefix = path.rstrip("/") + "/"
+        with self._lock:
+            for key in [("stat", path), ("list", path), ("list", parent)]:
+                self._entries.pop(key, None)
+            if recursive:
+                for key in [key for key in self._entries if key[1].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+class RemoteFileReader(io.RawIOBase):
+    """
+    Read-only raw file over the PathRoot's shared SFTP channel.
+
+    Reads go out as pipelined SFTP requests (paramiko's readv), so a block costs about one round
+    trip whatever its size. Sequential reads grow the read-ahead window from one request (32 KiB)
+    up to read_ahead bytes, so peeking at a header stays cheap while reading a whole file still
+    moves in large blocks; a seek starts over from the small window. Reading past the size seen
+    at open time checks the size again, so files still being written can be followed.
+    """
+    min_window = 1 << 15
+
+    def __init__(self, root, path: str, read_ahead: int = 1 << 20):
+        self.root = root
+        self.path = path
+        self.read_ahead = max(read_ahead, self.min_window)
+        self._pos = 0
+        self._buffer = b""
+        self._buffer_start = 0
+        self._window = self.min_window
+        with root.shared_sftp() as sftp:
+            self._file = sftp.open(path, "rb")
+            attrs = self._file.stat()
+        self._size = attrs.st_size or 0
+        root.metadata.put("stat", path, attrs)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def size(self) -> int:
+        """ Current size of the remote file (asked again, not the size seen at open) """
+        with self.root.shared_sftp():
+            self._size = self._file.stat().st_size or 0
+        return self._size
+
+    def _fetch(self, chunks: list[tuple[int, int]]) -> list[bytes]:
+        # readv hands the ranges to a prefetch thread, and one it can't encode kills that thread
+        # while this one waits on its replies (holding the shared channel) for good
+        for offset, length in chunks:
+            if offset < 0 or length <= 0:
+                raise ValueError(f"invalid range ({offset}, {length}) of {self.path}")
+        with self.root.shared_sftp(), self.root.stats.timed("sftp_read", f"{self.path} ({len(chunks)} ranges)"):
+            data = [bytes(block) for block in self._file.readv(chunks)]
+        self.root.stats.count("bytes_down", sum(len(block) for block in data))
+        return data
+
+    def read_ranges(self, ranges: list[tuple[int, int]]) -> list[bytes]:
+        """ Bytes of each (offset, length) range (cut short at the end of the file), all requested at once """
+        for offset, length in ranges:
+            if offset < 0 or length < 0:
+                raise ValueError(f"invalid range ({offset}, {length}) of {self.path}")
+        size = self._size if all(offset + length <= self._size for offset, length in ranges) else self.size()
+        clipped = [(offset, max(0, min(length, size - offset))) for offset, length in ranges]
+        wanted = [chunk for chunk in clipped if chunk[1] > 0]
+        data = iter(self._fetch(wanted)) if len(wanted) else iter([])
+        return [next(data) if length > 0 else b"" for _, length in clipped]
+
+    def readinto(self, b) -> int:
+        n = len(b)
+        offset = self._pos - self._buffer_start
+        if not (0 <= offset < len(self._buffer)):
+            sequential = self._pos == self._buffer_start + len(self._buffer)
+            self._window = min(self._window * 2, self.read_ahead) if sequential else self.min_window
+            if self._pos + 1 > self._size:
+                self.size()
+            length = min(max(n, self._window), self._size - self._pos)
+            if length <= 0:
+                return 0
+            self._buffer = self._fetch([(self._pos, length)])[0]
+            self._buffer_start = self._pos
+            offset = 0
+        data = self._buffer[offset:offset + n]
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            with self.root.shared_sftp():
+                self._file.close()
+        super().close()
+
+
+class RemotePath:
+    """
+    pathlib-style handle on a path of a remote PathRoot (get one with PathRoot.path).
+
+    Nothing is fetched until asked for. stat, exists, is_dir, is_file and iterdir answer from the
+    root's MetadataCache while its entries are fresh, and iterdir caches the stat of every entry it
+    lists, so walking a directory and checking its files costs one round trip. Writes made through
+    the PathRoot and PathRootPair invalidate the entries they touch; changes made by anything else
+    (a running job) show up once the ttl has passed, or after invalidate().
+
+    open() streams the file over SFTP (see RemoteFileReader) and read_range/read_ranges fetch
+    slices, so headers, tails or pieces of large outputs can be read without downloading them.
+    """
+
+    def __init__(self, root, path):
+        self.root = root
+        self._path = PurePosixPath(str(path).replace("\\", "/"))
+
+    def __str__(self):
+        return str(self._path)
+
+    def __repr__(self):
+        return f"RemotePath('{self._path}')"
+
+    def __eq__(self, other):
+        return isinstance(other, RemotePath) and other.root is self.root and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __truediv__(self, other) -> RemotePath:
+        return RemotePath(self.root, self._path / str(other))
+
+    def joinpath(self, *others) -> RemotePath:
+        return RemotePath(self.root, self._path.joinpath(*[str(o) for o in others]))
+
+    @property
+    def name(self) -> str:
+        return self._path.name
+
+    @property
+    def suffix(self) -> str:
+        return self._path.suffix
+
+    @property
+    def stem(self) -> str:
+        return self._path.stem
+
+    @property
+    def parts(self) -> tuple[str, ...]:
+        return self._path.parts
+
+    @property
+    def parent(self) -> RemotePath:
+        return RemotePath(self.root, self._path.parent)
+
+    def with_name(self, name: str) -> RemotePath:
+        return RemotePath(self.root, self._path.with_name(name))
+
+    def with_suffix(self, suffix: str) -> RemotePath:
+        return RemotePath(self.root, self._path.with_suffix(suffix))
+
+    def relative_to(self, other) -> PurePosixPath:
+        return self._path.relative_to(str(other))
+
+    def _cached(self, kind: str, fetch):
+        found, value = self.root.metadata.lookup(kind, str(self))
+        self.root.stats.count("metadata_hits" if found else "metadata_misses")
+        if found:
+            return value
+        value = fetch()
+        self.root.metadata.put(kind, str(self), value)
+        return value
+
+    def stat(self) -> paramiko.SFTPAttributes:
+        """ SFTPAttributes (st_size, st_mtime, st_mode, ...) of the path, following symlinks """
+        def fetch():
+            with self.root.shared_sftp() as sftp:
+                try:
+                    return sftp.stat(str(self))
+                except FileNotFoundError:
+                    return None
+        attrs = self._cached("stat", fetch)
+        if attrs is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file or directory", str(self))
+        return attrs
+
+    def exists(self) -> bool:
+        try:
+            self.stat()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def is_dir(self) -> bool:
+        try:
+            return stat.S_ISDIR(self.stat().st_mode or 0)
+        except FileNotFoundError:
+            return False
+
+    def is_file(self) -> bool:
+        try:
+            return stat.S_ISREG(self.stat().st_mode or 0)
+        except FileNotFoundError:
+            return False
+
+    def iterdir(self):
+        """ Yield a RemotePath for everything in the directory, from one listing """
+        def fetch():
+            with self.root.shared_sftp() as sftp:
+                attrs = sftp.listdir_attr(str(self))
+            for a in attrs:
+                # Listings report symlinks as themselves, while stat follows them
+                if not stat.S_ISLNK(a.st_mode or 0):
+                    self.root.metadata.put("stat", str(self._path / a.filename), a)
+            return [a.filename for a in attrs]
+        for name in self._cached("list", fetch):
+            yield self / name
+
+    def invalidate(self):
+        """ Forget cached metadata of this path and everything below it """
+        self.root.invalidate(str(self), recursive=True)
+
+    def open(
+            self, mode: str = "rb", buffering: int = -1, encoding: str | None = None, errors: str | None = None,
+            newline: str | None = None, read_ahead: int | None = None,
+            ):
+        """ Open the file for streamed reading, in binary ("rb") or text ("r") mode """
+        if not mode in ("r", "rb", "rt"):
+            raise ValueError(f"RemotePath only opens files for reading, not mode {mode} (upload files through PathRootPair)")
+        raw = RemoteFileReader(self.root, str(self), read_ahead=self.root.read_ahead if read_ahead is None else read_ahead)
+        if buffering == 0:
+            if mode != "rb":
+                raise ValueError("can't have unbuffered text I/O")
+            return raw
+        buffered = io.BufferedReader(raw, buffer_size=io.DEFAULT_BUFFER_SIZE if buffering < 0 else buffering)
+        if mode == "rb":
+            return buffered
+        return io.TextIOWrapper(buffered, encoding=encoding, errors=errors, newline=newline)
+
+    def read_bytes(self) -> bytes:
+        with self.open("rb") as f:
+            return f.read()
+
+    def read_text(self, encoding: str | None = None, errors: str | None = None) -> str:
+        with self.open("r", encoding=encoding, errors=errors) as f:
+            return f.read()
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """ length bytes from offset (a negative offset counts from the end of the file, so read_range(-n, n) is the tail, or the whole file if shorter) """
+        return self.read_ranges([(offset, length)])[0]
+
+    def read_ranges(self, ranges: list[tuple[int, int]]) -> list[bytes]:
+        """ Several (offset, length) slices of the file, fetched in one pipelined exchange """
+        with RemoteFileReader(self.root, str(self)) as raw:
+            size = raw._size
+            return raw.read_ranges([(max(0, offset + size) if offset < 0 else offset, length) for offset, length in ranges])
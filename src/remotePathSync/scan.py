@@ -0,0 +1,95 @@
+from __future__ import annotations
+import os
+import queue
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import NamedTuple
+
+
+class ScanEntry(NamedTuple):
+    """ A file or directory found by scan_tree, with the stat fields the sync code compares """
+    path: str
+    relpath: str
+    is_dir: bool
+    size: int
+    mtime: float
+    mtime_ns: int
+
+
+def is_excluded(name: str, exclude: list[str]) -> bool:
+    """ Whether a file or directory name matches any of the exclude names / glob patterns """
+    return any(name == pattern or fnmatch(name, pattern) for pattern in exclude)
+
+
+def scan_tree(
+        root: Path | str, exclude: list[str] | str | None = None, n_workers: int = 8, file_filter=None,
+        follow_symlinks: bool = False,
+        ):
+    """
+    Yield a ScanEntry for everything below root, scanning directories concurrently with os.scandir.
+
+    Entries are streamed as each directory is read, so consumers can start work before the scan is
+    done. A directory is always yielded before anything inside it; beyond that the order is arbitrary.
+    Entries matching exclude (names or glob patterns) are skipped, and excluded directories are never
+    entered. Symlinks are reported as themselves and not followed, unless follow_symlinks is set:
+    then they are reported as what they point to, linked directories are entered (except links back
+    to a directory they are already inside, so link loops end) and broken links are skipped.
+    Unreadable directories are skipped the way os.walk skips them. A FileFilter prunes the directories and drops the files it rejects.
+    An exception raised while scanning (by file_filter, say) ends the scan and is raised to the consumer.
+    """
+    root = os.fspath(root)
+    exclude = [exclude] if isinstance(exclude, str) else list(exclude or [])
+    results = queue.Queue()
+    pool = ThreadPoolExecutor(max_workers=max(1, n_workers))
+
+    def scan(dirpath: str, reldir: str, ancestors: frozenset):
+        # ancestors holds the (st_dev, st_ino) of dirpath and the directories above it, when following links
+        entries, subdirs, error = [], [], None
+        try:
+            with os.scandir(dirpath) as it:
+                for e in it:
+                    if is_excluded(e.name, exclude):
+                        continue
+                    try:
+                        st = e.stat(follow_symlinks=follow_symlinks)
+                    except FileNotFoundError:
+                        continue
+                    relpath = f"{reldir}/{e.name}" if len(reldir) else e.name
+                    is_dir = stat.S_ISDIR(st.st_mode)
+                    if not file_filter is None:
+                        if not (file_filter.match_dir(relpath) if is_dir else file_filter.match_file(relpath, st.st_size, st.st_mtime)):
+                            continue
+                    key = (st.st_dev, st.st_ino)
+                    if is_dir and follow_symlinks and key in ancestors:
+                        continue
+                    entries.append(ScanEntry(e.path, relpath, is_dir, st.st_size, st.st_mtime, st.st_mtime_ns))
+                    if is_dir:
+                        subdirs.append((e.path, relpath, ancestors | {key} if follow_symlinks else ancestors))
+        except OSError:
+            pass
+        except BaseException as e:
+            error, subdirs = e, []
+        finally:
+            # Always answer (the consumer counts on one result per directory), and hand the entries
+            # over before the subdirectories are queued, so parents always come out first
+            results.put((entries, len(subdirs), error))
+        for sub in subdirs:
+            pool.submit(scan, *sub)
+
+    try:
+        ancestors = frozenset()
+        if follow_symlinks and os.path.isdir(root):
+            top = os.stat(root)
+            ancestors = frozenset([(top.st_dev, top.st_ino)])
+        pool.submit(scan, root, "", ancestors)
+        outstanding = 1
+        while outstanding:
+            entries, n_subdirs, error = results.get()
+            if not error is None:
+                raise error
+            outstanding += n_subdirs - 1
+            yield from entries
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,146 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+def default_cache_dir() -> Path:
+    """ Directory for remotePathSync state (REMOTEPATHSYNC_CACHE or ~/.cache/remotePathSync) """
+    cache_dir = os.environ.get("REMOTEPATHSYNC_CACHE")
+    if cache_dir is None:
+        cache_dir = Path.home() / ".cache" / "remotePathSync"
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+class SyncIndex:
+    """
+    Persistent record of the last known remote state of every file synced by a PathRootPair.
+
+    Entries are keyed by path relative to the remote root and store the remote size, mtime
+    (unix timestamp) and optional content hash. The database lives in the cache directory,
+    never inside the synced data directories.
+    """
+
+    def __init__(self, db_path: Path | str):
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._con:
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "relpath TEXT PRIMARY KEY, isdir INTEGER, size INTEGER, mtime REAL, hash TEXT)"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS synced (relpath TEXT PRIMARY KEY, time REAL)"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS local_hashes ("
+                "path TEXT, algorithm TEXT, inode INTEGER, size INTEGER, mtime_ns INTEGER, hash TEXT, "
+                "PRIMARY KEY (path, algorithm))"
+            )
+            self._con.execute(
+                "CREATE TABLE IF NOT EXISTS partials ("
+                "path TEXT, direction TEXT, size INTEGER, mtime REAL, offset INTEGER, "
+                "PRIMARY KEY (path, direction))"
+            )
+
+    @classmethod
+    def for_roots(cls, hostname: str | None, remote_root: Path | str, local_root: Path | str, cache_dir: Path | None = None):
+        """ Open the index belonging to a (hostname, remote root, local root) combination """
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        key = f"{hostname}:{Path(remote_root).as_posix()}:{Path(local_root).resolve().as_posix()}"
+        name = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return cls(Path(cache_dir) / f"sync_{name}.sqlite")
+
+    def get(self, relpath: str) -> dict | None:
+        with self._lock:
+            row = self._con.execute(
+                "SELECT isdir, size, mtime, hash FROM files WHERE relpath = ?", (relpath,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"isdir": bool(row[0]), "size": row[1], "mtime": row[2], "hash": row[3]}
+
+    def get_many(self, prefix: str = "") -> dict[str, dict]:
+        """ Return all entries at or below prefix """
+        query = "SELECT relpath, isdir, size, mtime, hash FROM files"
+        args = ()
+        if len(prefix):
+            query += " WHERE relpath = ? OR substr(relpath, 1, ?) = ?"
+            args = (prefix, len(prefix) + 1, prefix + "/")
+        with self._lock:
+            rows = self._con.execute(query, args).fetchall()
+        return {r[0]: {"isdir": bool(r[1]), "size": r[2], "mtime": r[3], "hash": r[4]} for r in rows}
+
+    def update(self, entries: dict[str, dict]):
+        """ Insert or replace entries ({relpath: {"isdir", "size", "mtime", "hash"}}) """
+        rows = [
+            (relpath, int(info.get("isdir", False)), info.get("size"), info.get("mtime"), info.get("hash"))
+            for relpath, info in entries.items()
+        ]
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+
+    def remove(self, relpaths: list[str]):
+        with self._lock, self._con:
+            self._con.executemany("DELETE FROM files WHERE relpath = ?", [(r,) for r in relpaths])
+
+    def set_synced(self, relpath: str, timestamp: float | None = None):
+        self.set_synced_many([relpath], timestamp=timestamp)
+
+    def set_synced_many(self, relpaths: list[str], timestamp: float | None = None):
+        """ Record that the directories at relpaths were synced at timestamp (default now) """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock, self._con:
+            self._con.executemany("INSERT OR REPLACE INTO synced VALUES (?, ?)", [(r, float(timestamp)) for r in relpaths])
+
+    def get_synced(self, relpath: str) -> float | None:
+        with self._lock:
+            row = self._con.execute("SELECT time FROM synced WHERE relpath = ?", (relpath,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_local_hash(self, path: str, stamp: tuple[int, int, int], algorithm: str) -> str | None:
+        """ Cached digest of a local file, if its (inode, size, mtime_ns) stamp has not changed """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT inode, size, mtime_ns, hash FROM local_hashes WHERE path = ? AND algorithm = ?", (path, algorithm)
+            ).fetchone()
+        if (row is None) or (tuple(row[:3]) != tuple(stamp)):
+            return None
+        return row[3]
+
+    def set_local_hash(self, path: str, stamp: tuple[int, int, int], algorithm: str, digest: str):
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO local_hashes VALUES (?, ?, ?, ?, ?, ?)", (path, algorithm, *stamp, digest)
+            )
+
+    def get_partial(self, path: str, direction: str) -> dict | None:
+        """ Progress of an interrupted transfer of path ("down" or "up"), with the source size/mtime it started from """
+        with self._lock:
+            row = self._con.execute(
+                "SELECT size, mtime, offset FROM partials WHERE path = ? AND direction = ?", (path, direction)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "mtime": row[1], "offset": row[2]}
+
+    def set_partial(self, path: str, direction: str, size: int, mtime: float, offset: int):
+        with self._lock, self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO partials VALUES (?, ?, ?, ?, ?)", (path, direction, size, mtime, offset)
+            )
+
+    def clear_partial(self, path: str, direction: str):
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM partials WHERE path = ? AND direction = ?", (path, direction))
+
+    def close(self):
+        self._con.close()
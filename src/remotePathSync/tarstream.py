@@ -0,0 +1,113 @@
+from __future__ import annotations
+import os
+import tarfile
+from pathlib import Path
+from remotePathSync.scan import scan_tree
+
+# compress argument -> (GNU tar flag, tarfile stream mode suffix)
+tar_codecs = {
+    None: ("", ""),
+    "gz": ("z", "gz"),
+    "bz2": ("j", "bz2"),
+    "xz": ("J", "xz"),
+}
+
+
+def _check_codec(compress: str | None):
+    if not compress in tar_codecs:
+        raise ValueError(f"Unknown compression {compress} (options are {list(tar_codecs)})")
+
+
+def tar_create_command(dir_path: Path, exclude_fs=None, include_fs=None, compress: str | None = "gz", file_filter=None) -> str:
+    """ Shell command writing a tar stream of dir_path (relative to its parent) to stdout, with a FileFilter replacing exclude_fs/include_fs """
+    _check_codec(compress)
+    flag = tar_codecs[compress][0]
+    parent, name = str(dir_path.parent), str(dir_path.name)
+    if not file_filter is None:
+        # find lists the directories too (so empty ones come across), tar must not recurse into them itself
+        listing = file_filter.find_expression(name, action="-print0")
+        return f"cd '{parent}' && find '{name}' {listing} | tar --null --no-recursion -c{flag}f - -T -"
+    if not include_fs is None:
+        include_fs = [include_fs] if isinstance(include_fs, str) else include_fs
+        names = " -o ".join(f"-name '{f}'" for f in include_fs)
+        return f"cd '{parent}' && find '{name}' -type f \\( {names} \\) -print0 | tar --null -c{flag}f - -T -"
+    cmd = f"tar -C '{parent}' -c{flag}f -"
+    if not exclude_fs is None:
+        exclude_fs = [exclude_fs] if isinstance(exclude_fs, str) else exclude_fs
+        for f in exclude_fs:
+            cmd += f" --exclude='{f}'"
+    return cmd + f" '{name}'"
+
+
+def tar_create_list_command(base: Path, compress: str | None = "gz", recursive: bool = True) -> str:
+    """ Shell command writing a tar stream of the null-separated paths (relative to base) read from stdin to stdout """
+    _check_codec(compress)
+    flags = "" if recursive else " --no-recursion"
+    return f"cd '{base}' && tar --null{flags} -c{tar_codecs[compress][0]}f - -T -"
+
+
+def tar_extract_command(parent: Path, compress: str | None = "gz") -> str:
+    """ Shell command extracting a tar stream from stdin into parent """
+    _check_codec(compress)
+    return f"mkdir -p '{parent}' && tar -C '{parent}' -x{tar_codecs[compress][0]}f -"
+
+
+def write_tar_stream(fileobj, dir_path: Path, exclude_fs=None, include_fs=None, compress: str | None = "gz", file_filter=None):
+    """ Write dir_path as a tar stream to fileobj, with the same exclude_fs/include_fs/file_filter semantics as tar_create_command """
+    write_tar_stream_many(
+        fileobj, [dir_path], Path(dir_path).parent, exclude_fs=exclude_fs, include_fs=include_fs, compress=compress, file_filter=file_filter,
+        )
+
+
+def write_tar_stream_many(
+        fileobj, dir_paths: list[Path], base: Path, exclude_fs=None, include_fs=None, compress: str | None = "gz", file_filter=None,
+        ):
+    """ Write several directories as one tar stream to fileobj, each stored under its path relative to base """
+    _check_codec(compress)
+    exclude_fs = [exclude_fs] if isinstance(exclude_fs, str) else (exclude_fs or [])
+    include_fs = [include_fs] if isinstance(include_fs, str) else include_fs
+    base = Path(base)
+    with tarfile.open(fileobj=fileobj, mode=f"w|{tar_codecs[compress][1]}") as tar:
+        for dir_path in dir_paths:
+            dir_path = Path(dir_path)
+            if not file_filter is None:
+                arcdir = dir_path.relative_to(base).as_posix()
+                tar.add(str(dir_path), arcname=arcdir, recursive=False)
+                # Parents come out of the scan before their contents, as tar extraction expects
+                for entry in scan_tree(dir_path, file_filter=file_filter):
+                    tar.add(entry.path, arcname=f"{arcdir}/{entry.relpath}", recursive=False)
+                continue
+            if include_fs is None:
+                tar.add(str(dir_path), arcname=dir_path.relative_to(base).as_posix(), recursive=False)
+            for dirpath, dirnames, filenames in os.walk(dir_path):
+                dirnames[:] = [d for d in dirnames if (not include_fs is None) or (not d in exclude_fs)]
+                rel = Path(dirpath).relative_to(base)
+                if include_fs is None:
+                    for d in dirnames:
+                        tar.add(os.path.join(dirpath, d), arcname=(rel / d).as_posix(), recursive=False)
+                for f in filenames:
+                    if include_fs is None and f in exclude_fs:
+                        continue
+                    if (not include_fs is None) and (not f in include_fs):
+                        continue
+                    tar.add(os.path.join(dirpath, f), arcname=(rel / f).as_posix(), recursive=False)
+
+
+def write_tar_stream_files(fileobj, files: list[tuple[Path, str]], compress: str | None = "gz"):
+    """ Write individual files, given as (local path, name in the archive), as one tar stream to fileobj """
+    _check_codec(compress)
+    with tarfile.open(fileobj=fileobj, mode=f"w|{tar_codecs[compress][1]}") as tar:
+        for path, arcname in files:
+            tar.add(str(path), arcname=arcname, recursive=False)
+
+
+def extract_tar_stream(fileobj, parent: Path, compress: str | None = "gz"):
+    """ Extract a tar stream from fileobj into parent as the bytes arrive """
+    _check_codec(compress)
+    Path(parent).mkdir(parents=True, exist_ok=True)
+    with tarfile.open(fileobj=fileobj, mode=f"r|{tar_codecs[compress][1]}") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(str(parent), filter="data")
+        else:
+            tar.extractall(str(parent))
+
@@ -0,0 +1,301 @@
+from __future__ import annotations
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from pathlib import Path
+import paramiko
+from remotePathSync.syncindex import SyncIndex
+from remotePathSync.hashing import hash_file
+from remotePathSync.instrument import Stats, report_progress
+
+
+def resumable_get(
+        sftp: paramiko.SFTPClient, remote_file: Path, local_file: Path, index: SyncIndex,
+        chunk_size: int = 1 << 23, remote_digest=None, algorithm: str = "sha256",
+        ) -> int:
+    """
+    Download remote_file into '<local_file>.part', recording the completed offset in index after every chunk.
+
+    A later call continues from the recorded offset as long as the remote size/mtime has not changed.
+    If remote_digest (() -> hex digest with algorithm) is given, the finished file is checked against it.
+    Returns the number of bytes moved by this call.
+    """
+    key = str(remote_file)
+    st = sftp.stat(key)
+    part_file = local_file.with_name(f"{local_file.name}.part")
+    offset = 0
+    record = index.get_partial(key, "down")
+    if (not record is None) and record["size"] == st.st_size and record["mtime"] == st.st_mtime and part_file.exists():
+        offset = min(record["offset"], part_file.stat().st_size)
+    local_file.parent.mkdir(parents=True, exist_ok=True)
+    start = offset
+    with open(part_file, "r+b" if offset else "wb") as out, sftp.open(key, "rb") as remote:
+        out.seek(offset)
+        out.truncate(offset)
+        remote.seek(offset)
+        remote.prefetch(st.st_size)
+        while offset < st.st_size:
+            data = remote.read(min(chunk_size, st.st_size - offset))
+            if not len(data):
+                raise EOFError(f"{remote_file} ended at {offset} of {st.st_size} bytes")
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+            offset += len(data)
+            index.set_partial(key, "down", st.st_size, st.st_mtime, offset)
+    if (not remote_digest is None) and hash_file(part_file, algorithm=algorithm) != remote_digest():
+        part_file.unlink()
+        index.clear_partial(key, "down")
+        raise RuntimeError(f"Digest of {local_file} does not match {remote_file} after transfer")
+    os.replace(part_file, local_file)
+    index.clear_partial(key, "down")
+    return offset - start
+
+
+def resumable_put(
+        sftp: paramiko.SFTPClient, local_file: Path, remote_file: Path, index: SyncIndex,
+        chunk_size: int = 1 << 23, remote_digest=None, algorithm: str = "sha256",
+        ) -> int:
+    """ Upload counterpart of resumable_get, writing to '<remote_file>.part' on the remote side """
+    key = str(local_file)
+    st = local_file.stat()
+    part_file = f"{remote_file}.part"
+    offset = 0
+    record = index.get_partial(key, "up")
+    if (not record is None) and record["size"] == st.st_size and record["mtime"] == st.st_mtime:
+        try:
+            offset = min(record["offset"], sftp.stat(part_file).st_size)
+        except FileNotFoundError:
+            offset = 0
+    start = offset
+    with open(local_file, "rb") as f, sftp.open(part_file, "r+" if offset else "w") as remote:
+        remote.set_pipelined(True)
+        remote.truncate(offset)
+        remote.seek(offset)
+        f.seek(offset)
+        for data in iter(lambda: f.read(chunk_size), b""):
+            remote.write(data)
+            remote.flush()
+            offset += len(data)
+            # On resume the offset is capped by the size of the remote .part file, so an optimistic record is safe
+            index.set_partial(key, "up", st.st_size, st.st_mtime, offset)
+    if (not remote_digest is None) and hash_file(local_file, algorithm=algorithm) != remote_digest(part_file):
+        sftp.remove(part_file)
+        index.clear_partial(key, "up")
+        raise RuntimeError(f"Digest of {remote_file} does not match {local_file} after transfer")
+    try:
+        sftp.posix_rename(part_file, str(remote_file))
+    except IOError:
+        try:
+            sftp.remove(str(remote_file))
+        except FileNotFoundError:
+            pass
+        sftp.rename(part_file, str(remote_file))
+    index.clear_partial(key, "up")
+    return offset - start
+
+
+class TransferReport:
+    """
+    Aggregate result of a batch of transfers run through a TransferEngine.
+
+    modes breaks the totals down by how files moved ("direct" per-file transfers, "bundle" archive
+    streams) and settings holds the thresholds that decided it, when the caller chose between them.
+    """
+
+    def __init__(self):
+        self.n_files = 0
+        self.n_bytes = 0
+        self.elapsed = 0.0
+        self.errors: dict[str, str] = {}
+        self.modes: dict[str, dict[str, int]] = {}
+        self.settings: dict = {}
+        self._lock = threading.Lock()
+
+    def add(self, path: str, n_bytes: int = 0, error: Exception | None = None, n_files: int = 1, mode: str = "direct"):
+        with self._lock:
+            if error is None:
+                self.n_files += n_files
+                self.n_bytes += n_bytes
+                totals = self.modes.setdefault(mode, {"files": 0, "bytes": 0})
+                totals["files"] += n_files
+                totals["bytes"] += n_bytes
+            else:
+                self.errors[path] = f"{type(error).__name__}: {error}"
+
+    @property
+    def throughput(self) -> float:
+        """ Bytes per second over the wall time of the batch """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.n_bytes / self.elapsed
+
+    @property
+    def file_rate(self) -> float:
+        """ Files per second over the wall time of the batch """
+        if self.elapsed <= 0:
+            return 0.0
+        return self.n_files / self.elapsed
+
+    def __str__(self):
+        msg = (
+            f"Transferred {self.n_files} files ({self.n_bytes / 1e6:.2f} MB) in {self.elapsed:.2f} s "
+            f"({self.throughput / 1e6:.2f} MB/s, {self.file_rate:.1f} files/s)"
+        )
+        if len(self.errors):
+            msg += f", {len(self.errors)} failed"
+        if len(self.settings) or len(self.modes) > 1:
+            modes = ", ".join(f"{totals['files']} {mode} ({totals['bytes'] / 1e6:.2f} MB)" for mode, totals in self.modes.items())
+            settings = ", ".join(f"{key}={value}" for key, value in self.settings.items())
+            msg += f" [{'; '.join(part for part in (modes, settings) if len(part))}]"
+        return msg
+
+
+class TransferEngine:
+    """
+    Run file transfers over N concurrent SFTP channels.
+
+    Each worker thread opens its own SFTP channel, round-robin over the given transports
+    (normally just the transport of the remote PathRoot's SSHClient).
+    If resume_index is given, files are moved in chunks through resumable_get/resumable_put
+    and remote_digest (remote path -> hex digest with digest_algorithm) optionally verifies every finished file.
+    p prints every transfer or, if callable, receives them as ProgressEvents. Channels, bytes, files and
+    per-file latencies are recorded in stats. on_upload, if given, is called with the remote path of
+    every upload once it has finished (or failed), e.g. to drop cached metadata of the path.
+    """
+
+    def __init__(
+            self, transports: list[paramiko.Transport], n_workers: int = 4, p=True,
+            resume_index: SyncIndex | None = None, chunk_size: int = 1 << 23, remote_digest=None,
+            digest_algorithm: str = "sha256", stats: Stats | None = None, on_upload=None,
+            ):
+        if not len(transports):
+            raise ValueError("TransferEngine needs at least one transport")
+        self.transports = transports
+        self.n_workers = max(1, n_workers)
+        self.p = p
+        self.resume_index = resume_index
+        self.chunk_size = chunk_size
+        self.remote_digest = remote_digest
+        self.digest_algorithm = digest_algorithm
+        self.stats = Stats() if stats is None else stats
+        self.on_upload = on_upload
+        self.report = TransferReport()
+        self._pool = ThreadPoolExecutor(max_workers=self.n_workers)
+        self._futures: list[Future] = []
+        self._local = threading.local()
+        self._sftps: list[paramiko.SFTPClient] = []
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def _sftp(self) -> paramiko.SFTPClient:
+        sftp = getattr(self._local, "sftp", None)
+        if sftp is None:
+            with self._lock:
+                transport = self.transports[len(self._sftps) % len(self.transports)]
+                sftp = paramiko.SFTPClient.from_transport(transport)
+                self._sftps.append(sftp)
+            self.stats.count("channels")
+            self._local.sftp = sftp
+        return sftp
+
+    def _get(self, remote_file: Path, local_file: Path):
+        try:
+            local_file.parent.mkdir(parents=True, exist_ok=True)
+            report_progress(self.p, "transfer", f"{remote_file} --> {local_file}", src=remote_file, dst=local_file, download=True)
+            sftp = self._sftp()
+            with self.stats.timed("sftp_get", str(remote_file)):
+                if self.resume_index is None:
+                    sftp.get(str(remote_file), str(local_file))
+                    n_bytes = local_file.stat().st_size
+                else:
+                    digest = None if self.remote_digest is None else (lambda: self.remote_digest(str(remote_file)))
+                    n_bytes = resumable_get(
+                        sftp, remote_file, local_file, self.resume_index,
+                        chunk_size=self.chunk_size, remote_digest=digest, algorithm=self.digest_algorithm,
+                        )
+            self.stats.count("bytes_down", n_bytes)
+            self.stats.count("files_down")
+            self.report.add(str(remote_file), n_bytes)
+            return True
+        except Exception as e:
+            report_progress(self.p, "error", f"Error downloading {remote_file}: {e}", always=True, path=remote_file, error=e)
+            self.report.add(str(remote_file), error=e)
+            return False
+
+    def _put(self, local_file: Path, remote_file: Path):
+        try:
+            report_progress(self.p, "transfer", f"{local_file} --> {remote_file}", src=local_file, dst=remote_file, download=False)
+            sftp = self._sftp()
+            with self.stats.timed("sftp_put", str(local_file)):
+                if self.resume_index is None:
+                    n_bytes = sftp.put(str(local_file), str(remote_file)).st_size or 0
+                else:
+                    n_bytes = resumable_put(
+                        sftp, local_file, remote_file, self.resume_index,
+                        chunk_size=self.chunk_size, remote_digest=self.remote_digest, algorithm=self.digest_algorithm,
+                        )
+            self.stats.count("bytes_up", n_bytes)
+            self.stats.count("files_up")
+            self.report.add(str(local_file), n_bytes)
+            return True
+        except Exception as e:
+            report_progress(self.p, "error", f"Error uploading {local_file}: {e}", always=True, path=local_file, error=e)
+            self.report.add(str(local_file), error=e)
+            return False
+        finally:
+            if not self.on_upload is None:
+                self.on_upload(remote_file)
+
+    def _call(self, label: str, fn, download: bool):
+        try:
+            sftp = self._sftp()
+            with self.stats.timed("sftp_task", label):
+                n_bytes = fn(sftp)
+            self.stats.count("bytes_down" if download else "bytes_up", n_bytes)
+            self.report.add(label, n_bytes)
+            return True
+        except Exception as e:
+            report_progress(self.p, "error", f"Error transferring {label}: {e}", always=True, path=label, error=e)
+            self.report.add(label, error=e)
+            return False
+
+    def submit_task(self, label: str, fn, download: bool = True) -> Future:
+        """ Run fn(sftp_client) -> bytes moved (in the direction given by download) on a worker, recording its result under label """
+        future = self._pool.submit(self._call, label, fn, download)
+        self._futures.append(future)
+        return future
+
+    def submit_download(self, remote_file: Path | str, local_file: Path | str) -> Future:
+        """ Download remote_file to local_file (the future resolves to True on success) """
+        future = self._pool.submit(self._get, Path(remote_file), Path(local_file))
+        self._futures.append(future)
+        return future
+
+    def submit_upload(self, local_file: Path | str, remote_file: Path | str) -> Future:
+        """ Upload local_file to remote_file (the remote parent directory must already exist, the future resolves to True on success) """
+        future = self._pool.submit(self._put, Path(local_file), Path(remote_file))
+        self._futures.append(future)
+        return future
+
+    def wait(self) -> TransferReport:
+        """ Block until every submitted transfer has finished and return the aggregate report """
+        wait(self._futures)
+        self._futures = []
+        self.report.elapsed = time.time() - self._start
+        return self.report
+
+    def close(self) -> TransferReport:
+        report = self.wait()
+        self._pool.shutdown()
+        for sftp in self._sftps:
+            sftp.close()
+        self._sftps = []
+        return report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,180 @@
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING
+from remotePathSync.instrument import report_progress
+
+if TYPE_CHECKING:
+    from remotePathSync.pathrootpair import PathRootPair
+
+# States a job does not leave again
+finished_states = [
+    "COMPLETED", "TIMEOUT", "FAILED", "OUT_OF_MEMORY", "NODE_FAIL", "CANCELLED", "PREEMPTED", "BOOT_FAIL", "DEADLINE",
+]
+
+
+class JobWatcher:
+    """
+    Watch the Slurm jobs of a set of paths and pull their results as soon as each one finishes.
+
+    Every poll refreshes the pair's job store once (one incremental sacct query for all paths) and
+    compares each path's latest state with the one seen before. A transition into one of
+    finished_states queues an incremental download_dir of that path on a small thread pool, so
+    finished jobs are synced while others are still running and while polling continues.
+
+    on_transition(path, old_state, new_state) is called for every state change and
+    on_synced(path, state, error) after each download (error is None if it succeeded). Failed
+    polls, and failed syncs without an on_synced, are reported through p (see report_progress).
+    Run it with start()/stop() on a background thread or await run() as an asyncio task.
+    """
+
+    def __init__(
+            self, pair: PathRootPair, paths: list[Path] | None = None,
+            interval: float = 60, check_days: float = 3,
+            on_transition=None, on_synced=None,
+            download_kwargs: dict | None = None, download_workers: int = 2,
+            include_finished: bool = False, untrack_synced: bool = True, p=True,
+            ):
+        self.pair = pair
+        self.p = p
+        self.interval = interval
+        self.check_days = check_days
+        self.on_transition = on_transition
+        self.on_synced = on_synced
+        # Incremental, file by file by default: only new or changed results come down
+        self.download_kwargs = {"as_zip": False, "update_existing": False, "p": False}
+        self.download_kwargs.update(download_kwargs or {})
+        # Also sync paths whose job had already finished when they were first seen
+        self.include_finished = include_finished
+        # Stop watching a path once its results were synced
+        self.untrack_synced = untrack_synced
+        self.states: dict[Path, str | None] = {}
+        self._seen: set[Path] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.download_workers = max(1, download_workers)
+        # Made on first use, and again after stop() shut the last one down
+        self._pool: ThreadPoolExecutor | None = None
+        self._pending = {}
+        for path in paths or []:
+            self.add(path)
+
+    def add(self, path: Path):
+        with self._lock:
+            self.states.setdefault(Path(path), None)
+
+    def remove(self, path: Path):
+        with self._lock:
+            self.states.pop(Path(path), None)
+            self._seen.discard(Path(path))
+
+    @property
+    def paths(self) -> list[Path]:
+        with self._lock:
+            return list(self.states)
+
+    def poll(self) -> dict[Path, tuple[str | None, str | None]]:
+        """ Check every watched path once, queue syncs for finished jobs and return {path: (old, new)} for the ones that changed """
+        self.pair.job_store.refresh(days=self.check_days, force=True)
+        slurm_jobs = self.pair.get_slurm_jobs(days=self.check_days, exclude_cancelled=False)
+        changes = {}
+        for path in self.paths:
+            job = slurm_jobs.get(str(self.pair.get_local_remote_from_arb(path)[1]))
+            new = None if job is None else job["state"]
+            with self._lock:
+                if not path in self.states:
+                    continue
+                old = self.states[path]
+                first = not path in self._seen
+                self._seen.add(path)
+                self.states[path] = new
+            if (new == old) and not first:
+                continue
+            if not first or new != old:
+                changes[path] = (old, new)
+                if not self.on_transition is None:
+                    self.on_transition(path, old, new)
+            if (new in finished_states) and (not first or self.include_finished):
+                self._queue_sync(path, new)
+        return changes
+
+    def _queue_sync(self, path: Path, state: str):
+        with self._lock:
+            if path in self._pending:
+                return
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.download_workers)
+            future = self._pool.submit(self._sync, path, state)
+            self._pending[path] = future
+        # Registered before the callback can run, so even a sync that failed at once clears its entry
+        future.add_done_callback(lambda f: self._finish_sync(path, f))
+
+    def _finish_sync(self, path: Path, future):
+        with self._lock:
+            if self._pending.get(path) is future:
+                del self._pending[path]
+
+    def _shutdown_pool(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if not pool is None:
+            pool.shutdown(wait=wait)
+
+    def _sync(self, path: Path, state: str):
+        error = None
+        try:
+            self.pair.download_dir(path, **self.download_kwargs)
+        except Exception as e:
+            error = e
+        if error is None and self.untrack_synced:
+            self.remove(path)
+        if not self.on_synced is None:
+            self.on_synced(path, state, error)
+        elif not error is None:
+            report_progress(self.p, "error", f"Syncing {path} ({state}) failed: {error}", always=True, path=path, state=state, error=error)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                report_progress(self.p, "error", f"Job watcher poll failed: {e}", always=True, error=e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """ Poll every interval seconds on a background thread """
+        if (not self._thread is None) and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True):
+        """ Stop polling (and with wait, let queued syncs finish); start() can be called again afterwards """
+        self._stop.set()
+        if wait and (not self._thread is None):
+            self._thread.join()
+        self._shutdown_pool(wait=wait)
+
+    async def run(self):
+        """ Poll every interval seconds until cancelled, for use as an asyncio task """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    await loop.run_in_executor(None, self.poll)
+                except Exception as e:
+                    report_progress(self.p, "error", f"Job watcher poll failed: {e}", always=True, error=e)
+                await asyncio.sleep(self.interval)
+        finally:
+            await loop.run_in_executor(None, self._shutdown_pool)
+
+    def wait_idle(self):
+        """ Block until every queued sync has finished """
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result()